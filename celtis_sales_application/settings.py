@@ -43,6 +43,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'sales.middleware.StaticFilesMiddleware',
+    # ahead of the rest, so that the queries of the session, auth and message middleware are counted too
+    'sales.middleware.QueryInstrumentationMiddleware',
+    'sales.middleware.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -76,13 +80,52 @@ WSGI_APPLICATION = 'celtis_sales_application.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# Both aliases open the same file through sales/backends/sqlite3, which runs SQLITE_PRAGMAS on every new connection
+# (WAL journaling, so readers never block on writers). Connections are kept for CONN_MAX_AGE seconds instead of
+# being opened per request. sales.routers.ReadWriteRouter sends reads to the 'read' alias, whose connection is
+# query-only, and writes to 'default', where atomic blocks take the write lock up front with BEGIN IMMEDIATE.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'sales.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'pragmas': SQLITE_PRAGMAS,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'TEST': {
+            # a file rather than SQLite's in-memory database, so that tests running several threads get real
+            # database locking rather than shared-cache table locks
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
+    },
+    'read': {
+        'ENGINE': 'sales.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'pragmas': {**SQLITE_PRAGMAS, 'query_only': 'ON'},
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
+DATABASE_ROUTERS = ['sales.routers.ReadWriteRouter']
+
+SALES_READ_DATABASE = 'read'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -121,3 +164,153 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# `manage.py collectstatic` copies the assets here under content hashed names, with gzip and (when the brotli
+# package is installed) brotli compressed variants, see sales/storage.py
+
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+STATICFILES_STORAGE = 'sales.storage.CompressedManifestStaticFilesStorage'
+
+# Serve the collected files from the application (sales.middleware.StaticFilesMiddleware), for deployments where no
+# web server in front does. The content hashed names are cached by browsers for a year, other names for
+# SALES_STATIC_MAX_AGE seconds
+
+SALES_SERVE_STATIC = True
+
+SALES_STATIC_MAX_AGE = 60
+
+
+# Sales list pages
+# Rows per page of the keyset paginated customer, order and payment lists, overridable with ?page_size=
+
+SALES_PAGE_SIZE = 50
+
+SALES_MAX_PAGE_SIZE = 500
+
+# Rows rendered per chunk when a list page streams every row with ?stream=1
+
+SALES_STREAM_CHUNK_ROWS = 200
+
+# Most customers and most orders listed on the full-text search page, best matches first
+
+SALES_SEARCH_RESULTS = 50
+
+# Most orders or payments a single POST to the JSON API may carry
+
+SALES_API_MAX_ITEMS = 5000
+
+# Most matches the customer and order pickers' autocomplete lookups return
+
+SALES_AUTOCOMPLETE_LIMIT = 20
+
+# Customers shown on the aging report page, largest balance first; the CSV export has all of them
+
+SALES_AGING_ROWS = 100
+
+# Admin changelists of tables with more rows than this show an estimated count when unfiltered instead of running
+# COUNT(*) over the whole table
+
+SALES_ADMIN_EXACT_COUNT_LIMIT = 100000
+
+# Settled orders bought and last paid more than this many days ago are moved to the archive tables by
+# `manage.py archive_sales`, which is meant to run daily
+
+SALES_ARCHIVE_AFTER_DAYS = 365
+
+
+# Background jobs (sales/jobs.py), run by `manage.py run_sales_worker`
+# Uploaded job inputs and job results are stored under this directory
+
+SALES_JOB_FILES_DIR = os.path.join(BASE_DIR, 'jobs')
+
+# Jobs a worker runs at the same time, each in a process of its own
+
+SALES_JOB_CONCURRENCY = 2
+
+# Attempts a failing job gets, waiting SALES_JOB_RETRY_DELAY seconds times the attempts so far between them
+
+SALES_JOB_MAX_ATTEMPTS = 3
+
+SALES_JOB_RETRY_DELAY = 30
+
+# A running job whose worker has not sent a heartbeat for this many seconds is taken to be abandoned and retried
+
+SALES_JOB_STALE_AFTER = 60
+
+# Warm-up run by the WSGI application when a worker boots (sales/startup.py): 'templates' parses every sales
+# template, 'urls' builds the URL resolver and 'database' opens the database connections. [] turns it off
+
+SALES_WARMUP = ['templates', 'urls', 'database']
+
+
+# Caches
+# The list pages cache each rendered row in 'template_fragments' (the alias the {% cache %} tag uses by default),
+# keyed by the row versions, so nothing is ever invalidated explicitly. MAX_ENTRIES bounds it, the least recently
+# used fragments are culled first. Hit and miss counts are served at /cache/stats/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'template_fragments': {
+        'BACKEND': 'sales.cache.CountingLocMemCache',
+        'LOCATION': 'sales-fragments',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+
+
+# SQL instrumentation
+# Query count and time per request in the Server-Timing header and the 'sales.sql' log. Requests that repeat a
+# statement SALES_SQL_SIMILAR_THRESHOLD times or more (likely N+1 loops) are logged as warnings, the rest at INFO
+
+SALES_SQL_INSTRUMENTATION = True
+
+SALES_SQL_SIMILAR_THRESHOLD = 5
+
+
+# Profiling (sales/profiling.py)
+# Requests are profiled by sampling their call stack every SALES_PROFILE_INTERVAL seconds: a random
+# SALES_PROFILE_SAMPLE_RATE fraction of them, and any request whose SALES_PROFILE_HEADER equals SALES_PROFILE_TOKEN.
+# A rate of 0 and an empty token turn profiling off. The collapsed stacks and flame graph of each profile are
+# written under SALES_PROFILE_DIR, the latest SALES_PROFILE_KEEP per URL name are kept and listed at /profiles/
+
+SALES_PROFILE_SAMPLE_RATE = 0.0
+
+SALES_PROFILE_HEADER = 'X-Sales-Profile'
+
+SALES_PROFILE_TOKEN = ''
+
+SALES_PROFILE_INTERVAL = 0.005
+
+SALES_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+SALES_PROFILE_KEEP = 20
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # one structured line per request: at WARNING only the requests that look like N+1 loops are logged, set
+        # INFO to log every request
+        'sales.sql': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        # boot and warm-up timings of each WSGI worker
+        'sales.startup': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
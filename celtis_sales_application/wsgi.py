@@ -3,14 +3,19 @@ WSGI config for celtis_sales_application project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
 
+The application is built through sales.startup.boot(), which logs where the boot time went and runs the
+SALES_WARMUP stages before the first request arrives.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 """
 
 import os
 
-from django.core.wsgi import get_wsgi_application
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'celtis_sales_application.settings')
 
-application = get_wsgi_application()
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+
+from sales.startup import boot  # noqa: E402
+
+application = boot(get_wsgi_application)
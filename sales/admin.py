@@ -1,26 +1,165 @@
-from django.contrib import admin
-from .models import Customer, Order, Payment
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
+from .models import ArchivedOrder, ArchivedPayment, Customer, Order, Payment, Product
+from .payments import settle_orders
 
-class CustomerAdmin(admin.ModelAdmin):
-    fields = ['first_name', 'last_name', 'email', 'amount_owed']
-    readonly_fields = ['amount_owed']
+# The changelists are built to stay fast at millions of rows. Balances are the stored columns, so they cost no
+# aggregate. Related objects come in the same query through list_select_related. Foreign keys are edited through
+# autocomplete widgets instead of dropdowns listing every row. Filters only use indexed columns; dates are filtered
+# by ranges of their indexed column (today, past 7 days, this month, this year) rather than with date_hierarchy,
+# whose drill-down runs a DISTINCT over the truncated dates of the whole table on every changelist load. An
+# unfiltered changelist of a large table shows an estimated count instead of running COUNT(*).
+
+
+def estimated_count(queryset):
+    """
+    An estimate of the number of rows in the queryset's table: the row count SQLite's ANALYZE last recorded in
+    sqlite_stat1, or, for a table never analyzed, the span of its primary keys. The span is an upper bound that
+    also counts the ids of deleted and archived rows, so after archive_sales has moved rows out of the table the
+    changelist would offer trailing pages with nothing on them until the table is analyzed
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if 'sqlite_stat1' in connection.introspection.table_names(cursor):
+            # one row per index of the table, each stat starting with the number of rows the index covers
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall() if stat]
+            if counts:
+                return max(counts)
+        cursor.execute(f'SELECT MAX(rowid) - MIN(rowid) + 1 FROM {connection.ops.quote_name(table)}')
+        return cursor.fetchone()[0] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts an unfiltered changelist by estimated_count() once the table is past SALES_ADMIN_EXACT_COUNT_LIMIT rows.
+    Filtered changelists are counted exactly, through the index of the filter
+    """
+    @cached_property
+    def count(self):
+        if not self.object_list.query.has_filters():
+            estimate = estimated_count(self.object_list)
+            if estimate > settings.SALES_ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # the "N total" next to a filtered count would be a second COUNT(*) of the whole table
+    show_full_result_count = False
+
+
+class SettledListFilter(admin.SimpleListFilter):
+    title = 'settled'
+    parameter_name = 'settled'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Settled'), ('no', 'Outstanding')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(balance__lte=0)
+        if self.value() == 'no':
+            return queryset.filter(balance__gt=0)
+        return queryset
+
+
+class CustomerAdmin(LargeTableAdmin):
+    fields = ['first_name', 'last_name', 'email', 'total_ordered', 'total_paid', 'amount_owed']
+    readonly_fields = ['total_ordered', 'total_paid', 'amount_owed']
+    list_display = ['id', 'first_name', 'last_name', 'email', 'total_ordered', 'total_paid', 'balance']
+    # prefix matches, which the NOCASE search indexes serve
+    search_fields = ['^first_name', '^last_name', '^email']
 
 
 admin.site.register(Customer, CustomerAdmin)
 
 
-class OrderAdmin(admin.ModelAdmin):
+class ProductAdmin(admin.ModelAdmin):
+    fields = ['name', 'sku', 'list_price']
+    list_display = ['name', 'sku', 'list_price']
+    search_fields = ['name', 'sku']
+
+
+admin.site.register(Product, ProductAdmin)
+
+
+class OrderAdmin(LargeTableAdmin):
     fields = ['customer', 'product', 'product_sale_price', 'date_bought', 'amount_owed', 'payments_total']
     readonly_fields = ['date_bought', 'amount_owed', 'payments_total']
+    autocomplete_fields = ['customer', 'product']
+    list_display = ['id', 'customer', 'product', 'product_sale_price', 'paid_total', 'balance', 'date_bought']
+    list_select_related = ['customer', 'product']
+    list_filter = [SettledListFilter, 'date_bought']
+    search_fields = ['=id']
+    actions = ['mark_settled']
+
+    def mark_settled(self, request, queryset):
+        settled = settle_orders(queryset)
+        self.message_user(request, f'Recorded a cash payment settling {settled} order(s).', messages.SUCCESS)
+
+    mark_settled.short_description = 'Mark selected orders as settled (cash payment of the balance)'
 
 
 admin.site.register(Order, OrderAdmin)
 
 
-class PaymentAdmin(admin.ModelAdmin):
+class ReadOnlyAdmin(LargeTableAdmin):
+    """
+    Changelists and detail pages without add, change or delete. The admin's forms and its bulk delete would write
+    the rows without the checks and the balance, rollup and snapshot bookkeeping that the sales code goes through
+    """
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class PaymentAdmin(ReadOnlyAdmin):
+    """
+    Payments are recorded through the payment page and the API, which post them with payments.post_payment (the
+    customer, balance and idempotency checks), and the orders' mark settled action
+    """
     fields = ['order', 'customer', 'payment_type', 'payment_amount', 'date_paid']
-    readonly_fields = ['date_paid']
+    list_display = ['id', 'order', 'customer', 'payment_type', 'payment_amount', 'date_paid']
+    list_select_related = ['order__customer', 'customer']
+    list_filter = ['payment_type', 'date_paid']
 
 
 admin.site.register(Payment, PaymentAdmin)
+
+
+class ArchiveAdmin(ReadOnlyAdmin):
+    """
+    Read-only changelists of the archived history, which only archive_sales writes to
+    """
+
+
+class ArchivedOrderAdmin(ArchiveAdmin):
+    list_display = ['id', 'customer', 'product', 'product_sale_price', 'paid_total', 'date_bought', 'archived_at']
+    list_select_related = ['customer', 'product']
+    list_filter = ['date_bought']
+    search_fields = ['=id', '=customer__id']
+
+
+admin.site.register(ArchivedOrder, ArchivedOrderAdmin)
+
+
+class ArchivedPaymentAdmin(ArchiveAdmin):
+    list_display = ['id', 'order', 'customer', 'payment_type', 'payment_amount', 'date_paid', 'archived_at']
+    list_select_related = ['order__customer', 'customer']
+    list_filter = ['date_paid']
+    search_fields = ['=order__id']
+
+
+admin.site.register(ArchivedPayment, ArchivedPaymentAdmin)
@@ -0,0 +1,166 @@
+import csv
+import datetime
+
+from django.db import connections, router
+from django.db.models import ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .exports import Echo
+from .fields import MoneyField, from_cents
+from .models import ArchivedOrder, ArchivedPayment, Customer, Order, Payment, day_start
+
+# Accounts-receivable aging as of the end of a local day. What was outstanding on an order then is its price less
+# the payments against it dated up to that day, so payments made since are not netted off and orders settled since
+# still count. Archived orders and their payments are read alongside the hot tables (CarryForward holds their
+# per-customer sums; the rows themselves are needed to age them). An order can only have been outstanding then if it
+# has a stored balance now or was paid something after the day, so only those orders are looked at: the balance
+# index and the payment date indexes find them without scanning the order tables. The outstanding amounts are
+# bucketed by the age of each order's date_bought and summed per customer in a single grouped query.
+
+# (key, label, youngest age in days, oldest age in days or None for no limit)
+AGING_BUCKETS = [
+    ('days_0_30', '0-30 days', 0, 30),
+    ('days_31_60', '31-60 days', 31, 60),
+    ('days_61_90', '61-90 days', 61, 90),
+    ('days_over_90', '90+ days', 91, None),
+]
+
+# (orders, their payments)
+LEDGERS = [(Order, Payment), (ArchivedOrder, ArchivedPayment)]
+
+
+def _bucket_bounds(as_of, youngest, oldest):
+    """
+    The date_bought range (from, before) of the orders aged `youngest` to `oldest` days on the day `as_of`, from
+    None for no lower bound
+    """
+    # an order bought on day D is (as_of - D) days old
+    before = day_start(as_of - datetime.timedelta(days=youngest - 1))
+    return (None if oldest is None else day_start(as_of - datetime.timedelta(days=oldest))), before
+
+
+def _outstanding_sql(orders, payments, connection, end):
+    """
+    SQL selecting the customer, date_bought and outstanding amount in cents of every order of the `orders` model
+    bought before `end` that may have had something outstanding then, with its parameters
+    """
+    order_table, payment_table = orders._meta.db_table, payments._meta.db_table
+    end = connection.ops.adapt_datetimefield_value(end)
+    return (
+        f'SELECT o.customer_id, o.date_bought, o.product_sale_price - COALESCE(('
+        f'SELECT SUM(p.payment_amount) FROM {payment_table} p WHERE p.order_id = o.id AND p.date_paid < %s'
+        f'), 0) AS outstanding FROM {order_table} o WHERE o.date_bought < %s AND (o.balance > 0 OR o.id IN ('
+        f'SELECT order_id FROM {payment_table} WHERE date_paid >= %s))'
+    ), [end, end, end]
+
+
+def _aging_query(as_of, connection):
+    """
+    The FROM clause over every order outstanding at the end of the day `as_of`, and the bucket and total sums over
+    it, with their parameters
+    """
+    end = day_start(as_of + datetime.timedelta(days=1))
+    parts, params = zip(*(_outstanding_sql(orders, payments, connection, end) for orders, payments in LEDGERS))
+    source = f'({" UNION ALL ".join(parts)}) a'
+    sums, sum_params = [], []
+    for key, _, youngest, oldest in AGING_BUCKETS:
+        start, before = _bucket_bounds(as_of, youngest, oldest)
+        condition = 'a.date_bought < %s'
+        sum_params.append(connection.ops.adapt_datetimefield_value(before))
+        if start is not None:
+            condition += ' AND a.date_bought >= %s'
+            sum_params.append(connection.ops.adapt_datetimefield_value(start))
+        sums.append(f'SUM(CASE WHEN {condition} THEN a.outstanding ELSE 0 END) AS {key}')
+    sums.append('SUM(a.outstanding) AS total')
+    return source, [param for part in params for param in part], ', '.join(sums), sum_params
+
+
+def _money(row, keys):
+    return {key: (value if key not in keys or value is None else from_cents(value)) for key, value in row.items()}
+
+
+def _fetch(sql, params):
+    connection = connections[router.db_for_read(Order)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        money = {key for key, *_ in AGING_BUCKETS} | {'total'}
+        while True:
+            rows = cursor.fetchmany(2000)
+            if not rows:
+                return
+            for row in rows:
+                yield _money(dict(zip(columns, row)), money)
+
+
+def aging_by_customer(as_of=None, limit=None):
+    """
+    One row per customer with an outstanding balance at the end of the day: their name, the balance in each aging
+    bucket and the total, largest total first
+    """
+    as_of = as_of or timezone.localdate()
+    connection = connections[router.db_for_read(Order)]
+    source, source_params, sums, sum_params = _aging_query(as_of, connection)
+    sql = (
+        f'SELECT c.id AS customer_id, c.first_name AS customer__first_name, c.last_name AS customer__last_name, '
+        f'{sums} FROM {source} JOIN {Customer._meta.db_table} c ON c.id = a.customer_id WHERE a.outstanding > 0 '
+        f'GROUP BY c.id, c.first_name, c.last_name ORDER BY total DESC, c.id'
+    )
+    params = sum_params + source_params
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    return _fetch(sql, params)
+
+
+def aging_totals(as_of=None):
+    as_of = as_of or timezone.localdate()
+    connection = connections[router.db_for_read(Order)]
+    source, source_params, sums, sum_params = _aging_query(as_of, connection)
+    return next(_fetch(f'SELECT {sums} FROM {source} WHERE a.outstanding > 0', sum_params + source_params))
+
+
+def _open_orders(orders, payments, customer, as_of):
+    end = day_start(as_of + datetime.timedelta(days=1))
+    paid = payments.objects.filter(order=OuterRef('pk'), date_paid__lt=end).order_by().values('order').annotate(
+        total=Sum('payment_amount')
+    ).values('total')
+    outstanding = ExpressionWrapper(
+        F('product_sale_price') - Coalesce(Subquery(paid, output_field=MoneyField()), Value(0)),
+        output_field=MoneyField(),
+    )
+    return orders.objects.filter(customer=customer, date_bought__lt=end).filter(
+        Q(balance__gt=0) | Q(pk__in=payments.objects.filter(date_paid__gte=end).values('order'))
+    ).annotate(outstanding=outstanding).filter(outstanding__gt=0).select_related('product')
+
+
+def customer_open_orders(customer, as_of=None):
+    """
+    The orders, archived ones included, with something outstanding on them at the end of the day `as_of`, oldest
+    first, each with the outstanding amount, its age and bucket label
+    """
+    as_of = as_of or timezone.localdate()
+    orders = sorted(
+        (order for orders, payments in LEDGERS for order in _open_orders(orders, payments, customer, as_of)),
+        key=lambda order: (order.date_bought, order.pk),
+    )
+    for order in orders:
+        order.age_days = (as_of - timezone.localdate(order.date_bought)).days
+        order.aging_bucket = next(
+            label for _, label, youngest, oldest in AGING_BUCKETS
+            if order.age_days >= youngest and (oldest is None or order.age_days <= oldest)
+        )
+    return orders
+
+
+def stream_aging_csv(as_of=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(
+        ['customer_id', 'first_name', 'last_name'] + [key for key, *_ in AGING_BUCKETS] + ['total']
+    )
+    for row in aging_by_customer(as_of):
+        yield writer.writerow(
+            [row['customer_id'], row['customer__first_name'], row['customer__last_name']]
+            + [row[key] for key, *_ in AGING_BUCKETS] + [row['total']]
+        )
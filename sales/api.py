@@ -0,0 +1,102 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods
+
+from .imports import import_rows
+from .models import Customer, Order, Payment
+from .pagination import paginate
+
+# A JSON API for point-of-sale clients. Lists are keyset paginated like the HTML lists (?cursor=, ?page_size=) and
+# carry the stored balances, or live ones aggregated in the same query with ?live=1. A POST of a JSON array of
+# orders or payments validates every item with the rules of the order placement and payment forms (through the
+# batch import, so a whole array costs a few set-based lookups) and inserts the valid ones with bulk writes in a
+# single transaction. An order's product is given by its id, its SKU or its name.
+
+
+def _customer(customer):
+    return {
+        'id': customer.pk, 'first_name': customer.first_name, 'last_name': customer.last_name,
+        'email': customer.email, 'balance': customer.amount_owed,
+    }
+
+
+def _order(order):
+    return {
+        'id': order.pk, 'customer': order.customer_id, 'customer_name': order.customer.full_name,
+        'product': order.product_id, 'product_name': order.product.name,
+        'product_sale_price': order.product_sale_price, 'date_bought': order.date_bought,
+        'paid_total': order.payments_total, 'balance': order.amount_owed,
+    }
+
+
+def _payment(payment):
+    return {
+        'id': payment.pk, 'order': payment.order_id, 'customer': payment.customer_id,
+        'payment_type': payment.payment_type, 'payment_amount': payment.payment_amount,
+        'date_paid': payment.date_paid, 'order_balance': payment.order.amount_owed,
+    }
+
+
+# kind -> (queryset for ?live=, ordering keys, serializer)
+API_LISTS = {
+    'customers': (lambda live: Customer.objects.with_balances(live), ['id'], _customer),
+    'orders': (lambda live: Order.objects.with_payment_totals(live), ['date_bought', 'id'], _order),
+    'payments': (lambda live: Payment.objects.with_related(), ['date_paid', 'id'], _payment),
+}
+
+
+def _list(request, kind):
+    queryset, keys, serialize = API_LISTS[kind]
+    page = paginate(request, queryset(request.GET.get('live') == '1'), keys)
+    return JsonResponse({
+        'results': [serialize(obj) for obj in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def _create(request, kind):
+    """
+    Creates the orders or payments of a JSON array, returning one result per item in the same order: {"id": ...}
+    for a created item and {"errors": {field: [messages]}} for a rejected one. ?dry_run=1 only validates
+    """
+    try:
+        items = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest('The body must be a JSON array')
+    if not isinstance(items, list):
+        return HttpResponseBadRequest('The body must be a JSON array')
+    if len(items) > settings.SALES_API_MAX_ITEMS:
+        return HttpResponseBadRequest(f'At most {settings.SALES_API_MAX_ITEMS} items can be sent at once')
+
+    dry_run = request.GET.get('dry_run') == '1'
+    rows = (item if isinstance(item, dict) else {} for item in items)
+    report = import_rows(kind, rows, dry_run=dry_run, atomic=True)
+    errors = {error['row']: error['errors'] for error in report.errors}
+    ids = iter(report.ids)
+    results = [
+        {'errors': errors[row]} if row in errors else {'id': None if dry_run else next(ids)}
+        for row in range(1, report.rows + 1)
+    ]
+    return JsonResponse({'created': report.created, 'rejected': len(errors), 'results': results},
+                        status=201 if report.created else 200)
+
+
+@require_GET
+def customers(request):
+    return _list(request, 'customers')
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def orders(request):
+    return _create(request, 'orders') if request.method == 'POST' else _list(request, 'orders')
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def payments(request):
+    return _create(request, 'payments') if request.method == 'POST' else _list(request, 'payments')
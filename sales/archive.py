@@ -0,0 +1,134 @@
+import datetime
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedPayment, CarryForward, Order, Payment, day_start
+
+# Moving settled history out of the hot Order and Payment tables. An order is archived once it is fully paid and
+# both it and its last payment are older than the cutoff: it moves to ArchivedOrder and its payments to
+# ArchivedPayment, keeping their ids. Each batch is one transaction of set-based statements selected by a subquery
+# on the batch's orders (an upsert of the customers' CarryForward totals, INSERT ... SELECT into the archive, DELETE
+# from the hot table), so a batch costs the same handful of statements whatever its size and an interrupted run
+# leaves every order either fully archived or fully in place. The stored customer balances and the daily rollups
+# already count the archived rows and are not touched. restore() moves orders back the same way. Both then
+# re-analyze the four tables, so the row counts in sqlite_stat1 that the admin changelists are estimated from
+# (sales.admin.estimated_count) and the query planner's statistics follow the rows that moved.
+
+ARCHIVE_BATCH_SIZE = 2000
+
+# rows of each index ANALYZE samples, enough for estimates without reading millions of rows
+ANALYSIS_LIMIT = 1000
+
+
+def default_cutoff():
+    return timezone.localdate() - datetime.timedelta(days=settings.SALES_ARCHIVE_AFTER_DAYS)
+
+
+def archivable_orders(before):
+    """
+    The settled orders that were bought and last paid before the local day `before` starts
+    """
+    cutoff = day_start(before)
+    return Order.objects.filter(balance=0, date_bought__lt=cutoff).exclude(payment__date_paid__gte=cutoff)
+
+
+def _move(cursor, source, target, where, params, extra=None, expressions=None):
+    """
+    Copies the rows of `source` matching `where` into the columns `target` shares with it, then deletes them from
+    `source`. `extra` gives values for columns only the target has, `expressions` replaces the value copied into a
+    column with an SQL expression
+    """
+    extra, expressions = extra or {}, expressions or {}
+    target_columns = {field.column for field in target._meta.concrete_fields}
+    columns = [field.column for field in source._meta.concrete_fields if field.column in target_columns]
+    cursor.execute(
+        f'INSERT INTO {target._meta.db_table} ({", ".join(columns + list(extra))}) '
+        f'SELECT {", ".join([expressions.get(column, column) for column in columns] + ["%s"] * len(extra))} '
+        f'FROM {source._meta.db_table} WHERE {where}',
+        list(extra.values()) + list(params),
+    )
+    cursor.execute(f'DELETE FROM {source._meta.db_table} WHERE {where}', params)
+    return cursor.rowcount
+
+
+def _carry_forward(cursor, orders_table, where, params, sign):
+    """
+    Moves the customers' CarryForward totals by `sign` times the totals of the orders matching `where`
+    """
+    cursor.execute(
+        f'INSERT INTO {CarryForward._meta.db_table} (customer_id, total_ordered, total_paid) '
+        f'SELECT customer_id, {sign} * SUM(product_sale_price), {sign} * SUM(paid_total) '
+        f'FROM {orders_table} WHERE {where} GROUP BY customer_id '
+        f'ON CONFLICT (customer_id) DO UPDATE SET total_ordered = total_ordered + excluded.total_ordered, '
+        f'total_paid = total_paid + excluded.total_paid',
+        params,
+    )
+
+
+def _analyze():
+    with connections['default'].cursor() as cursor:
+        cursor.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+        for model in (Order, Payment, ArchivedOrder, ArchivedPayment):
+            cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+
+def _in_batches(orders, batch_size, move):
+    """
+    Calls move(cursor, where, params) for the orders of the queryset a batch at a time, each batch in its own
+    transaction, with `where` selecting the batch's orders by id. Returns the summed (orders, payments) counts
+    """
+    totals = [0, 0]
+    last_pk = 0
+    connection = connections['default']
+    while True:
+        with transaction.atomic():
+            pks = list(orders.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return tuple(totals)
+            subquery, params = orders.filter(pk__range=(pks[0], pks[-1])).values('pk').query.get_compiler(
+                using=connection.alias
+            ).as_sql()
+            with connection.cursor() as cursor:
+                counts = move(cursor, f'IN ({subquery})', params)
+        totals = [total + count for total, count in zip(totals, counts)]
+        last_pk = pks[-1]
+
+
+def archive(before=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Archives the settled orders last touched before the local day `before` (SALES_ARCHIVE_AFTER_DAYS ago by
+    default) and their payments, returning the numbers of orders and payments archived
+    """
+    archived_at = connections['default'].ops.adapt_datetimefield_value(timezone.now())
+
+    def move(cursor, batch, params):
+        _carry_forward(cursor, Order._meta.db_table, f'id {batch}', params, 1)
+        # payments first, while the batch's orders can still be selected in the hot table
+        payments = _move(cursor, Payment, ArchivedPayment, f'order_id {batch}', params,
+                         extra={'archived_at': archived_at})
+        return _move(cursor, Order, ArchivedOrder, f'id {batch}', params, extra={'archived_at': archived_at}), payments
+
+    counts = _in_batches(archivable_orders(before or default_cutoff()), batch_size, move)
+    _analyze()
+    return counts
+
+
+def restore(orders, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Moves the archived orders of an ArchivedOrder queryset, and their payments, back into the hot tables,
+    returning the numbers of orders and payments restored. Restored rows come back with their version moved on,
+    so no fragment cached before they were archived is served for them
+    """
+    new_version = {'version': 'version + 1'}
+
+    def move(cursor, batch, params):
+        _carry_forward(cursor, ArchivedOrder._meta.db_table, f'id {batch}', params, -1)
+        payments = _move(cursor, ArchivedPayment, Payment, f'order_id {batch}', params, expressions=new_version)
+        return _move(cursor, ArchivedOrder, Order, f'id {batch}', params, expressions=new_version), payments
+
+    counts = _in_batches(orders, batch_size, move)
+    CarryForward.objects.filter(total_ordered=0, total_paid=0).delete()
+    _analyze()
+    return counts
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Customer, Order, Product
+
+# Lookups behind the search-as-you-type customer and order pickers. Every word of the search term has to be the
+# start of a first name, last name or email (or be the customer id); the name and email columns have
+# case-insensitive indexes (migration 0007) so SQLite answers each prefix with an index range scan instead of
+# reading the table. Product names and SKUs have case-insensitive indexes of their own (migration 0016): their
+# unique indexes compare case-sensitively and can't serve istartswith. Orders are only ever searched among the
+# open orders of one customer, by the prefix of their product's name.
+
+
+def get_limit(request):
+    try:
+        limit = int(request.GET.get('limit', settings.SALES_AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        limit = settings.SALES_AUTOCOMPLETE_LIMIT
+    return max(1, min(limit, settings.SALES_AUTOCOMPLETE_LIMIT))
+
+
+def search_customers(term, limit):
+    words = term.split()
+    if not words:
+        return []
+    condition = Q()
+    for word in words:
+        match = Q(first_name__istartswith=word) | Q(last_name__istartswith=word) | Q(email__istartswith=word)
+        if word.isdigit():
+            match |= Q(pk=int(word))
+        condition &= match
+    customers = Customer.objects.filter(condition).order_by('last_name', 'first_name', 'pk')
+    return [
+        {'id': customer.pk, 'text': f'{customer.full_name} <{customer.email}>', 'balance': str(customer.balance)}
+        for customer in customers.only('first_name', 'last_name', 'email', 'balance')[:limit]
+    ]
+
+
+def search_orders(term, customer_id, limit):
+    """
+    The customer's orders with a balance left to pay, oldest first, narrowed down by order id or product prefix
+    """
+    orders = Order.objects.filter(customer_id=customer_id, balance__gt=0).select_related('product')
+    term = term.strip()
+    if term.isdigit():
+        orders = orders.filter(Q(pk=int(term)) | Q(product__name__istartswith=term))
+    elif term:
+        orders = orders.filter(product__name__istartswith=term)
+    return [
+        {'id': order.pk, 'text': f'Order ID {order.pk}, {order.product.name}, owes {order.balance}',
+         'balance': str(order.balance)}
+        for order in orders.only('product__name', 'balance').order_by('date_bought', 'pk')[:limit]
+    ]
+
+
+def search_products(term, limit):
+    """
+    Products whose name or SKU starts with the term, or with the term as their id
+    """
+    term = term.strip()
+    if not term:
+        return []
+    condition = Q(name__istartswith=term) | Q(sku__istartswith=term)
+    if term.isdigit():
+        condition |= Q(pk=int(term))
+    return [
+        {'id': product.pk, 'text': f'{product.name} ({product.sku})', 'list_price': str(product.list_price)}
+        for product in Product.objects.filter(condition).order_by('name', 'pk')[:limit]
+    ]
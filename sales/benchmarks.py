@@ -0,0 +1,223 @@
+import datetime
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from .middleware import QueryRecorder
+from .models import BalanceSnapshot, Customer, DailyPaymentTotals, DailyProductSales, Order, Payment, Product
+from .pagination import encode_cursor
+
+# Deterministic dataset generator and timing harness behind `manage.py bench_sales`. Rows are written with
+# executemany() straight into the tables, which is what makes a million orders practical to seed, and the stored
+# balances are then rebuilt set-based the same way recompute_balances does it.
+
+SEED_BATCH_SIZE = 10000
+
+PRODUCTS = ['Chair', 'Table', 'Desk', 'Lamp', 'Sofa', 'Bookshelf', 'Bed', 'Wardrobe', 'Rug', 'Mirror']
+
+
+def _insert(model, field_names, rows):
+    """
+    Inserts rows of raw values into the model's table, converting them the way the model fields would. Columns not
+    named get their field's default
+    """
+    fields = [model._meta.get_field(name) for name in field_names]
+    defaults = [field for field in model._meta.concrete_fields if field not in fields and field.has_default()]
+    fields += defaults
+    rows = (tuple(row) + tuple(field.get_default() for field in defaults) for row in rows)
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    params = [
+        [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+        for row in rows
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def _next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def _money(rng, low, high):
+    return Decimal(rng.randint(low * 100, high * 100)) / 100
+
+
+def _seed_products():
+    """
+    The ids of the catalogue products, creating the ones missing. List prices are drawn per name, so that the
+    seed's own random sequence doesn't depend on which products already existed
+    """
+    existing = dict(Product.objects.filter(name__in=PRODUCTS).values_list('name', 'pk'))
+    first_product = _next_id(Product)
+    missing = [name for name in PRODUCTS if name not in existing]
+    _insert(Product, ['id', 'name', 'sku', 'list_price'], [
+        (first_product + i, name, f'BENCH-{name.upper()}', _money(random.Random(name), 5, 2000))
+        for i, name in enumerate(missing)
+    ])
+    return sorted(existing.values()) + [first_product + i for i in range(len(missing))]
+
+
+def seed_dataset(orders, seed=0, customers=None, days=730):
+    """
+    Adds `orders` orders for `customers` customers (one per ten orders by default) spread over the last `days`
+    days, with a payment mix of roughly 20% unpaid, 55% paid in full at once and 25% paid in one to three
+    instalments. The same arguments always produce the same rows
+    """
+    rng = random.Random(seed)
+    customers = customers or max(1, orders // 10)
+    start = timezone.now() - datetime.timedelta(days=days)
+    first_customer, first_order, first_payment = _next_id(Customer), _next_id(Order), _next_id(Payment)
+
+    with transaction.atomic():
+        products = _seed_products()
+        _insert(Customer, ['id', 'first_name', 'last_name', 'email'], [
+            (first_customer + i, f'First{i}', f'Last{i}', f'customer{i}@example.com') for i in range(customers)
+        ])
+        payment_id = first_payment
+        for batch_start in range(0, orders, SEED_BATCH_SIZE):
+            order_rows, payment_rows = [], []
+            batch_end = min(orders, batch_start + SEED_BATCH_SIZE)
+            for order_id in range(first_order + batch_start, first_order + batch_end):
+                customer_id = first_customer + rng.randrange(customers)
+                price = _money(rng, 5, 2000)
+                bought = start + datetime.timedelta(seconds=rng.randrange(days * 86400))
+                order_rows.append((order_id, customer_id, rng.choice(products), price, bought))
+
+                kind = rng.random()
+                if kind < 0.2:
+                    amounts = []
+                elif kind < 0.75:
+                    amounts = [price]
+                else:
+                    amounts = [(price / 4).quantize(Decimal('0.01')) for _ in range(rng.randint(1, 3))]
+                paid = bought
+                for amount in amounts:
+                    paid += datetime.timedelta(seconds=rng.randrange(30 * 86400))
+                    payment_type = 'Card' if rng.random() < 0.7 else 'Cash'
+                    payment_rows.append((payment_id, order_id, customer_id, payment_type, amount, paid))
+                    payment_id += 1
+            _insert(Order, ['id', 'customer', 'product', 'product_sale_price', 'date_bought'], order_rows)
+            _insert(Payment, ['id', 'order', 'customer', 'payment_type', 'payment_amount', 'date_paid'], payment_rows)
+        rebuild_derived_data()
+
+
+def rebuild_derived_data():
+    """
+    Brings everything derived from the raw Order and Payment rows up to date after a seed
+    """
+    Order.objects.recompute_balances()
+    Customer.objects.recompute_balances()
+    DailyProductSales.rebuild()
+    DailyPaymentTotals.rebuild()
+    # seeded rows are dated in the past, the statement snapshots are taken again by snapshot_balances
+    BalanceSnapshot.objects.all().delete()
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(function, repeat):
+    """
+    Runs `function` `repeat` times and returns its p50/p95 latency, the queries of a run and the peak memory
+    traced while it ran
+    """
+    timings, query_counts = [], []
+    for _ in range(repeat):
+        # count the queries of every connection, reads go to the read alias
+        recorder = QueryRecorder()
+        with recorder.record():
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        query_counts.append(recorder.count)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(_percentile(timings, 0.95) * 1000, 3),
+        'queries': max(query_counts),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def _get(client, url_name, **params):
+    def request():
+        response = client.get(reverse(url_name), params)
+        assert response.status_code == 200, f'{url_name} returned {response.status_code}'
+        if response.streaming:
+            b''.join(response.streaming_content)
+    return request
+
+
+def _post(client, url_name, data):
+    def request():
+        response = client.post(reverse(url_name), data)
+        assert response.status_code == 302, f'{url_name} returned {response.status_code}'
+    return request
+
+
+def benchmarks(seed=0):
+    """
+    The benchmarks to run against the current dataset, by name
+    """
+    rng = random.Random(seed)
+    client = Client()
+    customer = Customer.objects.order_by('pk')[rng.randrange(Customer.objects.count())]
+    # an order with enough left to pay for every benchmarked payment
+    open_orders = Order.objects.filter(balance__gte=1).order_by('pk')
+    order = open_orders.filter(customer=customer).first() or open_orders.first()
+    last_order = Order.objects.order_by('-date_bought', '-pk').first()
+    # the last page of the order list, as deep as pagination goes
+    deep_cursor = last_order and encode_cursor([last_order.date_bought, last_order.pk + 1], 'prev')
+
+    def amount_owed(model, pk):
+        def read():
+            return model.objects.get(pk=pk).amount_owed
+        return read
+
+    cases = {
+        'view:sales-customer': _get(client, 'sales-customer'),
+        'view:sales-order': _get(client, 'sales-order'),
+        'view:sales-payment': _get(client, 'sales-payment'),
+        'view:sales-search': _get(client, 'sales-search', q=f'{customer.first_name} {PRODUCTS[0]}'),
+        'post:customer-registration': _post(client, 'customer-registration', {
+            'first_name': 'Bench', 'last_name': 'Mark', 'email': 'bench@example.com'}),
+        'property:Customer.amount_owed': amount_owed(Customer, customer.pk),
+    }
+    if order is not None:
+        cases.update({
+            'view:sales-order:deep-page': _get(client, 'sales-order', cursor=deep_cursor),
+            'post:order-placement': _post(client, 'order-placement', {
+                'customer': customer.pk, 'product': order.product_id, 'product_sale_price': '10.00'}),
+            'post:payment-accept': _post(client, 'payment-accept', {
+                'order': order.pk, 'customer': order.customer_id, 'payment_type': 'Cash', 'payment_amount': '0.01'}),
+            'property:Order.amount_owed': amount_owed(Order, order.pk),
+        })
+    return cases
+
+
+def run_benchmarks(repeat=20, seed=0, only=None):
+    results = {}
+    for name, function in benchmarks(seed).items():
+        if only and not any(part in name for part in only):
+            continue
+        results[name] = measure(function, repeat)
+    return results
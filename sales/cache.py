@@ -0,0 +1,59 @@
+import threading
+from collections import defaultdict
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+# The rows of the customer, order and payment lists are cached one rendered fragment per row by the {% cache %} tag,
+# in the 'template_fragments' cache. A fragment is keyed by the ids and version counters of the rows it shows (see
+# the `version` fields in models.py), so a write never has to find and delete fragments: it moves the version on,
+# the next render misses and stores a fresh fragment, and the stale one ages out of the size-bounded cache.
+
+FRAGMENT_CACHE = 'template_fragments'
+
+_MISSING = object()
+
+# hits and misses per cache location, shared by the per-thread instances Django creates of each cache
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_stats_lock = threading.Lock()
+
+
+class CountingLocMemCache(LocMemCache):
+    """
+    A local-memory cache that counts its hits and misses. Its size is bounded by the usual MAX_ENTRIES and
+    CULL_FREQUENCY options, evicting the least recently used entries first
+    """
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._stats = _stats[name]
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        with _stats_lock:
+            self._stats['misses' if value is _MISSING else 'hits'] += 1
+        return default if value is _MISSING else value
+
+    def stats(self):
+        with _stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats.update(
+            hit_rate=round(stats['hits'] / lookups, 4) if lookups else None,
+            entries=len(self._cache),
+            max_entries=self._max_entries,
+        )
+        return stats
+
+    def reset_stats(self):
+        with _stats_lock:
+            self._stats.update(hits=0, misses=0)
+
+    def clear(self):
+        super().clear()
+        self.reset_stats()
+
+
+def fragment_cache_stats():
+    cache = caches[FRAGMENT_CACHE]
+    return cache.stats() if hasattr(cache, 'stats') else {}
+
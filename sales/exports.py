@@ -0,0 +1,98 @@
+import csv
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import ArchivedOrder, ArchivedPayment, Customer, Order, Payment, day_start
+
+# Streaming exports of the ledger. Rows are read with values_list().iterator() in chunks, so memory stays flat
+# whatever the table size, and the balances come from the stored columns (and a join for the payment's order), so
+# no row costs an extra query. The header goes out before the first query runs.
+
+EXPORT_FORMATS = ['csv', 'jsonl']
+
+EXPORTS = {
+    'customers': (Customer, None, [
+        'id', 'first_name', 'last_name', 'email', 'total_ordered', 'total_paid', 'balance',
+    ]),
+    'orders': (Order, 'date_bought', [
+        'id', 'customer_id', 'customer__first_name', 'customer__last_name', 'product_id', 'product__name',
+        'product_sale_price', 'date_bought', 'paid_total', 'balance',
+    ]),
+    'payments': (Payment, 'date_paid', [
+        'id', 'order_id', 'customer_id', 'payment_type', 'payment_amount', 'date_paid', 'order__balance',
+    ]),
+    # the history moved out by archive_sales, only exported when asked for by name
+    'archived-orders': (ArchivedOrder, 'date_bought', [
+        'id', 'customer_id', 'customer__first_name', 'customer__last_name', 'product_id', 'product__name',
+        'product_sale_price', 'date_bought', 'paid_total', 'balance', 'archived_at',
+    ]),
+    'archived-payments': (ArchivedPayment, 'date_paid', [
+        'id', 'order_id', 'customer_id', 'payment_type', 'payment_amount', 'date_paid', 'archived_at',
+    ]),
+}
+
+CHUNK_SIZE = 2000
+
+
+def export_queryset(kind, start=None, end=None, customer=None):
+    """
+    The rows of one export as tuples, filtered to the dates from `start` to `end` inclusive and to one customer.
+    Customers have no date of their own, so the date range does not apply to them
+    """
+    model, date_field, columns = EXPORTS[kind]
+    queryset = model.objects.order_by(*([date_field, 'pk'] if date_field else ['pk']))
+    if customer is not None:
+        queryset = queryset.filter(**{'pk' if model is Customer else 'customer_id': customer})
+    if date_field is not None:
+        # compare the raw column against datetimes so the date index can be used
+        if start is not None:
+            queryset = queryset.filter(**{f'{date_field}__gte': day_start(start)})
+        if end is not None:
+            queryset = queryset.filter(**{f'{date_field}__lt': day_start(end + datetime.timedelta(days=1))})
+    return queryset.values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+
+
+class Echo:
+    """
+    A file-like object for csv.writer that hands back what it is given instead of buffering it
+    """
+    def write(self, value):
+        return value
+
+
+def _csv_lines(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    chunk = []
+    for row in rows:
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _jsonl_lines(columns, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n')
+        if len(chunk) >= CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def stream_export(kind, export_format='csv', **filters):
+    """
+    Yields the export as text chunks of up to CHUNK_SIZE rows each
+    """
+    columns = EXPORTS[kind][2]
+    # .iterator() is lazy, so no query runs until the header has been sent and the first row is needed
+    rows = export_queryset(kind, **filters)
+    if export_format == 'csv':
+        return _csv_lines(columns, rows)
+    return _jsonl_lines(columns, rows)
@@ -0,0 +1,53 @@
+import decimal
+
+from django.db import models
+
+# Amounts of money are stored as whole numbers of cents in BIGINT columns. The database then adds, subtracts and
+# sums them as integers, exactly and without going through floating point, and only the edges see decimals: a
+# MoneyField reads back as a Decimal with two places, and its form field is the usual DecimalField.
+
+CENTS = decimal.Decimal('0.01')
+
+
+def to_cents(amount):
+    """
+    The whole number of cents of a decimal amount, for use in F() arithmetic and raw SQL
+    """
+    return int(decimal.Decimal(amount).quantize(CENTS, rounding=decimal.ROUND_HALF_UP).scaleb(2))
+
+
+def from_cents(cents):
+    return decimal.Decimal(cents).scaleb(-2)
+
+
+class MoneyField(models.DecimalField):
+    """
+    A decimal amount of money with two decimal places, stored as an integer number of cents
+    """
+    description = 'Amount of money stored in cents'
+
+    def __init__(self, *args, max_digits=19, decimal_places=2, **kwargs):
+        super().__init__(*args, max_digits=max_digits, decimal_places=decimal_places, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get('max_digits') == 19:
+            del kwargs['max_digits']
+        if kwargs.get('decimal_places') == 2:
+            del kwargs['decimal_places']
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        # the column type, and which database converters apply to it
+        return 'BigIntegerField'
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else from_cents(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        return None if value is None else to_cents(value)
+
+    def get_db_prep_save(self, value, connection):
+        return self.get_db_prep_value(value, connection)
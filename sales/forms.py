@@ -1,9 +1,16 @@
+import uuid
+from decimal import Decimal
+
 from django import forms
-from .models import Customer, Order, Payment
+from .exports import EXPORT_FORMATS, EXPORTS
+from .models import Customer, Order, Payment, Product
+from .widgets import AutocompleteInput
 from django.forms import ModelForm
 
 # Here we are defining 3 forms: one to create a new customer, one to place a new order, and one to receive a payment
 # The database relations between these 3 forms are defined at models.py
+# The customer and order fields are typed-in ids with search-as-you-type suggestions (see widgets.py), so the pages
+# don't render every customer and order as an option
 
 class CustomerRegistrationForm(ModelForm):
     first_name = forms.CharField(max_length=50)
@@ -20,8 +27,8 @@ class CustomerRegistrationForm(ModelForm):
 
 
 class OrderPlacementForm(ModelForm):
-    customer = forms.ModelChoiceField(Customer.objects)
-    product = forms.CharField(max_length=225)
+    customer = forms.ModelChoiceField(Customer.objects, widget=AutocompleteInput('customers'))
+    product = forms.ModelChoiceField(Product.objects, widget=AutocompleteInput('products'))
     product_sale_price = forms.DecimalField(label='Product Sale Price in $', max_digits=19, decimal_places=2)
 
     class Meta:
@@ -34,10 +41,14 @@ class OrderPlacementForm(ModelForm):
 
 
 class PaymentAcceptForm(ModelForm):
-    order = forms.ModelChoiceField(Order.objects)
-    customer = forms.ModelChoiceField(Customer.objects)
+    order = forms.ModelChoiceField(Order.objects, widget=AutocompleteInput('orders', depends_on='customer'))
+    customer = forms.ModelChoiceField(Customer.objects, widget=AutocompleteInput('customers'))
     payment_type = forms.ChoiceField(choices=[('Cash', 'Cash'), ('Card', 'Card')])
-    payment_amount = forms.DecimalField(label='Payment Amount in $', max_digits=19, decimal_places=2)
+    payment_amount = forms.DecimalField(label='Payment Amount in $', max_digits=19, decimal_places=2,
+                                        min_value=Decimal('0.01'))
+    # a fresh key for every rendering of the form, so that submitting the same page twice records one payment
+    idempotency_key = forms.CharField(widget=forms.HiddenInput, required=False, max_length=64,
+                                      initial=lambda: uuid.uuid4().hex)
 
     class Meta:
         model = Payment
@@ -46,4 +57,52 @@ class PaymentAcceptForm(ModelForm):
             'customer',
             'payment_type',
             'payment_amount'
-        ]
\ No newline at end of file
+        ]
+
+    def clean(self):
+        # checked again by payments.post_payment inside the transaction that records the payment
+        cleaned_data = super().clean()
+        order, customer, amount = (cleaned_data.get(name) for name in ('order', 'customer', 'payment_amount'))
+        if order and customer and order.customer_id != customer.pk:
+            self.add_error('order', 'This order belongs to another customer.')
+        elif order and amount is not None and amount > order.balance:
+            self.add_error('payment_amount', f'Only ${order.balance} is left to pay on this order.')
+        return cleaned_data
+
+
+class DateRangeForm(forms.Form):
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('start') and cleaned_data.get('end') and cleaned_data['start'] > cleaned_data['end']:
+            raise forms.ValidationError('The start date must not be after the end date.')
+        return cleaned_data
+
+
+class ExportFilterForm(DateRangeForm):
+    format = forms.ChoiceField(choices=[(name, name) for name in EXPORT_FORMATS], required=False)
+    customer = forms.IntegerField(required=False, min_value=1)
+
+    def clean_format(self):
+        return self.cleaned_data['format'] or 'csv'
+
+
+class ExportJobForm(ExportFilterForm):
+    export = forms.ChoiceField(choices=[(name, name) for name in EXPORTS])
+
+
+class StatementsJobForm(DateRangeForm):
+    start = forms.DateField()
+    end = forms.DateField()
+
+
+class ImportUploadForm(forms.Form):
+    kind = forms.ChoiceField(choices=[('orders', 'Orders'), ('payments', 'Payments')])
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('jsonl', 'JSONL')])
+    file = forms.FileField()
+
+
+class AsOfForm(forms.Form):
+    as_of = forms.DateField(required=False)
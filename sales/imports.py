@@ -0,0 +1,179 @@
+import csv
+import io
+import json
+from contextlib import nullcontext
+from itertools import islice
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+
+from .forms import OrderPlacementForm, PaymentAcceptForm
+from .models import Customer, Order, Payment, Product
+
+# Bulk import of orders and payments. The file is parsed as a stream and validated a batch at a time with the same
+# forms the order placement and payment pages use; only their foreign key fields are swapped for ones that resolve
+# against objects fetched for the whole batch with in_bulk(), so a batch costs a couple of lookups instead of one
+# per row. A product can also be given by its SKU or its name: integer values are ids, and the batch's other values
+# are looked up with one in_bulk() by SKU, then one by name for those no SKU matched. Each batch is looked up, validated and inserted with bulk_create inside one transaction, which also
+# recomputes the stored balances of the customers and orders it touches.
+
+IMPORT_FORMATS = ['csv', 'jsonl']
+
+IMPORTS = {
+    'orders': (OrderPlacementForm, Order, {'customer': Customer, 'product': Product}),
+    'payments': (PaymentAcceptForm, Payment, {'customer': Customer, 'order': Order}),
+}
+
+# the unique fields a foreign key can be given by instead of the related row's id, tried in this order
+NATURAL_KEYS = {
+    'product': ['sku', 'name'],
+}
+
+BATCH_SIZE = 1000
+
+
+class PrefetchedChoiceField(forms.ModelChoiceField):
+    """
+    A ModelChoiceField that looks its value up in objects fetched ahead of time instead of querying the database:
+    an integer in `objects` by primary key, anything else in the {value: object} of `natural_objects`
+    """
+    def __init__(self, objects, model, natural_objects=None, **kwargs):
+        self.objects = objects
+        self.natural_objects = natural_objects or {}
+        super().__init__(queryset=model.objects.none(), **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            key = int(value)
+        except (TypeError, ValueError):
+            objects, key = self.natural_objects, str(value)
+        else:
+            objects = self.objects
+        try:
+            return objects[key]
+        except KeyError:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.valid = 0
+        self.created = 0
+        self.errors = []
+        # the primary keys of the created rows, in the order of their rows
+        self.ids = []
+
+    def add_error(self, row_number, errors):
+        self.errors.append({'row': row_number, 'errors': errors})
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def read_rows(stream, import_format='csv'):
+    """
+    Yields the rows of a text stream as dicts, one line at a time
+    """
+    if import_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else {}
+
+
+def text_stream(binary_file):
+    return io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+
+
+def _batch_form_class(form_class, related_models, rows):
+    """
+    Subclasses the form with foreign key fields that resolve against the objects referenced by this batch
+    """
+    fields = {}
+    for name, model in related_models.items():
+        ids, keys = set(), set()
+        for row in rows:
+            value = row.get(name)
+            try:
+                ids.add(int(value))
+            except (TypeError, ValueError):
+                if isinstance(value, str) and name in NATURAL_KEYS:
+                    keys.add(value)
+        natural_objects = {}
+        for field_name in NATURAL_KEYS.get(name, []):
+            # in_bulk() of no values returns without a query
+            natural_objects.update(model.objects.in_bulk(keys - set(natural_objects), field_name=field_name))
+        base_field = form_class.base_fields[name]
+        fields[name] = PrefetchedChoiceField(
+            model.objects.in_bulk(ids), model, natural_objects,
+            label=base_field.label, required=base_field.required,
+        )
+
+    def _get_validation_exclusions(self):
+        # the model would check each foreign key exists with a query of its own, the fields above already have
+        return super(batch_form_class, self)._get_validation_exclusions() + list(related_models)
+
+    fields['_get_validation_exclusions'] = _get_validation_exclusions
+    batch_form_class = type(form_class.__name__, (form_class,), fields)
+    return batch_form_class
+
+
+def _insert(model, objects):
+    """
+    Bulk inserts the objects and returns their new primary keys. Backends that can't return them from the INSERT
+    (SQLite) get them by reading back the rows above the previous highest id, which is only safe because the
+    caller's transaction holds the database write lock (BEGIN IMMEDIATE) for the whole time
+    """
+    last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    model.objects.bulk_create(objects)
+    if all(obj.pk is not None for obj in objects):
+        return [obj.pk for obj in objects]
+    return list(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True))
+
+
+def import_rows(kind, rows, batch_size=BATCH_SIZE, dry_run=False, atomic=False):
+    """
+    Validates and inserts the rows of an orders or payments import, returning an ImportReport with the number of
+    rows created, their ids and the errors of every rejected row (numbered from 1, not counting the header). Each
+    batch is validated and committed in a transaction of its own, or with atomic=True all of them in one
+    """
+    form_class, model, related_models = IMPORTS[kind]
+    report = ImportReport()
+    rows = iter(rows)
+    with transaction.atomic() if atomic else nullcontext():
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            # the batch's lookups, its checks against the stored balances and its insert share one transaction,
+            # whose write lock (BEGIN IMMEDIATE) keeps other payments from changing the balances in between
+            with nullcontext() if dry_run else transaction.atomic(savepoint=False):
+                batch_form_class = _batch_form_class(form_class, related_models, batch)
+                objects = []
+                for row in batch:
+                    report.rows += 1
+                    form = batch_form_class(row)
+                    if form.is_valid():
+                        objects.append(form.instance)
+                        if kind == 'payments':
+                            # the later rows of the batch have to fit in what this payment leaves to pay on the order
+                            form.instance.order.balance -= form.instance.payment_amount
+                    else:
+                        errors = {field: list(messages) for field, messages in form.errors.items()}
+                        report.add_error(report.rows, errors)
+                report.valid += len(objects)
+                if objects and not dry_run:
+                    report.ids += _insert(model, objects)
+                    report.created += len(objects)
+    return report
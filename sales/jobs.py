@@ -0,0 +1,341 @@
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import traceback
+import uuid
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django import forms
+from django.conf import settings
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .archive import archive
+from .exports import stream_export
+from .forms import ExportJobForm, ImportUploadForm, StatementsJobForm
+from .imports import import_rows, read_rows, text_stream
+from .models import Job
+from .statements import stream_statements, take_snapshots
+
+# Background jobs for the work that is too heavy for a web request: imports, exports, statements and the balance
+# and rollup rebuilds. A view enqueues a Job row and `manage.py run_sales_worker` runs it on a pool of local
+# processes. The queue is the database itself. A worker claims a job with a conditional UPDATE from 'queued' to
+# 'running', which only one worker can win, so any number of workers can share the queue without a broker.
+#
+# While a job runs its worker keeps moving heartbeat_at on. A running job whose heartbeat is more than
+# SALES_JOB_STALE_AFTER seconds old was left behind by a worker that died, and the next worker to poll queues it
+# again. A failed attempt is retried after SALES_JOB_RETRY_DELAY seconds times the attempts so far, up to
+# SALES_JOB_MAX_ATTEMPTS attempts. Imports commit batch by batch, so a failed import is not retried: running it
+# again would insert its first batches twice. Every other task can safely run again.
+#
+# Uploaded inputs and task results are files under SALES_JOB_FILES_DIR, named in the Job by relative path.
+
+JobKind = namedtuple('JobKind', ['label', 'function', 'form', 'retry'])
+
+JOB_KINDS = {}
+
+
+def task(kind, label, form=forms.Form, retry=True):
+    """
+    Registers the decorated function as the task run by jobs of `kind`, enqueued from the fields of `form`
+    """
+    def register(function):
+        JOB_KINDS[kind] = JobKind(label, function, form, retry)
+        return function
+    return register
+
+
+def job_path(name):
+    return os.path.join(settings.SALES_JOB_FILES_DIR, name)
+
+
+class JobRun:
+    """
+    What a task is handed: the job's parameters and input file, and ways to report progress and write its result
+    """
+    def __init__(self, job):
+        self.job = job
+        self.params = json.loads(job.params)
+
+    @property
+    def input_path(self):
+        return job_path(self.job.input_file)
+
+    def progress(self, percent, message=''):
+        Job.objects.filter(pk=self.job.pk).update(
+            progress=max(0, min(int(percent), 100)), message=message[:200], heartbeat_at=timezone.now()
+        )
+
+    def write_result(self, name, chunks):
+        """
+        Writes the text chunks to the job's result file `name`, replacing what an earlier attempt wrote
+        """
+        self.job.result_file = f'results/{self.job.pk}/{name}'
+        path = job_path(self.job.result_file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', newline='', encoding='utf-8') as output:
+            output.writelines(chunks)
+
+
+def _day(value):
+    return parse_date(value) if value else None
+
+
+def _reporting(rows, binary, size, run, every=1000):
+    """
+    Passes the rows through, reporting how far into the file they are every `every` rows
+    """
+    for number, row in enumerate(rows, 1):
+        yield row
+        if number % every == 0:
+            run.progress(100 * binary.tell() / size, f'{number} row(s) read')
+
+
+def _command(name):
+    out = io.StringIO()
+    call_command(name, stdout=out)
+    lines = out.getvalue().strip().splitlines()
+    return lines[-1] if lines else ''
+
+
+@task('import', 'Import orders or payments', ImportUploadForm, retry=False)
+def import_task(run):
+    size = os.path.getsize(run.input_path) or 1
+    with open(run.input_path, 'rb') as binary:
+        rows = read_rows(text_stream(binary), run.params['format'])
+        report = import_rows(run.params['kind'], _reporting(rows, binary, size, run))
+    if report.errors:
+        run.write_result('errors.jsonl', (json.dumps(error) + '\n' for error in report.errors))
+    return f'{report.rows} row(s) read, {report.created} created, {len(report.errors)} rejected'
+
+
+@task('export', 'Export', ExportJobForm)
+def export_task(run):
+    params = run.params
+    chunks = stream_export(params['export'], params['format'], start=_day(params.get('start')),
+                           end=_day(params.get('end')), customer=params.get('customer'))
+    run.write_result(f"{params['export']}.{params['format']}", chunks)
+    return f"Exported {params['export']} as {params['format']}"
+
+
+@task('statements', 'Customer statements', StatementsJobForm)
+def statements_task(run):
+    start, end = _day(run.params['start']), _day(run.params['end'])
+    run.write_result(f'statements-{start}-{end}.csv', stream_statements(start, end))
+    return f'Statements from {start} to {end}'
+
+
+@task('recompute-balances', 'Recompute balances')
+def recompute_balances_task(run):
+    return _command('recompute_balances')
+
+
+@task('rebuild-rollups', 'Rebuild daily rollups')
+def rebuild_rollups_task(run):
+    return _command('rebuild_rollups')
+
+
+@task('snapshot-balances', 'Take month-end balance snapshots')
+def snapshot_balances_task(run):
+    return f'Took {take_snapshots()} month-end snapshot(s)'
+
+
+@task('archive', 'Archive settled history')
+def archive_task(run):
+    return 'Archived {} order(s) and {} payment(s)'.format(*archive())
+
+
+def enqueue(kind, params=None, upload=None):
+    """
+    Queues a job of `kind` with the JSON serializable `params`, and the uploaded file `upload` as its input
+    """
+    input_file = ''
+    if upload is not None:
+        input_file = f'uploads/{uuid.uuid4().hex}-{os.path.basename(upload.name)}'
+        os.makedirs(os.path.dirname(job_path(input_file)), exist_ok=True)
+        with open(job_path(input_file), 'wb') as destination:
+            for chunk in upload.chunks():
+                destination.write(chunk)
+    return Job.objects.create(
+        kind=kind, params=json.dumps(params or {}, cls=DjangoJSONEncoder), input_file=input_file,
+        max_attempts=settings.SALES_JOB_MAX_ATTEMPTS if JOB_KINDS[kind].retry else 1,
+    )
+
+
+def claim(worker):
+    """
+    Marks the next due queued job as running for `worker` and returns it, or None when no job is due. A job another
+    worker claims first is skipped
+    """
+    while True:
+        now = timezone.now()
+        pk = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by('run_after', 'pk').values_list(
+            'pk', flat=True
+        ).first()
+        if pk is None:
+            return None
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, attempts=F('attempts') + 1, progress=0, message='',
+            started_at=now, heartbeat_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+
+
+def retry_or_fail(job, error):
+    """
+    Queues the running job for another attempt after a delay, or fails it once it is out of attempts. Returns the
+    job's new status
+    """
+    if job.attempts >= job.max_attempts:
+        return fail(job, error)
+    delay = datetime.timedelta(seconds=settings.SALES_JOB_RETRY_DELAY * job.attempts)
+    _record(job, status=Job.QUEUED, run_after=timezone.now() + delay, error=error)
+    return Job.QUEUED
+
+
+def fail(job, error):
+    """
+    Fails the running job without another attempt. Returns the job's new status
+    """
+    _record(job, status=Job.FAILED, finished_at=timezone.now(), error=error)
+    return Job.FAILED
+
+
+def _record(job, **changes):
+    # a worker that was given up for dead must not overwrite the outcome of the attempt that replaced it
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker).update(**changes)
+
+
+def run(pk):
+    """
+    Runs the claimed job and records its outcome, returning its new status. A job of a kind no task is registered
+    for (queued by a version of the code that had it) fails at once, since another attempt would fail the same way
+    """
+    job = Job.objects.get(pk=pk)
+    if job.kind not in JOB_KINDS:
+        return fail(job, f'Unknown job kind {job.kind!r}')
+    try:
+        runner = JobRun(job)
+        message = JOB_KINDS[job.kind].function(runner)
+    except Exception:
+        return retry_or_fail(job, traceback.format_exc())
+    _record(
+        job, status=Job.SUCCEEDED, progress=100, message=(message or '')[:200], result_file=runner.job.result_file,
+        error='', finished_at=timezone.now(),
+    )
+    return Job.SUCCEEDED
+
+
+def heartbeat(pks):
+    if pks:
+        Job.objects.filter(pk__in=pks, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def recover_stale():
+    """
+    Retries or fails the running jobs whose worker stopped sending heartbeats, returning how many there were
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.SALES_JOB_STALE_AFTER)
+    stale = list(Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=cutoff))
+    for job in stale:
+        retry_or_fail(job, f'Worker {job.worker} stopped sending heartbeats')
+    return len(stale)
+
+
+def _ignore_interrupts():
+    # Ctrl-C in a terminal reaches the whole process group; only the worker itself should act on it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Worker:
+    """
+    Claims queued jobs and runs them `concurrency` at a time on a pool of processes. With a concurrency of 0 the
+    jobs run one at a time in this process, which is easier to debug but sends no heartbeats between progress
+    reports
+    """
+    def __init__(self, concurrency, poll_interval=1.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.counts = Counter()
+        self.stopping = False
+        self.pool = None
+        self.running = {}
+
+    def stop(self, *args):
+        """
+        Stops claiming jobs; the running ones are finished first
+        """
+        self.stopping = True
+
+    def run(self, once=False):
+        """
+        Runs jobs until stop() is called, or with once=True until none is due
+        """
+        while not self.stopping or self.running:
+            recover_stale()
+            heartbeat([job.pk for job, _ in self.running.values()])
+            self._collect()
+            while not self.stopping and len(self.running) < max(self.concurrency, 1):
+                job = claim(self.name)
+                if job is None:
+                    break
+                if self.concurrency == 0:
+                    self.counts[run(job.pk)] += 1
+                else:
+                    self._submit(job)
+            if once and not self.running:
+                break
+            if self.running:
+                wait(list(self.running), timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(self.poll_interval)
+        if self.pool is not None:
+            self.pool.shutdown()
+        return self.counts
+
+    def _submit(self, job):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                self.concurrency, mp_context=multiprocessing.get_context('fork'), initializer=_ignore_interrupts
+            )
+        # the pool forks this process, and an SQLite connection must not be shared with a child
+        connections.close_all()
+        try:
+            future = self.pool.submit(run, job.pk)
+        except BrokenProcessPool:
+            # a process died since the last look; the jobs it took down are collected as failed
+            self._discard_pool(self.pool)
+            return self._submit(job)
+        self.running[future] = (job, self.pool)
+
+    def _discard_pool(self, pool):
+        pool.shutdown(wait=False)
+        if pool is self.pool:
+            self.pool = None
+
+    def _collect(self):
+        """
+        Records the outcome of the jobs that finished. A job whose process died is retried, and the pool the death
+        left broken is replaced
+        """
+        for future in [future for future in self.running if future.done()]:
+            job, pool = self.running.pop(future)
+            try:
+                self.counts[future.result()] += 1
+            except Exception as exc:
+                self.counts[retry_or_fail(job, f'The process running the job died: {exc!r}')] += 1
+                if isinstance(exc, BrokenProcessPool):
+                    self._discard_pool(pool)
@@ -0,0 +1,12 @@
+from django.core.management.base import CommandError
+from django.utils.dateparse import parse_date
+
+
+def date_argument(value):
+    """
+    An argparse type for dates given as YYYY-MM-DD
+    """
+    parsed = parse_date(value)
+    if parsed is None:
+        raise CommandError(f'"{value}" is not a YYYY-MM-DD date')
+    return parsed
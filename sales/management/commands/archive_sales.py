@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.archive import ARCHIVE_BATCH_SIZE, archive, default_cutoff, restore
+from sales.management.arguments import date_argument
+from sales.models import ArchivedOrder, day_start
+
+
+class Command(BaseCommand):
+    help = ('Moves settled orders and their payments older than a cutoff into the archive tables, or with --restore '
+            'moves archived orders back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=date_argument,
+                            help='Archive orders bought and last paid before this date, YYYY-MM-DD. Defaults to '
+                                 'SALES_ARCHIVE_AFTER_DAYS days ago')
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE,
+                            help='Orders moved per transaction')
+        parser.add_argument('--restore', action='store_true',
+                            help='Move archived orders back instead, all of them unless narrowed down with '
+                                 '--customer or --since')
+        parser.add_argument('--customer', type=int, help='Only restore the orders of this customer ID')
+        parser.add_argument('--since', type=date_argument, help='Only restore orders bought on or after this date')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if not options['restore']:
+            if options['customer'] or options['since']:
+                raise CommandError('--customer and --since only apply to --restore')
+            before = options['before'] or default_cutoff()
+            orders, payments = archive(before, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Archived {orders} order(s) and {payments} payment(s) settled before {before}'
+            ))
+            return
+
+        archived = ArchivedOrder.objects.all()
+        if options['customer']:
+            archived = archived.filter(customer_id=options['customer'])
+        if options['since']:
+            archived = archived.filter(date_bought__gte=day_start(options['since']))
+        orders, payments = restore(archived, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Restored {orders} order(s) and {payments} payment(s)'))
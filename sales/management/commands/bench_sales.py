@@ -0,0 +1,74 @@
+import json
+import platform
+import sqlite3
+import subprocess
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from sales.benchmarks import run_benchmarks, seed_dataset
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+
+def _size(value):
+    return SIZES.get(value.lower()) or int(value)
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Seeds throwaway databases of fixed sizes and reports latency, query counts and peak memory as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', type=_size, default=[1000],
+                            help='Numbers of orders to seed, or 1k, 100k and 1m. Defaults to 1k')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of each benchmark')
+        parser.add_argument('--only', nargs='*', help='Only run benchmarks whose name contains one of these')
+        parser.add_argument('--output', '-o', help='Write the JSON report to this file instead of standard output')
+
+    def handle(self, *args, **options):
+        report = {
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'sizes': {},
+        }
+        setup_test_environment()
+        try:
+            for size in options['sizes']:
+                # every size gets a fresh test database, so the real one is never touched
+                runner = DiscoverRunner(verbosity=0, interactive=False)
+                old_config = runner.setup_databases()
+                try:
+                    start = time.perf_counter()
+                    seed_dataset(size, seed=options['seed'])
+                    seed_seconds = time.perf_counter() - start
+                    report['sizes'][str(size)] = {
+                        'seed_seconds': round(seed_seconds, 2),
+                        'benchmarks': run_benchmarks(options['repeat'], options['seed'], options['only']),
+                    }
+                finally:
+                    runner.teardown_databases(old_config)
+                self.stderr.write(f'Finished {size} orders')
+        finally:
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from sales.exports import EXPORT_FORMATS, EXPORTS, stream_export
+from sales.management.arguments import date_argument
+
+
+class Command(BaseCommand):
+    help = 'Streams customers, orders or payments to a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--start', type=date_argument, help='First date to include, YYYY-MM-DD')
+        parser.add_argument('--end', type=date_argument, help='Last date to include, YYYY-MM-DD')
+        parser.add_argument('--customer', type=int, help='Only export rows of this customer ID')
+        parser.add_argument('--output', '-o', help='File to write to, standard output by default')
+
+    def handle(self, *args, **options):
+        chunks = stream_export(
+            options['kind'], options['format'],
+            start=options['start'], end=options['end'], customer=options['customer'],
+        )
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.management.arguments import date_argument
+from sales.statements import stream_statements
+
+
+class Command(BaseCommand):
+    help = 'Streams the statement summary (opening balance, orders, payments, closing balance) of every customer as CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', type=date_argument, help='First day of the statement period, YYYY-MM-DD')
+        parser.add_argument('end', type=date_argument, help='Last day of the statement period, YYYY-MM-DD')
+        parser.add_argument('--output', '-o', help='File to write to, standard output by default')
+
+    def handle(self, *args, **options):
+        if options['start'] > options['end']:
+            raise CommandError('The start date must not be after the end date')
+        chunks = stream_statements(options['start'], options['end'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
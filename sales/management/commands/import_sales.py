@@ -0,0 +1,42 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.imports import BATCH_SIZE, IMPORT_FORMATS, IMPORTS, import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Imports orders or payments from a CSV or JSONL file in validated, batched inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTS))
+        parser.add_argument('path', help='CSV file with a header row, or JSONL file with one object per line')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Validate the file without inserting anything')
+        parser.add_argument('--errors', help='Write the per-row error report to this JSONL file')
+
+    def handle(self, *args, **options):
+        import_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError('Cannot tell the file format from its extension, pass --format')
+        try:
+            source = open(options['path'], encoding='utf-8-sig', newline='')
+        except OSError as exc:
+            raise CommandError(exc)
+        with source:
+            report = import_rows(options['kind'], read_rows(source, import_format),
+                                 batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        if options['errors']:
+            with open(options['errors'], 'w', encoding='utf-8') as errors:
+                for error in report.errors:
+                    errors.write(json.dumps(error) + '\n')
+        else:
+            for error in report.errors:
+                self.stderr.write(f"Row {error['row']}: {json.dumps(error['errors'])}")
+
+        summary = f"{report.rows} row(s) read, {report.valid} valid, {report.created} created, " \
+                  f"{len(report.errors)} rejected"
+        self.stdout.write(self.style.SUCCESS(summary) if report.ok else self.style.WARNING(summary))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.management.arguments import date_argument
+from sales.models import DailyPaymentTotals, DailyProductSales
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily sales and payment rollups of a date range from the Order and Payment tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date_argument, help='First day to rebuild, YYYY-MM-DD. Defaults to the first')
+        parser.add_argument('--end', type=date_argument, help='Last day to rebuild, YYYY-MM-DD. Defaults to the last')
+
+    def handle(self, *args, **options):
+        if options['start'] and options['end'] and options['start'] > options['end']:
+            raise CommandError('--start must not be after --end')
+        for rollup in (DailyProductSales, DailyPaymentTotals):
+            rollup.rebuild(options['start'], options['end'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt the daily rollups'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from sales.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search indexes of customers and products from their tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optimize', action='store_true',
+                            help='Also merge the index segments, for faster searches after large imports')
+
+    def handle(self, *args, **options):
+        rebuild_search_index(optimize=options['optimize'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt the search indexes'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from sales.models import Customer, Order
+
+
+class Command(BaseCommand):
+    help = 'Checks the stored Customer and Order balances against the ledger and rebuilds them from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report balances that drifted from the ledger, exit with an error if any did')
+
+    def handle(self, *args, **options):
+        drifted_customers = [
+            customer.pk for customer in Customer.objects.with_computed_balances().iterator(chunk_size=2000)
+            if (customer.total_ordered, customer.total_paid, customer.balance) != (
+                customer.computed_total_ordered, customer.computed_total_paid,
+                customer.computed_total_ordered - customer.computed_total_paid)
+        ]
+        drifted_orders = [
+            order.pk for order in Order.objects.with_computed_balances().iterator(chunk_size=2000)
+            if (order.paid_total, order.balance) != (
+                order.computed_paid_total, order.product_sale_price - order.computed_paid_total)
+        ]
+        self.stdout.write(
+            f'{len(drifted_customers)} customer balance(s) and {len(drifted_orders)} order balance(s) drifted'
+        )
+        for pk in drifted_customers[:20]:
+            self.stdout.write(f'  Customer ID {pk}')
+        for pk in drifted_orders[:20]:
+            self.stdout.write(f'  Order ID {pk}')
+
+        if options['check']:
+            if drifted_customers or drifted_orders:
+                raise CommandError('Stored balances do not match the ledger, run recompute_balances to fix them')
+            return
+
+        with transaction.atomic():
+            orders = Order.objects.recompute_balances()
+            customers = Customer.objects.recompute_balances()
+        self.stdout.write(self.style.SUCCESS(f'Recomputed balances of {customers} customer(s) and {orders} order(s)'))
@@ -0,0 +1,35 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.jobs import Worker
+from sales.models import Job
+
+
+class Command(BaseCommand):
+    help = ('Runs the queued sales jobs (imports, exports, statements, balance and rollup rebuilds) on a pool of '
+            'processes until stopped with Ctrl-C or SIGTERM, which let the running jobs finish')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.SALES_JOB_CONCURRENCY,
+                            help='Jobs run at the same time, each in its own process. 0 runs them one at a time in '
+                                 'this process. Defaults to SALES_JOB_CONCURRENCY')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds between looks at the queue when it is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of waiting')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 0:
+            raise CommandError('--concurrency must not be negative')
+        worker = Worker(options['concurrency'], options['poll_interval'])
+        handlers = {signum: signal.signal(signum, worker.stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            counts = worker.run(once=options['once'])
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(
+            f'{counts[Job.SUCCEEDED]} job(s) succeeded, {counts[Job.QUEUED]} queued for a retry, '
+            f'{counts[Job.FAILED]} failed'
+        ))
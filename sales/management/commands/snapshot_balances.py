@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from sales.management.arguments import date_argument
+from sales.models import BalanceSnapshot
+from sales.statements import take_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Takes the missing month-end customer balance snapshots the statements are computed from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--through', type=date_argument,
+                            help='Last day to snapshot up to, YYYY-MM-DD. Defaults to yesterday')
+        parser.add_argument('--rebuild', action='store_true', help='Drop every snapshot and take them all again')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            BalanceSnapshot.objects.all().delete()
+        taken = take_snapshots(options['through'])
+        self.stdout.write(self.style.SUCCESS(f'Took {taken} month-end snapshot(s)'))
@@ -0,0 +1,218 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .profiling import Sampler, save_profile
+from .storage import collected_files
+
+logger = logging.getLogger('sales.sql')
+
+# Collapses the literals of a statement so that queries differing only in their values count as similar
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper that records every statement with its parameters and duration
+    """
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'params': params, 'duration': time.perf_counter() - start})
+
+    def record(self, aliases=None):
+        """
+        Context manager installing the recorder on the given connections, all of them by default
+        """
+        stack = ExitStack()
+        for alias in aliases or connections:
+            stack.enter_context(connections[alias].execute_wrapper(self))
+        return stack
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(query['duration'] for query in self.queries)
+
+    def duplicates(self):
+        """
+        Statements run more than once with the same parameters
+        """
+        counts = Counter((query['sql'], repr(query['params'])) for query in self.queries)
+        return {sql: count for (sql, _), count in counts.items() if count > 1}
+
+    def similar(self, threshold=2):
+        """
+        Statements run at least `threshold` times with any parameters, the usual sign of an N+1 loop
+        """
+        counts = Counter(_LITERALS.sub('?', query['sql']) for query in self.queries)
+        return {sql: count for sql, count in counts.items() if count >= threshold}
+
+    def slowest(self, count=3):
+        return sorted(self.queries, key=lambda query: query['duration'], reverse=True)[:count]
+
+    def report(self):
+        return '\n'.join(
+            f"{i}. ({query['duration'] * 1000:.2f} ms) {query['sql']} {query['params']!r}"
+            for i, query in enumerate(self.queries, 1)
+        )
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records the SQL each request runs and reports it in a Server-Timing header and a structured 'sales.sql' log
+    line. Enabled with SALES_SQL_INSTRUMENTATION; queries run while a streaming response is sent are not counted
+    """
+    def __init__(self, get_response):
+        if not settings.SALES_SQL_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.similar_threshold = settings.SALES_SQL_SIMILAR_THRESHOLD
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.get_response(request)
+
+        similar = recorder.similar(self.similar_threshold)
+        duplicates = recorder.duplicates()
+        sql_ms = recorder.total_time * 1000
+        response['Server-Timing'] = f'sql;dur={sql_ms:.2f};desc="{recorder.count} queries"'
+
+        match = request.resolver_match
+        logger.log(logging.WARNING if similar else logging.INFO, json.dumps({
+            'view': match.view_name if match else None,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'sql_ms': round(sql_ms, 2),
+            'duplicates': sum(duplicates.values()),
+            'similar': similar,
+            'slowest': [
+                {'sql': query['sql'], 'ms': round(query['duration'] * 1000, 2)} for query in recorder.slowest()
+            ],
+        }))
+        return response
+
+
+# a year, the longest lifetime browsers honour
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def accepted_encodings(header):
+    """
+    The content codings an Accept-Encoding header accepts, leaving out those it refuses with q=0
+    """
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding.strip():
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """
+    Serves the files collectstatic wrote to STATIC_ROOT (see sales/storage.py) ahead of the rest of the middleware,
+    picking the best precompressed variant the client accepts. Content hashed names are cached by browsers for a
+    year without revalidation, the plain names for SALES_STATIC_MAX_AGE seconds. Enabled with SALES_SERVE_STATIC
+    once collectstatic has run; the files found are indexed when the worker starts
+    """
+    def __init__(self, get_response):
+        if not settings.SALES_SERVE_STATIC or not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed
+        self.files = collected_files(settings.STATIC_ROOT)
+        if not self.files:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.max_age = settings.SALES_STATIC_MAX_AGE
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            static = self.files.get(request.path[len(self.prefix):])
+            if static is not None:
+                return self.serve(request, static)
+        return self.get_response(request)
+
+    def serve(self, request, static):
+        if not static.immutable and not was_modified_since(
+                request.META.get('HTTP_IF_MODIFIED_SINCE'), static.mtime, static.size):
+            return HttpResponseNotModified()
+        encoding, path, size = static.variant(accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=static.content_type)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=static.content_type)
+        response['Content-Length'] = size
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if static.variants:
+            patch_vary_headers(response, ['Accept-Encoding'])
+        if static.immutable:
+            response['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        else:
+            response['Cache-Control'] = f'public, max-age={self.max_age}'
+            response['Last-Modified'] = http_date(static.mtime)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a random SALES_PROFILE_SAMPLE_RATE of the requests, and those whose SALES_PROFILE_HEADER carries
+    SALES_PROFILE_TOKEN, with the sampler of sales/profiling.py, saving the profile under the request's URL name.
+    With neither set the middleware is left out; otherwise a request that is not profiled costs a random number and
+    a header lookup. The content of a streaming response is produced after the profile ends and is not profiled
+    """
+    def __init__(self, get_response):
+        self.rate = settings.SALES_PROFILE_SAMPLE_RATE
+        self.token = settings.SALES_PROFILE_TOKEN
+        if self.rate <= 0 and not self.token:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.header = 'HTTP_' + settings.SALES_PROFILE_HEADER.upper().replace('-', '_')
+
+    def sampled(self, request):
+        requested = request.META.get(self.header)
+        if requested is not None and self.token:
+            return constant_time_compare(requested, self.token)
+        return random.random() < self.rate
+
+    def __call__(self, request):
+        if not self.sampled(request):
+            return self.get_response(request)
+        with Sampler(threading.get_ident()) as sampler:
+            response = self.get_response(request)
+        match = request.resolver_match
+        url_name = (match.url_name or match.view_name) if match else 'unresolved'
+        response['X-Sales-Profile'] = save_profile(sampler, url_name, request, response)
+        return response
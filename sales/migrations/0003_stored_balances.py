@@ -0,0 +1,60 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:54
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_balances(apps, schema_editor):
+    Customer = apps.get_model('sales', 'Customer')
+    Order = apps.get_model('sales', 'Order')
+    Payment = apps.get_model('sales', 'Payment')
+
+    def total(queryset, group_by, column):
+        return Coalesce(
+            Subquery(queryset.order_by().values(group_by).annotate(total=Sum(column)).values('total')),
+            0, output_field=models.DecimalField(max_digits=19, decimal_places=2)
+        )
+
+    order_paid = total(Payment.objects.filter(order=OuterRef('pk')), 'order', 'payment_amount')
+    Order.objects.update(paid_total=order_paid, balance=F('product_sale_price') - order_paid)
+
+    ordered = total(Order.objects.filter(customer=OuterRef('pk')), 'customer', 'product_sale_price')
+    paid = total(Payment.objects.filter(customer=OuterRef('pk')), 'customer', 'payment_amount')
+    Customer.objects.update(total_ordered=ordered, total_paid=paid, balance=ordered - paid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0002_auto_20191104_1535'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=19),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='total_ordered',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=19),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='total_paid',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=19),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=19),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='paid_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=19),
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0003_stored_balances'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date_bought', 'id'], name='sales_order_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['date_paid', 'id'], name='sales_payment_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:04
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_rollups(apps, schema_editor):
+    for rollup_name, source_name, key, date_field, amount_field in [
+        ('DailyProductSales', 'Order', 'product', 'date_bought', 'product_sale_price'),
+        ('DailyPaymentTotals', 'Payment', 'payment_type', 'date_paid', 'payment_amount'),
+    ]:
+        Rollup = apps.get_model('sales', rollup_name)
+        Source = apps.get_model('sales', source_name)
+        totals = Source.objects.order_by().annotate(day=TruncDate(date_field)).values('day', key).annotate(
+            total_count=Count('pk'), total_amount=Sum(amount_field)
+        )
+        Rollup.objects.bulk_create((
+            Rollup(date=total['day'], count=total['total_count'], amount=total['total_amount'], **{key: total[key]})
+            for total in totals.iterator()
+        ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0004_list_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('product', models.CharField(max_length=225)),
+            ],
+            options={
+                'verbose_name_plural': 'daily product sales',
+                'unique_together': {('date', 'product')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyPaymentTotals',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('payment_type', models.CharField(choices=[('Cash', 'Cash'), ('Card', 'Card')], max_length=25)),
+            ],
+            options={
+                'verbose_name_plural': 'daily payment totals',
+                'unique_together': {('date', 'payment_type')},
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
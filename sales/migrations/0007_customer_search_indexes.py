@@ -0,0 +1,20 @@
+from django.db import migrations
+
+# Case-insensitive indexes for the customer autocomplete. SQLite's LIKE ignores case, so it can only turn a prefix
+# match into an index range scan on an index with NOCASE collation, which Django's Meta.indexes can't declare.
+SEARCH_COLUMNS = ['first_name', 'last_name', 'email']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0006_row_versions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX sales_customer_{column}_search_idx ON sales_customer ({column} COLLATE NOCASE)',
+            f'DROP INDEX sales_customer_{column}_search_idx',
+        )
+        for column in SEARCH_COLUMNS
+    ]
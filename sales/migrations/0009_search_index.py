@@ -0,0 +1,72 @@
+from django.db import migrations
+
+# SQLite FTS5 full-text indexes over customers' names and emails and over order products. Both are external
+# content tables: they hold only the index and read the text back from the source table, and triggers on the
+# source table keep them in step with every INSERT, DELETE and UPDATE of an indexed column, whether it comes from
+# the ORM, a bulk write or raw SQL. Prefix indexes of 2 and 3 characters make search-as-you-type prefix queries
+# cheap.
+
+CUSTOMER_FTS = [
+    """CREATE VIRTUAL TABLE sales_customer_fts USING fts5(
+        first_name, last_name, email, content='sales_customer', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER sales_customer_fts_insert AFTER INSERT ON sales_customer BEGIN
+        INSERT INTO sales_customer_fts(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END""",
+    """CREATE TRIGGER sales_customer_fts_delete AFTER DELETE ON sales_customer BEGIN
+        INSERT INTO sales_customer_fts(sales_customer_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+    END""",
+    """CREATE TRIGGER sales_customer_fts_update AFTER UPDATE OF first_name, last_name, email ON sales_customer
+    WHEN old.first_name IS NOT new.first_name OR old.last_name IS NOT new.last_name OR old.email IS NOT new.email
+    BEGIN
+        INSERT INTO sales_customer_fts(sales_customer_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+        INSERT INTO sales_customer_fts(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END""",
+    "INSERT INTO sales_customer_fts(sales_customer_fts) VALUES ('rebuild')",
+]
+
+ORDER_FTS = [
+    """CREATE VIRTUAL TABLE sales_order_fts USING fts5(
+        product, content='sales_order', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER sales_order_fts_insert AFTER INSERT ON sales_order BEGIN
+        INSERT INTO sales_order_fts(rowid, product) VALUES (new.id, new.product);
+    END""",
+    """CREATE TRIGGER sales_order_fts_delete AFTER DELETE ON sales_order BEGIN
+        INSERT INTO sales_order_fts(sales_order_fts, rowid, product) VALUES ('delete', old.id, old.product);
+    END""",
+    # only a change of product touches the index, not the balance updates every payment makes
+    """CREATE TRIGGER sales_order_fts_update AFTER UPDATE OF product ON sales_order
+    WHEN old.product IS NOT new.product BEGIN
+        INSERT INTO sales_order_fts(sales_order_fts, rowid, product) VALUES ('delete', old.id, old.product);
+        INSERT INTO sales_order_fts(rowid, product) VALUES (new.id, new.product);
+    END""",
+    "INSERT INTO sales_order_fts(sales_order_fts) VALUES ('rebuild')",
+]
+
+
+def _drop(table):
+    return [
+        f'DROP TRIGGER IF EXISTS {table}_fts_insert',
+        f'DROP TRIGGER IF EXISTS {table}_fts_delete',
+        f'DROP TRIGGER IF EXISTS {table}_fts_update',
+        f'DROP TABLE IF EXISTS {table}_fts',
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0008_payment_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CUSTOMER_FTS, _drop('sales_customer')),
+        migrations.RunSQL(ORDER_FTS, _drop('sales_order')),
+    ]
@@ -0,0 +1,231 @@
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+
+# Moves Order.product from free text to a foreign key into a new Product table. The distinct product strings are
+# grouped case- and whitespace-insensitively, each group becomes one Product named after its most used spelling,
+# and the orders are then pointed at their product a range of ids at a time through a temporary spelling -> product
+# table. That bounds each UPDATE, not the migration: on SQLite, removing the text column and making the foreign key
+# required each remake the whole orders table (a copy of every row into a new table), as does renaming the column
+# before SQLite 3.25, all in the migration's one transaction, so the migration takes time and disk in proportion
+# to the orders table. The daily product rollups are keyed by the product id from here on, and the order search
+# index moves to the products.
+
+BATCH_SIZE = 20000
+
+ORDER_FTS = [
+    """CREATE VIRTUAL TABLE sales_order_fts USING fts5(
+        product, content='sales_order', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER sales_order_fts_insert AFTER INSERT ON sales_order BEGIN
+        INSERT INTO sales_order_fts(rowid, product) VALUES (new.id, new.product);
+    END""",
+    """CREATE TRIGGER sales_order_fts_delete AFTER DELETE ON sales_order BEGIN
+        INSERT INTO sales_order_fts(sales_order_fts, rowid, product) VALUES ('delete', old.id, old.product);
+    END""",
+    """CREATE TRIGGER sales_order_fts_update AFTER UPDATE OF product ON sales_order
+    WHEN old.product IS NOT new.product BEGIN
+        INSERT INTO sales_order_fts(sales_order_fts, rowid, product) VALUES ('delete', old.id, old.product);
+        INSERT INTO sales_order_fts(rowid, product) VALUES (new.id, new.product);
+    END""",
+    "INSERT INTO sales_order_fts(sales_order_fts) VALUES ('rebuild')",
+]
+
+PRODUCT_FTS = [
+    """CREATE VIRTUAL TABLE sales_product_fts USING fts5(
+        name, sku, content='sales_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER sales_product_fts_insert AFTER INSERT ON sales_product BEGIN
+        INSERT INTO sales_product_fts(rowid, name, sku) VALUES (new.id, new.name, new.sku);
+    END""",
+    """CREATE TRIGGER sales_product_fts_delete AFTER DELETE ON sales_product BEGIN
+        INSERT INTO sales_product_fts(sales_product_fts, rowid, name, sku) VALUES ('delete', old.id, old.name, old.sku);
+    END""",
+    """CREATE TRIGGER sales_product_fts_update AFTER UPDATE OF name, sku ON sales_product
+    WHEN old.name IS NOT new.name OR old.sku IS NOT new.sku BEGIN
+        INSERT INTO sales_product_fts(sales_product_fts, rowid, name, sku) VALUES ('delete', old.id, old.name, old.sku);
+        INSERT INTO sales_product_fts(rowid, name, sku) VALUES (new.id, new.name, new.sku);
+    END""",
+    "INSERT INTO sales_product_fts(sales_product_fts) VALUES ('rebuild')",
+]
+
+
+def _drop(table):
+    return [
+        f'DROP TRIGGER IF EXISTS {table}_fts_insert',
+        f'DROP TRIGGER IF EXISTS {table}_fts_delete',
+        f'DROP TRIGGER IF EXISTS {table}_fts_update',
+        f'DROP TABLE IF EXISTS {table}_fts',
+    ]
+
+
+def _normalize(spelling):
+    return ' '.join(spelling.split()).casefold()
+
+
+def _id_ranges(model):
+    bounds = model.objects.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return
+    for start in range(bounds['first'], bounds['last'] + 1, BATCH_SIZE):
+        yield start, start + BATCH_SIZE - 1
+
+
+def link_products(apps, schema_editor):
+    Order = apps.get_model('sales', 'Order')
+    Product = apps.get_model('sales', 'Product')
+    quote = schema_editor.quote_name
+
+    # most used spelling first, so that it names its product
+    spellings = Order.objects.order_by().values('product').annotate(
+        orders=Count('pk'), price=Max('product_sale_price')
+    ).order_by('-orders', 'product')
+    products, product_of = {}, {}
+    for row in spellings.iterator():
+        key = _normalize(row['product'])
+        if key not in products:
+            products[key] = Product(
+                name=' '.join(row['product'].split()), sku=f'P{len(products) + 1:06d}', list_price=0,
+            )
+        # the highest price any spelling of the product was sold at
+        products[key].list_price = max(products[key].list_price, row['price'] or 0)
+        product_of[row['product']] = key
+    if '' in products:
+        # the blank spellings need a name that no other product has
+        names = {product.name for product in products.values()}
+        placeholder, number = 'Unnamed product', 1
+        while placeholder in names:
+            number += 1
+            placeholder = f'Unnamed product {number}'
+        products[''].name = placeholder
+    Product.objects.bulk_create(products.values(), batch_size=500)
+    ids = dict(Product.objects.values_list('sku', 'pk'))
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE sales_product_spelling (spelling TEXT PRIMARY KEY, product_id INTEGER)')
+        cursor.executemany('INSERT INTO sales_product_spelling VALUES (%s, %s)', [
+            (spelling, ids[products[key].sku]) for spelling, key in product_of.items()
+        ])
+        for start, end in _id_ranges(Order):
+            cursor.execute(
+                f'UPDATE {quote(Order._meta.db_table)} SET product_ref_id = ('
+                f'SELECT product_id FROM sales_product_spelling WHERE spelling = product'
+                f') WHERE id BETWEEN %s AND %s',
+                [start, end],
+            )
+        cursor.execute('DROP TABLE sales_product_spelling')
+
+
+def unlink_products(apps, schema_editor):
+    Order = apps.get_model('sales', 'Order')
+    Product = apps.get_model('sales', 'Product')
+    for product in Product.objects.iterator():
+        Order.objects.filter(product_ref=product).update(product=product.name)
+
+
+def rebuild_product_sales(apps, schema_editor):
+    Rollup = apps.get_model('sales', 'DailyProductSales')
+    Order = apps.get_model('sales', 'Order')
+    Rollup.objects.all().delete()
+    totals = Order.objects.order_by().annotate(day=TruncDate('date_bought')).values('day', 'product').annotate(
+        total_count=Count('pk'), total_amount=Sum('product_sale_price')
+    )
+    Rollup.objects.bulk_create((
+        Rollup(date=total['day'], count=total['total_count'], amount=total['total_amount'],
+               product_id=total['product'])
+        for total in totals.iterator()
+    ), batch_size=500)
+
+
+def clear_product_sales(apps, schema_editor):
+    apps.get_model('sales', 'DailyProductSales').objects.all().delete()
+
+
+def rebuild_product_sales_by_name(apps, schema_editor):
+    Rollup = apps.get_model('sales', 'DailyProductSales')
+    Order = apps.get_model('sales', 'Order')
+    totals = Order.objects.order_by().annotate(day=TruncDate('date_bought')).values('day', 'product').annotate(
+        total_count=Count('pk'), total_amount=Sum('product_sale_price')
+    )
+    Rollup.objects.bulk_create((
+        Rollup(date=total['day'], count=total['total_count'], amount=total['total_amount'], product=total['product'])
+        for total in totals.iterator()
+    ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0009_search_index'),
+    ]
+
+    operations = [
+        # only run when migrating backwards, last, once the rollups are keyed by product name again
+        migrations.RunPython(migrations.RunPython.noop, rebuild_product_sales_by_name),
+        migrations.RunSQL(_drop('sales_order'), ORDER_FTS),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=225, unique=True)),
+                ('sku', models.CharField(max_length=64, unique=True, verbose_name='SKU')),
+                ('list_price', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('version', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='product_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='sales.Product'),
+        ),
+        migrations.RunPython(link_products, unlink_products),
+        # a default for the text column to be recreated with when migrating backwards, no change to the table
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='order',
+                name='product',
+                field=models.CharField(default='', max_length=225),
+            ),
+        ]),
+        migrations.RemoveField(
+            model_name='order',
+            name='product',
+        ),
+        migrations.RenameField(
+            model_name='order',
+            old_name='product_ref',
+            new_name='product',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='sales.Product'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyproductsales',
+            unique_together=set(),
+        ),
+        migrations.RemoveField(
+            model_name='dailyproductsales',
+            name='product',
+        ),
+        migrations.AddField(
+            model_name='dailyproductsales',
+            name='product',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='sales.Product'),
+        ),
+        migrations.RunPython(rebuild_product_sales, clear_product_sales),
+        migrations.AlterField(
+            model_name='dailyproductsales',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sales.Product'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyproductsales',
+            unique_together={('date', 'product')},
+        ),
+        migrations.RunSQL(PRODUCT_FTS, _drop('sales_product')),
+    ]
@@ -0,0 +1,113 @@
+from django.db import migrations
+import sales.fields
+
+# Amounts move from DECIMAL columns to whole cents in BIGINT columns (see sales/fields.py). The values are scaled
+# while the columns are still decimal, so that no database rounds cents away when the column type changes, and on
+# the way down they are scaled back once the columns are decimal again.
+#
+# SQLite changes a column's type by copying the table, and the triggers and indexes created with raw SQL on
+# sales_customer (the search indexes of 0007, the full-text index triggers of 0009) don't survive the copy, so they
+# are dropped first and created again at the end. The full-text index itself keeps its content.
+
+MONEY_COLUMNS = {
+    'sales_customer': ['total_ordered', 'total_paid', 'balance'],
+    'sales_order': ['product_sale_price', 'paid_total', 'balance'],
+    'sales_payment': ['payment_amount'],
+    'sales_dailyproductsales': ['amount'],
+    'sales_dailypaymenttotals': ['amount'],
+}
+
+CUSTOMER_SEARCH_INDEXES = [
+    f'CREATE INDEX sales_customer_{column}_search_idx ON sales_customer ({column} COLLATE NOCASE)'
+    for column in ['first_name', 'last_name', 'email']
+]
+
+CUSTOMER_FTS_TRIGGERS = [
+    """CREATE TRIGGER sales_customer_fts_insert AFTER INSERT ON sales_customer BEGIN
+        INSERT INTO sales_customer_fts(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END""",
+    """CREATE TRIGGER sales_customer_fts_delete AFTER DELETE ON sales_customer BEGIN
+        INSERT INTO sales_customer_fts(sales_customer_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+    END""",
+    """CREATE TRIGGER sales_customer_fts_update AFTER UPDATE OF first_name, last_name, email ON sales_customer
+    WHEN old.first_name IS NOT new.first_name OR old.last_name IS NOT new.last_name OR old.email IS NOT new.email
+    BEGIN
+        INSERT INTO sales_customer_fts(sales_customer_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+        INSERT INTO sales_customer_fts(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END""",
+]
+
+DROP_CUSTOMER_SQL = [
+    f'DROP TRIGGER IF EXISTS sales_customer_fts_{event}' for event in ['insert', 'delete', 'update']
+] + [
+    f'DROP INDEX IF EXISTS sales_customer_{column}_search_idx' for column in ['first_name', 'last_name', 'email']
+]
+
+
+def _scale(expression):
+    return [
+        'UPDATE {} SET {}'.format(table, ', '.join(f'{column} = {expression.format(column)}' for column in columns))
+        for table, columns in MONEY_COLUMNS.items()
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0010_product_catalog'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DROP_CUSTOMER_SQL, CUSTOMER_SEARCH_INDEXES + CUSTOMER_FTS_TRIGGERS),
+        migrations.RunSQL(_scale('CAST(ROUND({} * 100) AS INTEGER)'), _scale('{} / 100.0')),
+        migrations.AlterField(
+            model_name='customer',
+            name='balance',
+            field=sales.fields.MoneyField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='total_ordered',
+            field=sales.fields.MoneyField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='total_paid',
+            field=sales.fields.MoneyField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='dailypaymenttotals',
+            name='amount',
+            field=sales.fields.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='dailyproductsales',
+            name='amount',
+            field=sales.fields.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='balance',
+            field=sales.fields.MoneyField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='paid_total',
+            field=sales.fields.MoneyField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='product_sale_price',
+            field=sales.fields.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_amount',
+            field=sales.fields.MoneyField(),
+        ),
+        migrations.RunSQL(CUSTOMER_SEARCH_INDEXES + CUSTOMER_FTS_TRIGGERS, DROP_CUSTOMER_SQL),
+    ]
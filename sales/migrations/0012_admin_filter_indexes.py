@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0011_money_in_cents'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['balance'], name='sales_order_balance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['payment_type'], name='sales_payment_type_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import sales.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0012_admin_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_sale_price', sales.fields.MoneyField()),
+                ('date_bought', models.DateTimeField()),
+                ('paid_total', sales.fields.MoneyField()),
+                ('balance', sales.fields.MoneyField()),
+                ('version', models.PositiveIntegerField()),
+                ('archived_at', models.DateTimeField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='sales.Customer')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='sales.Product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CarryForward',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='sales.Customer')),
+                ('total_ordered', sales.fields.MoneyField(default=0)),
+                ('total_paid', sales.fields.MoneyField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_type', models.CharField(choices=[('Cash', 'Cash'), ('Card', 'Card')], max_length=25)),
+                ('payment_amount', sales.fields.MoneyField()),
+                ('date_paid', models.DateTimeField()),
+                ('version', models.PositiveIntegerField()),
+                ('idempotency_key', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+                ('archived_at', models.DateTimeField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='sales.Customer')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='sales.ArchivedOrder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedpayment',
+            index=models.Index(fields=['date_paid', 'id'], name='sales_archpayment_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['date_bought', 'id'], name='sales_archorder_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['customer', 'date_bought'], name='sales_archorder_customer_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import sales.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0013_archive_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('total_ordered', sales.fields.MoneyField(default=0)),
+                ('total_paid', sales.fields.MoneyField(default=0)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sales.Customer')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='balancesnapshot',
+            index=models.Index(fields=['date'], name='sales_snapshot_date_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='balancesnapshot',
+            unique_together={('customer', 'date')},
+        ),
+    ]
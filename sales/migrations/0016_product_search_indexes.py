@@ -0,0 +1,21 @@
+from django.db import migrations
+
+# Case-insensitive indexes for the product autocomplete, like the customer ones of migration 0007. The unique
+# indexes on name and sku use the default BINARY collation, which SQLite can't use for the case-insensitive LIKE
+# that istartswith compiles to.
+SEARCH_COLUMNS = ['name', 'sku']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0015_jobs'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX sales_product_{column}_search_idx ON sales_product ({column} COLLATE NOCASE)',
+            f'DROP INDEX sales_product_{column}_search_idx',
+        )
+        for column in SEARCH_COLUMNS
+    ]
@@ -1,28 +1,375 @@
+import datetime
 import decimal
 
-from django.db import models
-from django.db.models import Sum
-from django.db.models.functions import Coalesce
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
 from django.utils import timezone
 
+from .fields import MoneyField, to_cents
+
+
+# Customer and Order carry stored balance columns (total_ordered/total_paid/balance and paid_total/balance).
+# Single-object writes keep them up to date with F() deltas inside the same transaction as the write, and the
+# QuerySet bulk paths (bulk_create, bulk_update, update, delete) recompute the affected rows in one set-based UPDATE.
+# `manage.py recompute_balances` rebuilds and checks every stored balance from scratch.
+#
+# The daily rollup tables (DailyProductSales, DailyPaymentTotals) are maintained the same way: single-object writes
+# move their counters by the delta, bulk paths rebuild the days they touched.
+#
+# Settled orders and their payments are eventually moved to the archive tables by sales/archive.py. What they added
+# to their customer's totals is kept in CarryForward, which the balance recomputation adds back in, and the rollup
+# rebuilds read the archive tables alongside the hot ones, so archiving changes neither.
+#
+# Orders and payments are normally written on the day they are dated, after every BalanceSnapshot. A write that
+# changes an earlier day discards the snapshots from that day on.
+#
+# Every amount is a MoneyField, stored in whole cents, so the deltas below are integer additions and the totals
+# integer sums in the database.
+
+def _order_total_subquery(outer='pk'):
+    return Coalesce(
+        Subquery(
+            Order.objects.filter(customer=OuterRef(outer)).order_by().values('customer')
+            .annotate(total=Sum('product_sale_price')).values('total')
+        ),
+        0, output_field=MoneyField()
+    )
+
+
+def _payment_total_subquery(lookup, outer='pk'):
+    return Coalesce(
+        Subquery(
+            Payment.objects.filter(**{lookup: OuterRef(outer)}).order_by().values(lookup)
+            .annotate(total=Sum('payment_amount')).values('total')
+        ),
+        0, output_field=MoneyField()
+    )
+
+
+def _carried_subquery(field, outer='pk'):
+    return Coalesce(
+        Subquery(CarryForward.objects.filter(customer=OuterRef(outer)).values(field)), 0, output_field=MoneyField()
+    )
+
+
+def _apply_order_delta(customer_id, amount):
+    amount = to_cents(amount)
+    Customer.objects.filter(pk=customer_id).update(
+        total_ordered=F('total_ordered') + amount, balance=F('balance') + amount
+    )
+
+
+def _apply_payment_delta(order_id, customer_id, amount):
+    amount = to_cents(amount)
+    Order.objects.filter(pk=order_id).update(paid_total=F('paid_total') + amount, balance=F('balance') - amount)
+    Customer.objects.filter(pk=customer_id).update(total_paid=F('total_paid') + amount, balance=F('balance') - amount)
+
+
+def _recompute_balances(model, ids, batch_size=500):
+    """
+    Recomputes the stored balances of the given primary keys, a batch at a time to stay under SQLite's limit on
+    query parameters
+    """
+    ids = sorted(pk for pk in set(ids) if pk is not None)
+    for start in range(0, len(ids), batch_size):
+        model.objects.filter(pk__in=ids[start:start + batch_size]).recompute_balances()
+
+
+def _bump_versions(model, ids, batch_size=500):
+    ids = sorted(pk for pk in set(ids) if pk is not None)
+    for start in range(0, len(ids), batch_size):
+        model.objects.filter(pk__in=ids[start:start + batch_size]).update(version=F('version') + 1)
+
+
+def _save_with_new_version(instance, save, update_fields, *args, **kwargs):
+    """
+    Saves the `update_fields` of an existing row with its version moved on in the same UPDATE, then reads the new
+    version back
+    """
+    kwargs['update_fields'] = set(update_fields) | {'version'}
+    instance.version = F('version') + 1
+    save(*args, **kwargs)
+    instance.refresh_from_db(fields=['version'])
+
+
+def _column_values(model, column, pks, batch_size=500):
+    pks = list(pks)
+    values = set()
+    for start in range(0, len(pks), batch_size):
+        values.update(model.objects.filter(pk__in=pks[start:start + batch_size]).values_list(column, flat=True))
+    return values
+
+
+def day_start(day):
+    """
+    The aware datetime at which a local calendar day starts, for filtering datetime columns by date while still
+    using their indexes
+    """
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _days_of(model, field, pks, batch_size=500):
+    pks = list(pks)
+    days = set()
+    for start in range(0, len(pks), batch_size):
+        days.update(
+            model.objects.filter(pk__in=pks[start:start + batch_size]).order_by()
+            .annotate(day=TruncDate(field)).values_list('day', flat=True).distinct()
+        )
+    return days
+
+
+def _refresh_cached_balances(instance, *relations):
+    """
+    Reloads the balance columns of related objects already cached on the instance, so that code holding on to
+    them (views, tests, the admin) sees the values written by the F() updates above
+    """
+    for name in relations:
+        field = instance._meta.get_field(name)
+        if field.is_cached(instance):
+            related = getattr(instance, name)
+            if related is not None and related.pk is not None:
+                related.refresh_from_db(fields=related.BALANCE_FIELDS + ['version'])
+
+
+class VersionedQuerySet(models.QuerySet):
+    """
+    Moves on the version of every row a bulk write changes, which is what the cached list fragments are keyed by
+    """
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            result = super().bulk_update(objs, fields, *args, **kwargs)
+            _bump_versions(self.model, [obj.pk for obj in objs])
+        return result
+
+    def update(self, **kwargs):
+        kwargs.setdefault('version', F('version') + 1)
+        return super().update(**kwargs)
+
+
+class CustomerQuerySet(VersionedQuerySet):
+    def with_balances(self, live=False):
+        """
+        Customers ready to be listed with their balances. The balances are stored columns, so they come with the
+        rows themselves; live=True aggregates them from the Order and Payment tables in the same query instead
+        """
+        return self.with_computed_balances() if live else self
+
+    def with_computed_balances(self):
+        """
+        Annotates each customer with totals aggregated live from the Order and Payment tables, for checking the
+        stored columns against
+        """
+        return self.annotate(
+            computed_total_ordered=_order_total_subquery() + _carried_subquery('total_ordered'),
+            computed_total_paid=_payment_total_subquery('customer') + _carried_subquery('total_paid'),
+        )
+
+    def recompute_balances(self):
+        """
+        Rebuilds the stored totals of the selected customers from the Order, Payment and CarryForward tables in a
+        single UPDATE
+        """
+        ordered = _order_total_subquery() + _carried_subquery('total_ordered')
+        paid = _payment_total_subquery('customer') + _carried_subquery('total_paid')
+        return self.update(total_ordered=ordered, total_paid=paid, balance=ordered - paid)
+
+class OrderQuerySet(models.QuerySet):
+    BALANCE_SOURCES = {'customer', 'customer_id', 'product_sale_price'}
+    ROLLUP_SOURCES = {'product', 'product_id', 'product_sale_price', 'date_bought'}
+
+    def with_payment_totals(self, live=False):
+        """
+        Orders ready to be listed with their customer, product and payment totals in a single query
+        """
+        queryset = self.select_related('customer', 'product')
+        return queryset.with_computed_balances() if live else queryset
+
+    def with_computed_balances(self):
+        return self.annotate(computed_paid_total=_payment_total_subquery('order'))
+
+    def recompute_balances(self):
+        """
+        Rebuilds the stored payment totals of the selected orders from the Payment table in a single UPDATE
+        """
+        paid = _payment_total_subquery('order')
+        return self.update(paid_total=paid, balance=F('product_sale_price') - paid)
+
+    def _customer_ids(self):
+        return set(self.order_by().values_list('customer_id', flat=True).distinct())
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            # a new order can't have payments yet
+            obj.paid_total = 0
+            obj.balance = obj.product_sale_price
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            _recompute_balances(Customer, [obj.customer_id for obj in objs])
+            DailyProductSales.rebuild_days(timezone.localdate(obj.date_bought) for obj in objs)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        balances = self.BALANCE_SOURCES.intersection(fields)
+        rollups = self.ROLLUP_SOURCES.intersection(fields)
+        with transaction.atomic(using=self.db, savepoint=False):
+            pks = [obj.pk for obj in objs]
+            customer_ids = _column_values(Order, 'customer_id', pks) if balances else set()
+            days = _days_of(Order, 'date_bought', pks) if balances or rollups else set()
+            result = super().bulk_update(objs, fields, *args, **kwargs)
+            _bump_versions(Order, pks)
+            if balances:
+                _recompute_balances(Order, pks)
+                _recompute_balances(Customer, customer_ids | {obj.customer_id for obj in objs})
+            if rollups:
+                days |= _days_of(Order, 'date_bought', pks)
+                DailyProductSales.rebuild_days(days)
+            BalanceSnapshot.discard_from(days)
+        return result
+
+    def update(self, **kwargs):
+        kwargs.setdefault('version', F('version') + 1)
+        balances = self.BALANCE_SOURCES.intersection(kwargs)
+        rollups = self.ROLLUP_SOURCES.intersection(kwargs)
+        if not (balances or rollups):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            pks = list(self.values_list('pk', flat=True))
+            customer_ids = self._customer_ids() if balances else set()
+            days = _days_of(Order, 'date_bought', pks) if balances or rollups else set()
+            rows = super().update(**kwargs)
+            if balances:
+                customer_ids |= _column_values(Order, 'customer_id', pks)
+                _recompute_balances(Order, pks)
+                _recompute_balances(Customer, customer_ids)
+            if rollups:
+                days |= _days_of(Order, 'date_bought', pks)
+                DailyProductSales.rebuild_days(days)
+            BalanceSnapshot.discard_from(days)
+        return rows
+
+    def delete(self):
+        with transaction.atomic(using=self.db, savepoint=False):
+            customer_ids = self._customer_ids()
+            days = set(self.order_by().annotate(day=TruncDate('date_bought')).values_list('day', flat=True).distinct())
+            deleted = super().delete()
+            _recompute_balances(Customer, customer_ids)
+            DailyProductSales.rebuild_days(days)
+            BalanceSnapshot.discard_from(days)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class PaymentQuerySet(models.QuerySet):
+    BALANCE_SOURCES = {'order', 'order_id', 'customer', 'customer_id', 'payment_amount'}
+    ROLLUP_SOURCES = {'payment_type', 'payment_amount', 'date_paid'}
+
+    def with_related(self):
+        """
+        Payments ready to be listed with their order, the order's customer and their own customer in a single query
+        """
+        return self.select_related('order__customer', 'customer')
+
+    def _affected_ids(self):
+        rows = self.order_by().values_list('order_id', 'customer_id').distinct()
+        return {order_id for order_id, _ in rows}, {customer_id for _, customer_id in rows}
+
+    def _recompute(self, order_ids, customer_ids):
+        _recompute_balances(Order, order_ids)
+        _recompute_balances(Customer, customer_ids)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            self._recompute({obj.order_id for obj in objs}, {obj.customer_id for obj in objs})
+            DailyPaymentTotals.rebuild_days(timezone.localdate(obj.date_paid) for obj in objs)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        balances = self.BALANCE_SOURCES.intersection(fields)
+        rollups = self.ROLLUP_SOURCES.intersection(fields)
+        with transaction.atomic(using=self.db, savepoint=False):
+            pks = [obj.pk for obj in objs]
+            order_ids = _column_values(Payment, 'order_id', pks) if balances else set()
+            customer_ids = _column_values(Payment, 'customer_id', pks) if balances else set()
+            days = _days_of(Payment, 'date_paid', pks) if balances or rollups else set()
+            result = super().bulk_update(objs, fields, *args, **kwargs)
+            _bump_versions(Payment, pks)
+            if balances:
+                self._recompute(order_ids | {obj.order_id for obj in objs},
+                                customer_ids | {obj.customer_id for obj in objs})
+            if rollups:
+                days |= _days_of(Payment, 'date_paid', pks)
+                DailyPaymentTotals.rebuild_days(days)
+            BalanceSnapshot.discard_from(days)
+        return result
+
+    def update(self, **kwargs):
+        kwargs.setdefault('version', F('version') + 1)
+        balances = self.BALANCE_SOURCES.intersection(kwargs)
+        rollups = self.ROLLUP_SOURCES.intersection(kwargs)
+        if not (balances or rollups):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            pks = list(self.values_list('pk', flat=True))
+            order_ids, customer_ids = self._affected_ids() if balances else (set(), set())
+            days = _days_of(Payment, 'date_paid', pks) if balances or rollups else set()
+            rows = super().update(**kwargs)
+            if balances:
+                self._recompute(order_ids | _column_values(Payment, 'order_id', pks),
+                                customer_ids | _column_values(Payment, 'customer_id', pks))
+            if rollups:
+                days |= _days_of(Payment, 'date_paid', pks)
+                DailyPaymentTotals.rebuild_days(days)
+            BalanceSnapshot.discard_from(days)
+        return rows
+
+    def delete(self):
+        with transaction.atomic(using=self.db, savepoint=False):
+            order_ids, customer_ids = self._affected_ids()
+            days = set(self.order_by().annotate(day=TruncDate('date_paid')).values_list('day', flat=True).distinct())
+            deleted = super().delete()
+            self._recompute(order_ids, customer_ids)
+            DailyPaymentTotals.rebuild_days(days)
+            BalanceSnapshot.discard_from(days)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
 
 class Customer(models.Model):
+    BALANCE_FIELDS = ['total_ordered', 'total_paid', 'balance']
+
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     email = models.CharField(max_length=100)
+    # maintained by Order and Payment writes, never edited directly
+    total_ordered = MoneyField(default=0, editable=False)
+    total_paid = MoneyField(default=0, editable=False)
+    balance = MoneyField(default=0, editable=False)
+    # moved on by every write to the row, the cached list fragments are keyed by it
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CustomerQuerySet.as_manager()
 
     def amount_owed(self):
         """"
-        This function fetches the total value of all the orders (from the Orders table) then subtracts the total value
-        of all the payments (from the Payments table) to calculate the total amount a customer owes
+        The total value of all the customer's orders minus the total value of all their payments. This is read from
+        the stored balance column, which every Order and Payment write keeps up to date, or from the live totals
+        annotated by Customer.objects.with_balances(live=True)
         """
-        total_cust_orders = Order.objects.filter(customer=self).aggregate(
-            order_total=Coalesce(Sum('product_sale_price', output_field=models.DecimalField()), 0)
-        ).get('order_total')
-        total_cust_payments = Payment.objects.filter(customer=self).aggregate(
-            payments_total=Coalesce(Sum('payment_amount', output_field=models.DecimalField()), 0)
-        ).get('payments_total')
-        return total_cust_orders - total_cust_payments
+        if hasattr(self, 'computed_total_ordered'):
+            return self.computed_total_ordered - self.computed_total_paid
+        return self.balance
 
     amount_owed = property(amount_owed)
 
@@ -31,32 +378,118 @@ class Customer(models.Model):
 
     full_name = property(full_name)
 
+    def save(self, *args, **kwargs):
+        if self._state.adding or kwargs.get('force_insert'):
+            return super().save(*args, **kwargs)
+        # the stored balances belong to the Order and Payment writes, an update must not write back a stale copy
+        update_fields = kwargs.pop('update_fields', None)
+        if update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        _save_with_new_version(self, super().save, set(update_fields) - set(self.BALANCE_FIELDS), *args, **kwargs)
+
     def __str__(self):
         return f"Customer ID {self.pk}, {self.full_name}"
 
 
+class Product(models.Model):
+    name = models.CharField(max_length=225, unique=True)
+    sku = models.CharField('SKU', max_length=64, unique=True)
+    list_price = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = VersionedQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or kwargs.get('force_insert'):
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.pop('update_fields', None)
+        if update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        _save_with_new_version(self, super().save, update_fields, *args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
 class Order(models.Model):
+    BALANCE_FIELDS = ['paid_total', 'balance']
+
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
-    product = models.CharField(max_length=225)
-    product_sale_price = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+    product = models.ForeignKey(Product, on_delete=models.PROTECT)
+    product_sale_price = MoneyField(default=0)
     date_bought = models.DateTimeField(auto_now_add=True, blank=True)
+    # maintained by Payment writes, never edited directly
+    paid_total = MoneyField(default=0, editable=False)
+    balance = MoneyField(default=0, editable=False)
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the keyset pagination order of the order list
+            models.Index(fields=['date_bought', 'id'], name='sales_order_date_id_idx'),
+            # open and settled orders, for the aging report and the admin's settled filter
+            models.Index(fields=['balance'], name='sales_order_balance_idx'),
+        ]
 
     def amount_owed(self):
         """
         This function looks at the sale price of an item in the order then subtracts the amount paid for that order
-        (derived from the Payment table) to calculate the amount the customer owes for this order
+        (the stored total of the Payment table) to calculate the amount the customer owes for this order
         """
-        return decimal.Decimal(self.product_sale_price) - decimal.Decimal(self.payments_total)
+        return self.product_sale_price - self.payments_total
 
     amount_owed = property(amount_owed)
 
     def payments_total(self):
-        return Payment.objects.filter(order=self).aggregate(
-            payments_total=Coalesce(Sum('payment_amount', output_field=models.DecimalField()), 0)
-        ).get('payments_total')
+        # prefer the live total annotated by Order.objects.with_payment_totals(live=True)
+        return getattr(self, 'computed_paid_total', self.paid_total)
 
     payments_total = property(payments_total)
 
+    def save(self, *args, **kwargs):
+        self.product_sale_price = self._meta.get_field('product_sale_price').to_python(self.product_sale_price)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(self.BALANCE_FIELDS) | {'version'}
+        with transaction.atomic(using=kwargs.get('using')):
+            previous = None
+            if self.pk is not None:
+                previous = Order.objects.select_for_update().filter(pk=self.pk).values(
+                    'customer_id', 'product_id', 'product_sale_price', 'date_bought', 'paid_total', 'version'
+                ).first()
+            self.paid_total = previous['paid_total'] if previous else decimal.Decimal(0)
+            self.version = previous['version'] + 1 if previous else 0
+            self.balance = self.product_sale_price - self.paid_total
+            super().save(*args, **kwargs)
+            # take the previous version of the order out of the totals and put the new one in
+            if previous:
+                _apply_order_delta(previous['customer_id'], -previous['product_sale_price'])
+                DailyProductSales.add(
+                    previous['date_bought'], previous['product_id'], -1, -previous['product_sale_price']
+                )
+                BalanceSnapshot.discard_from(
+                    [timezone.localdate(previous['date_bought']), timezone.localdate(self.date_bought)]
+                )
+            _apply_order_delta(self.customer_id, self.product_sale_price)
+            DailyProductSales.add(self.date_bought, self.product_id, 1, self.product_sale_price)
+        _refresh_cached_balances(self, 'customer')
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            previous = Order.objects.select_for_update().filter(pk=self.pk).values(
+                'customer_id', 'product_id', 'product_sale_price', 'date_bought'
+            ).first()
+            deleted = super().delete(*args, **kwargs)
+            if previous:
+                _apply_order_delta(previous['customer_id'], -previous['product_sale_price'])
+                DailyProductSales.add(
+                    previous['date_bought'], previous['product_id'], -1, -previous['product_sale_price']
+                )
+                BalanceSnapshot.discard_from([timezone.localdate(previous['date_bought'])])
+        _refresh_cached_balances(self, 'customer')
+        return deleted
+
     def __str__(self):
         return f"Order ID {self.pk}, {self.customer.full_name}, {self.product_sale_price}"
 
@@ -65,8 +498,287 @@ class Payment(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
     payment_type = models.CharField(max_length=25, choices=[('Cash', 'Cash'), ('Card', 'Card')], default='')
-    payment_amount = models.DecimalField(max_digits=19, decimal_places=2)
+    payment_amount = MoneyField()
     date_paid = models.DateTimeField(auto_now_add=True, blank=True)
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # set by the client posting the payment, a payment posted twice with the same key is only recorded once
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    objects = PaymentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the keyset pagination order of the payment list
+            models.Index(fields=['date_paid', 'id'], name='sales_payment_date_id_idx'),
+            # the admin's payment type filter
+            models.Index(fields=['payment_type'], name='sales_payment_type_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.payment_amount = self._meta.get_field('payment_amount').to_python(self.payment_amount)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'version'}
+        with transaction.atomic(using=kwargs.get('using')):
+            previous = None
+            if self.pk is not None:
+                previous = Payment.objects.select_for_update().filter(pk=self.pk).values(
+                    'order_id', 'customer_id', 'payment_type', 'payment_amount', 'date_paid', 'version'
+                ).first()
+            self.version = previous['version'] + 1 if previous else 0
+            super().save(*args, **kwargs)
+            # take the previous version of the payment out of the totals and put the new one in
+            if previous:
+                self._undo(previous)
+                BalanceSnapshot.discard_from([timezone.localdate(self.date_paid)])
+            _apply_payment_delta(self.order_id, self.customer_id, self.payment_amount)
+            DailyPaymentTotals.add(self.date_paid, self.payment_type, 1, self.payment_amount)
+        _refresh_cached_balances(self, 'order', 'customer')
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            previous = Payment.objects.select_for_update().filter(pk=self.pk).values(
+                'order_id', 'customer_id', 'payment_type', 'payment_amount', 'date_paid'
+            ).first()
+            deleted = super().delete(*args, **kwargs)
+            if previous:
+                self._undo(previous)
+        _refresh_cached_balances(self, 'order', 'customer')
+        return deleted
+
+    @staticmethod
+    def _undo(previous):
+        _apply_payment_delta(previous['order_id'], previous['customer_id'], -previous['payment_amount'])
+        DailyPaymentTotals.add(previous['date_paid'], previous['payment_type'], -1, -previous['payment_amount'])
+        BalanceSnapshot.discard_from([timezone.localdate(previous['date_paid'])])
 
     def __str__(self):
         return f"Payment ID {self.pk} for Order ID {self.order.pk}, {self.customer.full_name}"
+
+
+class ArchivedOrderQuerySet(models.QuerySet):
+    def with_related(self):
+        return self.select_related('customer', 'product')
+
+
+class ArchivedOrder(models.Model):
+    """
+    A settled order moved out of the Order table, with its id and stored totals as they were
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    product = models.ForeignKey(Product, on_delete=models.PROTECT)
+    product_sale_price = MoneyField()
+    date_bought = models.DateTimeField()
+    paid_total = MoneyField()
+    balance = MoneyField()
+    version = models.PositiveIntegerField()
+    archived_at = models.DateTimeField()
+
+    objects = ArchivedOrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_bought', 'id'], name='sales_archorder_date_id_idx'),
+            models.Index(fields=['customer', 'date_bought'], name='sales_archorder_customer_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived Order ID {self.pk}, {self.customer.full_name}, {self.product_sale_price}"
+
+
+class ArchivedPaymentQuerySet(models.QuerySet):
+    def with_related(self):
+        return self.select_related('order__customer', 'customer')
+
+
+class ArchivedPayment(models.Model):
+    """
+    A payment of an archived order, moved out of the Payment table with it
+    """
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.PROTECT)
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    payment_type = models.CharField(max_length=25, choices=[('Cash', 'Cash'), ('Card', 'Card')])
+    payment_amount = MoneyField()
+    date_paid = models.DateTimeField()
+    version = models.PositiveIntegerField()
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    archived_at = models.DateTimeField()
+
+    objects = ArchivedPaymentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['date_paid', 'id'], name='sales_archpayment_date_id_idx')]
+
+    def __str__(self):
+        return f"Archived Payment ID {self.pk} for Order ID {self.order_id}, {self.customer.full_name}"
+
+
+class CarryForward(models.Model):
+    """
+    What a customer's archived orders and payments add to their totals, carried forward into the stored balances
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True)
+    total_ordered = MoneyField(default=0)
+    total_paid = MoneyField(default=0)
+
+    def balance(self):
+        return self.total_ordered - self.total_paid
+
+    balance = property(balance)
+
+
+class BalanceSnapshot(models.Model):
+    """
+    A customer's running totals, archived history included, at the end of a local calendar day (a month end, see
+    sales/statements.py). Every customer with any history by then has a row for the day
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    date = models.DateField()
+    total_ordered = MoneyField(default=0)
+    total_paid = MoneyField(default=0)
+
+    class Meta:
+        unique_together = [('customer', 'date')]
+        indexes = [models.Index(fields=['date'], name='sales_snapshot_date_idx')]
+
+    def balance(self):
+        return self.total_ordered - self.total_paid
+
+    balance = property(balance)
+
+    @classmethod
+    def discard_from(cls, days):
+        """
+        Drops the snapshots of the earliest of the days and after, which a write dated on those days has made stale.
+        `snapshot_balances` takes them again
+        """
+        days = [day for day in days if day is not None]
+        if days:
+            cls.objects.filter(date__gte=min(days)).delete()
+
+
+class DailyRollup(models.Model):
+    """
+    A counter and an amount per local calendar day and `KEY`, summed from the rows of the `SOURCES` models (the hot
+    table and its archive)
+    """
+    date = models.DateField()
+    count = models.IntegerField(default=0)
+    amount = MoneyField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def add(cls, moment, key, count, amount):
+        """
+        Moves the counters of the day of `moment` by the given deltas
+        """
+        lookup = {'date': timezone.localdate(moment), cls.KEY: key}
+        if not cls.objects.filter(**lookup).update(count=F('count') + count, amount=F('amount') + to_cents(amount)):
+            cls.objects.create(**lookup, count=count, amount=amount)
+        elif count < 0:
+            cls.objects.filter(**lookup, count=0).delete()
+
+    @classmethod
+    def rebuild(cls, start=None, end=None):
+        """
+        Recomputes the rollup rows of the days from `start` to `end` inclusive (all of them by default) from the
+        source table, in one grouped query
+        """
+        rollups = cls.objects.all()
+        if start is not None:
+            rollups = rollups.filter(date__gte=start)
+        if end is not None:
+            rollups = rollups.filter(date__lte=end)
+        with transaction.atomic():
+            totals = {}
+            for model, date_field, amount_field in cls.SOURCES:
+                rows = model.objects.order_by()
+                if start is not None:
+                    rows = rows.filter(**{f'{date_field}__gte': day_start(start)})
+                if end is not None:
+                    rows = rows.filter(**{f'{date_field}__lt': day_start(end + datetime.timedelta(days=1))})
+                grouped = rows.annotate(day=TruncDate(date_field)).values('day', cls.KEY).annotate(
+                    total_count=Count('pk'), total_amount=Sum(amount_field)
+                )
+                for total in grouped.iterator():
+                    count, amount = totals.get((total['day'], total[cls.KEY]), (0, 0))
+                    totals[total['day'], total[cls.KEY]] = (
+                        count + total['total_count'], amount + total['total_amount']
+                    )
+            rollups.delete()
+            cls.objects.bulk_create((
+                cls(date=day, count=count, amount=amount, **{cls.KEY: key})
+                for (day, key), (count, amount) in totals.items()
+            ), batch_size=500)
+
+    @classmethod
+    def rebuild_days(cls, days):
+        days = set(days)
+        if days:
+            cls.rebuild(min(days), max(days))
+
+
+class DailyProductSales(DailyRollup):
+    """
+    Orders placed and their revenue per day and product
+    """
+    KEY = 'product_id'
+    SOURCES = [(Order, 'date_bought', 'product_sale_price'), (ArchivedOrder, 'date_bought', 'product_sale_price')]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = [('date', 'product')]
+        verbose_name_plural = 'daily product sales'
+
+
+class DailyPaymentTotals(DailyRollup):
+    """
+    Payments received and their total per day and payment type
+    """
+    KEY = 'payment_type'
+    SOURCES = [(Payment, 'date_paid', 'payment_amount'), (ArchivedPayment, 'date_paid', 'payment_amount')]
+
+    payment_type = models.CharField(max_length=25, choices=[('Cash', 'Cash'), ('Card', 'Card')])
+
+    class Meta:
+        unique_together = [('date', 'payment_type')]
+        verbose_name_plural = 'daily payment totals'
+
+
+class Job(models.Model):
+    """
+    A heavy task queued for `manage.py run_sales_worker` (see sales/jobs.py), with its progress and outcome
+    """
+    QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=40)
+    # the task's arguments as a JSON object
+    params = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    # paths relative to SALES_JOB_FILES_DIR
+    input_file = models.CharField(max_length=200, blank=True)
+    result_file = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'], name='sales_job_queue_idx')]
+
+    @property
+    def finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    def __str__(self):
+        return f"Job ID {self.pk}, {self.kind}, {self.status}"
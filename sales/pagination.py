@@ -0,0 +1,131 @@
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+# Keyset (cursor) pagination for the list views. A page is fetched by filtering on the ordering key of the last row
+# seen instead of using OFFSET, so every page costs one indexed range query however deep it is, and no COUNT(*) is
+# ever needed. Cursors are opaque to the templates: base64 encoded JSON holding the key values and a direction.
+
+
+def get_page_size(request):
+    """
+    Reads the page size from the ?page_size= parameter, falling back to SALES_PAGE_SIZE and capped at
+    SALES_MAX_PAGE_SIZE
+    """
+    default = settings.SALES_PAGE_SIZE
+    maximum = settings.SALES_MAX_PAGE_SIZE
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except ValueError:
+        page_size = default
+    return max(1, min(page_size, maximum))
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        parsed = parse_datetime(value.get('dt', ''))
+        if parsed is None:
+            raise ValueError('invalid datetime in cursor')
+        return parsed
+    return value
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'k': [_encode_value(value) for value in values], 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    """
+    The key values and direction of a cursor, each value converted by the model field of its key. A cursor that
+    doesn't decode to values of the right types is not found
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+        keys, direction = payload['k'], payload['d']
+        if len(keys) != len(fields):
+            raise ValueError('wrong number of keys in cursor')
+        values = [field.to_python(_decode_value(value)) for field, value in zip(fields, keys)]
+    except (ValueError, TypeError, KeyError, AttributeError, ValidationError):
+        raise Http404('Invalid page cursor')
+    if direction not in ('next', 'prev') or None in values:
+        raise Http404('Invalid page cursor')
+    return values, direction
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor, page_size):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.page_size = page_size
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Pages through a queryset in ascending order of `keys`, the last of which must be unique (normally 'id')
+    """
+    def __init__(self, queryset, keys, page_size):
+        self.queryset = queryset
+        self.keys = list(keys)
+        self.fields = [queryset.model._meta.get_field(key) for key in self.keys]
+        self.page_size = page_size
+
+    def _after(self, values, operator):
+        # lexicographic comparison: (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        for i, key in enumerate(self.keys):
+            equal = {self.keys[j]: values[j] for j in range(i)}
+            condition |= Q(**equal, **{f'{key}__{operator}': values[i]})
+        return condition
+
+    def _key(self, obj):
+        return [getattr(obj, key) for key in self.keys]
+
+    def page(self, cursor=None):
+        queryset = self.queryset
+        direction = 'next'
+        if cursor:
+            values, direction = decode_cursor(cursor, self.fields)
+            queryset = queryset.filter(self._after(values, 'gt' if direction == 'next' else 'lt'))
+        ordering = self.keys if direction == 'next' else [f'-{key}' for key in self.keys]
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if direction == 'prev':
+            rows.reverse()
+            has_next, has_previous = bool(rows), has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor) and bool(rows)
+        next_cursor = encode_cursor(self._key(rows[-1]), 'next') if has_next and rows else None
+        previous_cursor = encode_cursor(self._key(rows[0]), 'prev') if has_previous and rows else None
+        return KeysetPage(rows, next_cursor, previous_cursor, self.page_size)
+
+
+def paginate(request, queryset, keys):
+    return KeysetPaginator(queryset, keys, get_page_size(request)).page(request.GET.get('cursor'))
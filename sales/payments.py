@@ -0,0 +1,87 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .models import Order, Payment
+
+SETTLE_BATCH_SIZE = 2000
+
+# Posting a payment from the payment page, the API or anything else that takes payments one at a time. Everything
+# the payment is checked against (the order's customer and remaining balance, an earlier payment with the same
+# idempotency key) is read inside the transaction that writes it, after the order row is locked: SELECT ... FOR
+# UPDATE where the database has row locks, and on SQLite the BEGIN IMMEDIATE the default connection starts every
+# transaction with, which takes the database write lock before the first read. Concurrent posts against the same
+# order therefore queue up instead of both passing the balance check, and the transaction stays a handful of
+# statements long so that the queue drains quickly.
+
+
+def _replay(payment, order_id, customer_id, payment_type, payment_amount):
+    if (payment.order_id, payment.customer_id, payment.payment_type, payment.payment_amount) != \
+            (order_id, customer_id, payment_type, payment_amount):
+        raise ValidationError(
+            'This idempotency key was already used for a different payment.', code='idempotency_conflict'
+        )
+    return payment, False
+
+
+def post_payment(order_id, customer_id, payment_type, payment_amount, idempotency_key=None):
+    """
+    Records a payment against an order, returning (payment, created). A payment posted again with the same
+    idempotency key is not recorded twice: the first one is returned with created=False. Raises ValidationError
+    when the order doesn't exist or belongs to another customer, or the amount isn't positive or exceeds what is
+    left to pay on the order
+    """
+    payment_amount = Payment._meta.get_field('payment_amount').to_python(payment_amount)
+    idempotency_key = idempotency_key or None
+    if payment_amount <= 0:
+        raise ValidationError('The payment amount must be positive.', code='invalid_amount')
+    try:
+        with transaction.atomic():
+            if idempotency_key:
+                previous = Payment.objects.filter(idempotency_key=idempotency_key).first()
+                if previous:
+                    return _replay(previous, order_id, customer_id, payment_type, payment_amount)
+            order = Order.objects.select_for_update().filter(pk=order_id).values('customer_id', 'balance').first()
+            if order is None:
+                raise ValidationError('This order does not exist.', code='invalid_order')
+            if order['customer_id'] != customer_id:
+                raise ValidationError('This order belongs to another customer.', code='customer_mismatch')
+            if payment_amount > order['balance']:
+                raise ValidationError(
+                    'The payment is more than the %(balance)s left to pay on this order.',
+                    code='overpayment', params={'balance': order['balance']},
+                )
+            payment = Payment(
+                order_id=order_id, customer_id=customer_id, payment_type=payment_type,
+                payment_amount=payment_amount, idempotency_key=idempotency_key,
+            )
+            payment.save()
+    except IntegrityError:
+        # another connection committed the same key between our lookup and insert, which row locks alone can't
+        # prevent on databases that don't lock the whole table for a write
+        previous = Payment.objects.filter(idempotency_key=idempotency_key).first() if idempotency_key else None
+        if previous is None:
+            raise
+        return _replay(previous, order_id, customer_id, payment_type, payment_amount)
+    return payment, True
+
+
+def settle_orders(orders, payment_type='Cash'):
+    """
+    Pays off the outstanding balance of every order in the queryset with one payment each, returning the number
+    of orders settled. The payments are inserted with bulk_create a batch at a time, which recomputes the stored
+    balances and rollups of each batch set-based
+    """
+    settled = 0
+    with transaction.atomic():
+        open_orders = orders.filter(balance__gt=0).order_by('pk').values_list('pk', 'customer_id', 'balance')
+        last_pk = 0
+        while True:
+            batch = list(open_orders.filter(pk__gt=last_pk)[:SETTLE_BATCH_SIZE])
+            if not batch:
+                return settled
+            Payment.objects.bulk_create([
+                Payment(order_id=pk, customer_id=customer_id, payment_type=payment_type, payment_amount=balance)
+                for pk, customer_id, balance in batch
+            ])
+            settled += len(batch)
+            last_pk = batch[-1][0]
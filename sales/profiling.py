@@ -0,0 +1,182 @@
+import datetime
+import html
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+from django.conf import settings
+
+# On-demand profiling of requests (sales.middleware.ProfilingMiddleware). A profiled request is sampled by a
+# background thread that reads the request thread's Python stack every SALES_PROFILE_INTERVAL seconds, so the
+# request itself runs uninstrumented and pays only for the sampler competing for the GIL. Each sampled stack is a
+# line of "module:function;module:function;... count" (the collapsed format flamegraph.pl and speedscope read),
+# innermost call last. Every profile is written to SALES_PROFILE_DIR/<url name>/ as <stamp>.collapsed, a
+# <stamp>.svg flame graph and a <stamp>.json summary; the latest SALES_PROFILE_KEEP of each URL name are kept.
+# Code running in C, like Decimal arithmetic or the SQLite driver, is counted in the Python function calling it.
+
+_UNSAFE = re.compile(r'[^\w.-]')
+
+
+def collapse(frame):
+    """
+    The stack of `frame` in the collapsed format, outermost call first
+    """
+    labels = []
+    while frame is not None:
+        label = f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+        labels.append(label.replace(';', ',').replace(' ', '_'))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Sampler:
+    """
+    Counts the stacks of the thread `thread_id` sampled every `interval` seconds while the block runs
+    """
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval or settings.SALES_PROFILE_INTERVAL
+        self.stacks = Counter()
+        self.duration = 0.0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='sales-profiler', daemon=True)
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._start
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+
+FRAME_HEIGHT = 16
+GRAPH_WIDTH = 1200
+
+
+def _colour(name):
+    # a stable warm colour per function, so a function keeps its colour across profiles
+    hashed = zlib.crc32(name.encode())
+    return f'rgb({205 + hashed % 50},{hashed // 50 % 180},{hashed // 9000 % 55})'
+
+
+def flamegraph_svg(stacks, title):
+    """
+    An SVG flame graph of collapsed stacks: one box per function on the path to a sample, as wide as the samples
+    it appears in, callers below their callees
+    """
+    root = {'children': {}, 'value': 0}
+    for stack, count in stacks.items():
+        root['value'] += count
+        node = root
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'children': {}, 'value': 0})
+            node['value'] += count
+    total = root['value'] or 1
+    boxes = []
+
+    def layout(node, x, depth):
+        for name, child in sorted(node['children'].items()):
+            width = child['value'] * GRAPH_WIDTH / total
+            if width >= 0.1:
+                boxes.append((name, child['value'], x, depth, width))
+                layout(child, x, depth + 1)
+            x += width
+
+    layout(root, 0.0, 0)
+    depth = max((box[3] for box in boxes), default=0) + 1
+    height = (depth + 2) * FRAME_HEIGHT
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{GRAPH_WIDTH}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="4" y="12">{html.escape(title)} ({root["value"]} samples)</text>',
+    ]
+    for name, value, x, level, width in boxes:
+        y = height - (level + 1) * FRAME_HEIGHT
+        label = name if width / 7 >= len(name) else name[:max(int(width / 7) - 2, 0)] + '..'
+        parts.append(
+            f'<g><title>{html.escape(name)} ({value} samples, {100 * value / total:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{FRAME_HEIGHT - 1}" fill="{_colour(name)}"/>'
+            + (f'<text x="{x + 2:.1f}" y="{y + 11}">{html.escape(label)}</text>' if width >= 21 else '')
+            + '</g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+def profile_directory(url_name):
+    return os.path.join(settings.SALES_PROFILE_DIR, _UNSAFE.sub('_', url_name))
+
+
+def save_profile(sampler, url_name, request, response):
+    """
+    Writes the sampler's stacks, their flame graph and a summary for the URL name and drops the oldest profiles of
+    the name beyond SALES_PROFILE_KEEP. Returns the profile's stamp
+    """
+    directory = profile_directory(url_name)
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.datetime.now()
+    stamp = f'{now:%Y%m%d-%H%M%S-%f}-{os.getpid()}'
+    base = os.path.join(directory, stamp)
+    with open(base + '.collapsed', 'w', encoding='utf-8') as collapsed:
+        collapsed.writelines(f'{stack} {count}\n' for stack, count in sampler.stacks.most_common())
+    with open(base + '.svg', 'w', encoding='utf-8') as svg:
+        svg.write(flamegraph_svg(sampler.stacks, f'{request.method} {request.path}'))
+    with open(base + '.json', 'w', encoding='utf-8') as summary:
+        json.dump({
+            'url_name': url_name,
+            'stamp': stamp,
+            'created': now.isoformat(timespec='seconds'),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(sampler.duration * 1000, 2),
+            'samples': sampler.samples,
+        }, summary)
+    stamps = sorted(name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+    for old in stamps[:-settings.SALES_PROFILE_KEEP]:
+        for extension in ('.collapsed', '.svg', '.json'):
+            try:
+                os.remove(os.path.join(directory, old + extension))
+            except FileNotFoundError:
+                pass
+    return stamp
+
+
+def latest_profiles():
+    """
+    {URL name: [summary, ...]} of the kept profiles, newest first
+    """
+    profiles = {}
+    root = settings.SALES_PROFILE_DIR
+    if not os.path.isdir(root):
+        return profiles
+    for directory in sorted(os.listdir(root)):
+        path = os.path.join(root, directory)
+        if not os.path.isdir(path):
+            continue
+        summaries = []
+        for name in sorted(os.listdir(path), reverse=True):
+            if name.endswith('.json'):
+                with open(os.path.join(path, name), encoding='utf-8') as summary:
+                    summaries.append(dict(json.load(summary), directory=directory))
+        if summaries:
+            profiles[summaries[0]['url_name']] = summaries
+    return profiles
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class ReadWriteRouter:
+    """
+    Sends reads to the SALES_READ_DATABASE alias, a second connection to the same SQLite file, and writes to the
+    default one. With WAL the read connection never waits for a writer. Reads made inside a transaction on the
+    default database stay on it, so a write path always sees its own uncommitted rows
+    """
+    @property
+    def read_alias(self):
+        alias = settings.SALES_READ_DATABASE
+        return alias if alias in connections.databases else DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return self.read_alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases are the same database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
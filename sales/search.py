@@ -0,0 +1,84 @@
+import re
+
+from django.db import connections, router
+from django.db.models import prefetch_related_objects
+
+from .models import Customer, Order, Product
+
+# Ranked full-text search over the FTS5 indexes created by migrations 0009 and 0010 and kept up to date by triggers
+# on the customer and product tables. A search term is split into words and every word has to match the start of a word
+# of the indexed text, so "ann exa" finds ann@example.com. Results come best match first by bm25, with a customer's
+# names weighted above their email and a product's name above its SKU. Orders are found through their product.
+
+# the indexed table, its index and the bm25 weights of the index's columns, per model
+SEARCH_INDEXES = {
+    Customer: ('sales_customer_fts', [10.0, 10.0, 1.0]),
+    Product: ('sales_product_fts', [10.0, 1.0]),
+}
+
+_WORDS = re.compile(r'\w+')
+
+
+def match_expression(term):
+    """
+    Turns free text into an FTS5 query matching every word as a prefix, or '' when there is nothing to search for.
+    Only word characters get through, so nothing typed can be read as FTS5 query syntax
+    """
+    return ' '.join(f'"{word}"*' for word in _WORDS.findall(term))
+
+
+def _search(model, term, limit):
+    expression = match_expression(term)
+    if not expression:
+        return []
+    index, weights = SEARCH_INDEXES[model]
+    table = model._meta.db_table
+    return list(model.objects.raw(
+        f'SELECT {table}.* FROM {index} JOIN {table} ON {table}.id = {index}.rowid '
+        f'WHERE {index} MATCH %s ORDER BY bm25({index}, {", ".join(map(str, weights))}), {table}.id LIMIT %s',
+        [expression, limit],
+        using=router.db_for_read(model),
+    ))
+
+
+def search_customers(term, limit=50):
+    return _search(Customer, term, limit)
+
+
+def search_products(term, limit=50):
+    return _search(Product, term, limit)
+
+
+def search_orders(term, limit=50):
+    """
+    The most recent orders of the products best matching the term: the `limit` best products are ranked first, then
+    each one's latest `limit` orders are read newest first through the order table's product index, so a product
+    with millions of orders costs no more than one with a few
+    """
+    expression = match_expression(term)
+    if not expression:
+        return []
+    index, weights = SEARCH_INDEXES[Product]
+    orders = list(Order.objects.raw(
+        f'SELECT sales_order.* FROM ('
+        f'SELECT rowid AS product_id, bm25({index}, {", ".join(map(str, weights))}) AS rank FROM {index} '
+        f'WHERE {index} MATCH %s ORDER BY rank, rowid LIMIT %s'
+        f') best JOIN sales_order ON sales_order.id IN ('
+        f'SELECT id FROM sales_order WHERE product_id = best.product_id ORDER BY id DESC LIMIT %s'
+        f') ORDER BY best.rank, best.product_id, sales_order.id DESC LIMIT %s',
+        [expression, limit, limit, limit],
+        using=router.db_for_read(Order),
+    ))
+    prefetch_related_objects(orders, 'customer', 'product')
+    return orders
+
+
+def rebuild_search_index(optimize=False):
+    """
+    Rebuilds the full-text indexes from the customer and product tables, and optionally merges their segments
+    """
+    with connections['default'].cursor() as cursor:
+        for index, _ in SEARCH_INDEXES.values():
+            cursor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+            if optimize:
+                cursor.execute(f"INSERT INTO {index}({index}) VALUES ('optimize')")
@@ -0,0 +1,17 @@
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .cache import FRAGMENT_CACHE
+from .models import Customer
+
+
+@receiver(post_delete, sender=Customer)
+def forget_customer_row(sender, instance, **kwargs):
+    """
+    Drops the cached list row of a deleted customer, so that a new customer given the same id doesn't show it.
+    Orders and payments need no such care: deleting one moves on the version of the customer (and order) its row
+    is also keyed by
+    """
+    caches[FRAGMENT_CACHE].delete(make_template_fragment_key('customer_row', [instance.pk, instance.version]))
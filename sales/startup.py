@@ -0,0 +1,201 @@
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from django.apps import AppConfig
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.urls import URLResolver, get_resolver
+
+logger = logging.getLogger('sales.startup')
+
+# Worker boot for celtis_sales_application/wsgi.py. boot() builds the WSGI application while timing every module
+# imported on the way and every app's ready(), then runs the SALES_WARMUP stages, so that the work Django otherwise
+# leaves to the first requests is done before any request arrives:
+#
+#   'templates'  parses every sales template. With DEBUG off Django loads templates through its cached loader, so
+#                they are kept parsed, with the template tag libraries they load (crispy_forms) imported
+#   'urls'       imports the URLconf, builds the resolver's reverse lookup tables and compiles every pattern
+#   'database'   opens the database connections of the booting thread
+#
+# Under a pre-fork server that loads the application before forking (gunicorn --preload, uWSGI without lazy-apps)
+# the workers inherit the warmed templates and URL resolver from the master. A database connection must not be
+# shared across a fork, so the ones opened here are closed again in each child, which opens its own on its first
+# query. The report goes to the 'sales.startup' logger at INFO.
+
+WARMUP_STAGES = {}
+
+
+def stage(name):
+    def register(function):
+        WARMUP_STAGES[name] = function
+        return function
+    return register
+
+
+class ImportTimer:
+    """
+    A sys.meta_path finder that times how long each module takes to execute, not counting the modules it imports
+    """
+    def __init__(self):
+        self.times = {}
+        self._children = []
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is None:
+                continue
+            # only loader instances are wrapped: class-level loaders (builtin and frozen modules) are shared
+            if spec.loader is not None and not isinstance(spec.loader, type) and hasattr(spec.loader, 'exec_module'):
+                spec.loader.exec_module = self._timed(name, spec.loader.exec_module)
+            return spec
+        return None
+
+    def _timed(self, name, exec_module):
+        def timed_exec_module(module):
+            start = time.perf_counter()
+            self._children.append(0.0)
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.times[name] = elapsed - self._children.pop()
+                if self._children:
+                    self._children[-1] += elapsed
+        return timed_exec_module
+
+    @contextmanager
+    def installed(self):
+        sys.meta_path.insert(0, self)
+        try:
+            yield self
+        finally:
+            sys.meta_path.remove(self)
+
+
+@contextmanager
+def timing_ready(times):
+    """
+    Records in `times` how long the ready() of each app configured inside the block takes, by app label
+    """
+    create = AppConfig.create.__func__
+
+    def timed_create(cls, entry):
+        app_config = create(cls, entry)
+        ready = app_config.ready
+
+        def timed_ready():
+            start = time.perf_counter()
+            ready()
+            times[app_config.label] = time.perf_counter() - start
+
+        app_config.ready = timed_ready
+        return app_config
+
+    AppConfig.create = classmethod(timed_create)
+    try:
+        yield times
+    finally:
+        AppConfig.create = classmethod(create)
+
+
+def sales_template_names():
+    """
+    The names of the templates under sales/ in every template directory of every engine
+    """
+    names = set()
+    for engine in engines.all():
+        # the cached loader wraps the loaders that know the directories
+        loaders = [
+            inner for loader in engine.engine.template_loaders for inner in getattr(loader, 'loaders', [loader])
+        ]
+        for loader in loaders:
+            for directory in loader.get_dirs():
+                root = os.path.join(directory, 'sales')
+                for path, _, files in os.walk(root):
+                    names.update(
+                        os.path.relpath(os.path.join(path, file), directory).replace(os.sep, '/')
+                        for file in files if file.endswith('.html')
+                    )
+    return sorted(names)
+
+
+@stage('templates')
+def warm_templates():
+    for engine in engines.all():
+        for name in sales_template_names():
+            engine.get_template(name)
+
+
+def _compile_patterns(resolver):
+    for pattern in resolver.url_patterns:
+        # compiled on first access, then kept
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            _compile_patterns(pattern)
+
+
+@stage('urls')
+def warm_urls():
+    resolver = get_resolver()
+    # imports the URLconf, and with it every view module, and fills the reverse() tables
+    resolver.reverse_dict
+    _compile_patterns(resolver)
+
+
+def _close_inherited_connections():
+    for connection in connections.all():
+        connection.close()
+
+
+_fork_hook_registered = False
+
+
+@stage('database')
+def warm_database():
+    global _fork_hook_registered
+    for alias in connections:
+        connections[alias].ensure_connection()
+    if not _fork_hook_registered and hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_close_inherited_connections)
+        _fork_hook_registered = True
+
+
+def warm_up(stages=None):
+    """
+    Runs the named warm-up stages, SALES_WARMUP by default, and returns how long each took
+    """
+    times = {}
+    for name in settings.SALES_WARMUP if stages is None else stages:
+        start = time.perf_counter()
+        WARMUP_STAGES[name]()
+        times[name] = time.perf_counter() - start
+    return times
+
+
+def boot(get_application, top=15):
+    """
+    Builds the WSGI application with get_application(), warms it up and logs where the time went
+    """
+    start = time.perf_counter()
+    timer, ready = ImportTimer(), {}
+    with timer.installed(), timing_ready(ready):
+        application = get_application()
+        setup = time.perf_counter() - start
+        warmup = warm_up()
+    total = time.perf_counter() - start
+    logger.info('Worker %s booted in %.1f ms: setup %.1f ms, warm-up %.1f ms', os.getpid(), total * 1000,
+                setup * 1000, sum(warmup.values()) * 1000)
+    for label, seconds in sorted(ready.items(), key=lambda item: -item[1]):
+        logger.info('  ready %s: %.1f ms', label, seconds * 1000)
+    for name, seconds in sorted(timer.times.items(), key=lambda item: -item[1])[:top]:
+        logger.info('  import %s: %.1f ms', name, seconds * 1000)
+    for name, seconds in warmup.items():
+        logger.info('  warm-up %s: %.1f ms', name, seconds * 1000)
+    return application
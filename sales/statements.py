@@ -0,0 +1,196 @@
+import csv
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Min, Sum
+from django.utils import timezone
+
+from .exports import Echo
+from .models import ArchivedOrder, ArchivedPayment, BalanceSnapshot, Customer, Order, Payment, day_start
+
+# Customer statements: the opening balance, the orders and payments and the closing balance of a date range. A
+# balance as of any day is the customer's nearest BalanceSnapshot on or before it plus the ledger rows dated after
+# the snapshot, so it costs a few aggregates over at most a month of rows instead of the customer's whole history.
+# `manage.py snapshot_balances` takes the month-end snapshots, each one from the previous snapshot plus the month in
+# between, and writes that discard snapshots leave gaps it fills in on its next run. The archived orders and
+# payments are part of the ledger here: statements cover history from before archiving too.
+
+# (model, date field, amount field, the total its rows add to)
+LEDGER = [
+    (Order, 'date_bought', 'product_sale_price', 'total_ordered'),
+    (ArchivedOrder, 'date_bought', 'product_sale_price', 'total_ordered'),
+    (Payment, 'date_paid', 'payment_amount', 'total_paid'),
+    (ArchivedPayment, 'date_paid', 'payment_amount', 'total_paid'),
+]
+
+ZERO = Decimal('0.00')
+
+
+def month_end(day):
+    next_month = (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+    return next_month - datetime.timedelta(days=1)
+
+
+def _dated(rows, date_field, after=None, through=None):
+    """
+    The rows dated after the local day `after` and up to the end of the local day `through`
+    """
+    if after is not None:
+        rows = rows.filter(**{f'{date_field}__gte': day_start(after + datetime.timedelta(days=1))})
+    if through is not None:
+        rows = rows.filter(**{f'{date_field}__lt': day_start(through + datetime.timedelta(days=1))})
+    return rows
+
+
+def ledger_totals(after=None, through=None, customer_id=None):
+    """
+    {customer_id: {'total_ordered': ..., 'total_paid': ...}} of the ledger rows dated after the day `after` up to
+    and including the day `through`, one grouped query per ledger table
+    """
+    totals = defaultdict(lambda: {'total_ordered': ZERO, 'total_paid': ZERO})
+    for model, date_field, amount_field, total in LEDGER:
+        rows = _dated(model.objects.order_by(), date_field, after, through)
+        if customer_id is not None:
+            rows = rows.filter(customer_id=customer_id)
+        for row in rows.values('customer_id').annotate(amount=Sum(amount_field)):
+            totals[row['customer_id']][total] += row['amount']
+    return totals
+
+
+def _add(first, second):
+    return {total: first[total] + second[total] for total in ('total_ordered', 'total_paid')}
+
+
+def totals_as_of(customer_id, day):
+    """
+    The customer's running totals at the end of the day, from the nearest snapshot and the rows after it
+    """
+    snapshot = BalanceSnapshot.objects.filter(customer_id=customer_id, date__lte=day).order_by('-date').first()
+    base = {'total_ordered': ZERO, 'total_paid': ZERO}
+    if snapshot is not None:
+        base = {'total_ordered': snapshot.total_ordered, 'total_paid': snapshot.total_paid}
+    return _add(base, ledger_totals(snapshot and snapshot.date, day, customer_id)[customer_id])
+
+
+def balance_as_of(customer_id, day):
+    totals = totals_as_of(customer_id, day)
+    return totals['total_ordered'] - totals['total_paid']
+
+
+class Statement:
+    """
+    One customer's statement for the days from `start` to `end` inclusive: the opening balance at the end of the
+    day before `start`, the orders and payments in date order, each with the running balance, and the closing
+    balance
+    """
+    def __init__(self, customer, start, end):
+        self.customer, self.start, self.end = customer, start, end
+        opening_day = start - datetime.timedelta(days=1)
+        self.opening_balance = balance_as_of(customer.pk, opening_day)
+        lines = []
+        for model, date_field, amount_field, total in LEDGER:
+            is_order = total == 'total_ordered'
+            rows = _dated(model.objects.filter(customer=customer), date_field, opening_day, end)
+            for row in rows.select_related('product') if is_order else rows:
+                amount = getattr(row, amount_field)
+                lines.append({
+                    'date': getattr(row, date_field),
+                    'kind': 'Order' if is_order else 'Payment',
+                    'reference': row.pk,
+                    'description': row.product.name if is_order else row.payment_type,
+                    'charge': amount if is_order else None,
+                    'credit': None if is_order else amount,
+                })
+        lines.sort(key=lambda line: (line['date'], line['kind'] == 'Payment', line['reference']))
+        self.total_ordered = self.total_paid = ZERO
+        balance = self.opening_balance
+        for line in lines:
+            if line['charge'] is not None:
+                self.total_ordered += line['charge']
+                balance += line['charge']
+            else:
+                self.total_paid += line['credit']
+                balance -= line['credit']
+            line['balance'] = balance
+        self.lines = lines
+        self.closing_balance = balance
+
+
+def take_snapshots(through=None):
+    """
+    Takes the missing month-end snapshots up to the last month end on or before `through`, oldest first, and
+    returns the number of month ends taken. Only days that are over are snapshotted, so `through` defaults to
+    and is capped at yesterday
+    """
+    yesterday = timezone.localdate() - datetime.timedelta(days=1)
+    through = min(through or yesterday, yesterday)
+    if month_end(through) != through:
+        through = through.replace(day=1) - datetime.timedelta(days=1)
+    first_days = [
+        model.objects.aggregate(first=Min(date_field))['first'] for model, date_field, _, _ in LEDGER
+    ]
+    first_days = [timezone.localdate(first) for first in first_days if first is not None]
+    if not first_days:
+        return 0
+    existing = set(BalanceSnapshot.objects.order_by().values_list('date', flat=True).distinct())
+    previous = None
+    taken = 0
+    day = month_end(min(first_days))
+    while day <= through:
+        if day not in existing:
+            _take_snapshot(previous, day)
+            taken += 1
+        previous = day
+        day = month_end(day + datetime.timedelta(days=1))
+    return taken
+
+
+def _take_snapshot(previous, day):
+    with transaction.atomic():
+        totals = ledger_totals(previous, day)
+        if previous is not None:
+            for snapshot in BalanceSnapshot.objects.filter(date=previous).iterator(chunk_size=2000):
+                totals[snapshot.customer_id] = _add(totals[snapshot.customer_id], {
+                    'total_ordered': snapshot.total_ordered, 'total_paid': snapshot.total_paid,
+                })
+        BalanceSnapshot.objects.bulk_create((
+            BalanceSnapshot(customer_id=customer_id, date=day, **customer_totals)
+            for customer_id, customer_totals in totals.items()
+        ), batch_size=500)
+
+
+STATEMENT_COLUMNS = [
+    'customer_id', 'first_name', 'last_name', 'opening_balance', 'orders', 'payments', 'closing_balance',
+]
+
+
+def stream_statements(start, end):
+    """
+    Yields the statement summary of every customer for the days from `start` to `end` as CSV lines, from a fixed
+    number of grouped queries whatever the number of customers
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(STATEMENT_COLUMNS)
+    opening_day = start - datetime.timedelta(days=1)
+    snapshot_day = BalanceSnapshot.objects.filter(date__lte=opening_day).order_by('-date').values_list(
+        'date', flat=True
+    ).first()
+    opening = ledger_totals(snapshot_day, opening_day)
+    if snapshot_day is not None:
+        for snapshot in BalanceSnapshot.objects.filter(date=snapshot_day).iterator(chunk_size=2000):
+            opening[snapshot.customer_id] = _add(opening[snapshot.customer_id], {
+                'total_ordered': snapshot.total_ordered, 'total_paid': snapshot.total_paid,
+            })
+    period = ledger_totals(opening_day, end)
+    customers = Customer.objects.order_by('pk').values_list('pk', 'first_name', 'last_name')
+    for customer_id, first_name, last_name in customers.iterator(chunk_size=2000):
+        opening_totals = opening.get(customer_id, {'total_ordered': ZERO, 'total_paid': ZERO})
+        period_totals = period.get(customer_id, {'total_ordered': ZERO, 'total_paid': ZERO})
+        opening_balance = opening_totals['total_ordered'] - opening_totals['total_paid']
+        yield writer.writerow([
+            customer_id, first_name, last_name, opening_balance, period_totals['total_ordered'],
+            period_totals['total_paid'],
+            opening_balance + period_totals['total_ordered'] - period_totals['total_paid'],
+        ])
@@ -0,0 +1,55 @@
+// Search-as-you-type for the inputs rendered by sales.widgets.AutocompleteInput: the matches of the typed text are
+// fetched from the input's data-autocomplete-url and offered through its <datalist>, with the row id as the value.
+(function () {
+    'use strict';
+
+    function fieldValue(form, name) {
+        var field = form.elements[name];
+        return field ? field.value : '';
+    }
+
+    function attach(input) {
+        var list = document.getElementById(input.getAttribute('list'));
+        var dependsOn = input.dataset.autocompleteDependsOn;
+        var timer = null;
+        var latest = 0;
+
+        function refresh() {
+            var params = new URLSearchParams({q: input.value});
+            if (dependsOn) {
+                var value = fieldValue(input.form, dependsOn);
+                if (!value) {
+                    list.innerHTML = '';
+                    return;
+                }
+                params.set(dependsOn, value);
+            }
+            var request = ++latest;
+            fetch(input.dataset.autocompleteUrl + '?' + params.toString(), {credentials: 'same-origin'})
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    if (request !== latest) {
+                        return;  // a newer search has been sent since
+                    }
+                    list.innerHTML = '';
+                    data.results.forEach(function (result) {
+                        var option = document.createElement('option');
+                        option.value = result.id;
+                        option.label = result.text;
+                        list.appendChild(option);
+                    });
+                });
+        }
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(refresh, 150);
+        });
+        if (dependsOn) {
+            // the open orders of the chosen customer are offered as soon as the field is entered
+            input.addEventListener('focus', refresh);
+        }
+    }
+
+    document.querySelectorAll('input[data-autocomplete-url][list]').forEach(attach);
+})();
@@ -0,0 +1,35 @@
+// Keeps the job page up to date: the job's status URL is polled while the job is queued or running, and the page is
+// reloaded once it has finished so that the result link and any error show.
+(function () {
+    'use strict';
+
+    var section = document.getElementById('job');
+    if (!section || section.dataset.finished === 'true') {
+        return;
+    }
+
+    function show(name, text) {
+        var element = section.querySelector('[data-job="' + name + '"]');
+        if (element) {
+            element.textContent = text;
+        }
+    }
+
+    function poll() {
+        fetch(section.dataset.statusUrl, {credentials: 'same-origin'})
+            .then(function (response) { return response.json(); })
+            .then(function (job) {
+                if (job.finished) {
+                    window.location.reload();
+                    return;
+                }
+                show('status', job.status.charAt(0).toUpperCase() + job.status.slice(1));
+                show('progress', job.progress + '%');
+                section.querySelector('[data-job="progress"]').style.width = job.progress + '%';
+                show('message', job.message);
+                setTimeout(poll, 1000);
+            });
+    }
+
+    setTimeout(poll, 1000);
+}());
@@ -0,0 +1,112 @@
+import gzip
+import json
+import mimetypes
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The static file pipeline. `manage.py collectstatic` copies the assets to STATIC_ROOT, adds a copy of each one
+# under a name carrying a hash of its content (main.css -> main.3f2a9c1b7e4d.css), which {% static %} then links to,
+# and next to every text asset a .gz and, when the brotli package is installed, a .br variant compressed at the
+# highest level. The hashed names never change content, so sales.middleware.StaticFilesMiddleware serves them with
+# far-future immutable cache headers and the precompressed variant the client accepts, and browsers never
+# revalidate them. Compressed variants found in STATIC_ROOT are served whether or not brotli is installed here.
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.html', '.txt', '.json', '.xml')
+
+# a variant is only kept when it is at least this much smaller than the file
+MIN_SAVING = 0.05
+
+# content encoding -> file extension of its variants, in order of preference
+VARIANTS = [('br', '.br'), ('gzip', '.gz')]
+
+COMPRESSORS = {'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=11)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Hashes the collected files' names like ManifestStaticFilesStorage and writes their compressed variants.
+    Before collectstatic has written a manifest (development, tests) the files are linked by their plain names
+    """
+    def url(self, name, force=False):
+        try:
+            return super().url(name, force)
+        except ValueError:
+            return StaticFilesStorage.url(self, name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in paths:
+            hashed_name = self.hashed_files.get(self.hash_key(self.clean_name(name)))
+            for target in {name, hashed_name} - {None}:
+                if target.endswith(COMPRESSIBLE_EXTENSIONS):
+                    self.compress(target)
+
+    def compress(self, name):
+        with self.open(name) as original:
+            data = original.read()
+        for encoding, extension in VARIANTS:
+            variant = name + extension
+            if self.exists(variant):
+                self.delete(variant)
+            if encoding not in COMPRESSORS:
+                continue
+            compressed = COMPRESSORS[encoding](data)
+            if len(compressed) <= len(data) * (1 - MIN_SAVING):
+                self._save(variant, ContentFile(compressed))
+
+
+class StaticFile:
+    """
+    A collected file as served: its path, type, size and modification time, whether its name is content hashed
+    and the paths and sizes of its precompressed variants by encoding
+    """
+    def __init__(self, path, immutable):
+        self.path = path
+        self.immutable = immutable
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        stat = os.stat(path)
+        self.size, self.mtime = stat.st_size, stat.st_mtime
+        self.variants = {
+            encoding: (path + extension, os.path.getsize(path + extension))
+            for encoding, extension in VARIANTS if os.path.exists(path + extension)
+        }
+
+    def variant(self, accepted):
+        """
+        The (encoding, path, size) to send to a client accepting the `accepted` encodings, best first
+        """
+        for encoding, _ in VARIANTS:
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return (encoding, *self.variants[encoding])
+        return None, self.path, self.size
+
+
+def collected_files(root):
+    """
+    {name relative to STATIC_ROOT: StaticFile} of every file collectstatic wrote to `root`, read once at startup
+    """
+    manifest = os.path.join(root, ManifestStaticFilesStorage.manifest_name)
+    if not os.path.exists(manifest):
+        return {}
+    with open(manifest, encoding='utf-8') as manifest_file:
+        hashed = set(json.load(manifest_file).get('paths', {}).values())
+    files = {}
+    for path, _, names in os.walk(root):
+        for filename in names:
+            full_path = os.path.join(path, filename)
+            name = os.path.relpath(full_path, root).replace(os.sep, '/')
+            if name == ManifestStaticFilesStorage.manifest_name or name.endswith(tuple(e for _, e in VARIANTS)):
+                continue
+            files[name] = StaticFile(full_path, name in hashed)
+    return files
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.template.loader import get_template, render_to_string
+
+# Streaming the full customer, order and payment lists (?stream=1 on the list pages). The page is rendered once
+# with `streaming` set, which puts ROWS_MARKER where the rows go instead of the paginated loop, and is split there:
+# the head, with the whole layout down to the list heading, goes out before any query runs, then the rows are read
+# with .iterator() and rendered through the same row templates as the paginated pages, SALES_STREAM_CHUNK_ROWS at a
+# time, and the tail closes the page. Memory stays flat whatever the table size. The rows are not taken from the
+# fragment cache: a full listing would fill it with every row of the table and evict the pages people come back to.
+
+ROWS_MARKER = '<!-- sales:rows -->'
+
+
+def stream_list(request, template_name, row_template, name, queryset, keys, context):
+    """
+    Yields the page `template_name` with every row of the queryset in ascending order of `keys`, each rendered by
+    `row_template` with the row as `name`
+    """
+    page = render_to_string(template_name, dict(context, streaming=True, rows_marker=ROWS_MARKER), request)
+    head, tail = page.split(ROWS_MARKER, 1)
+    yield head
+    row = get_template(row_template)
+    chunk_rows = settings.SALES_STREAM_CHUNK_ROWS
+    chunk = []
+    for obj in queryset.order_by(*keys).iterator(chunk_size=2000):
+        chunk.append(row.render({name: obj}))
+        if len(chunk) >= chunk_rows:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+    yield tail
@@ -0,0 +1,23 @@
+from django.urls import reverse
+
+from .middleware import QueryRecorder
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin for declaring how many queries a page may run. A request over budget fails with every statement
+    it ran listed, and the statements repeated with different parameters called out as likely N+1 loops
+    """
+    def assertQueryBudget(self, budget, url_name, args=None, data=None, method='get'):
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = getattr(self.client, method)(reverse(url_name, args=args), data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        if recorder.count > budget:
+            similar = ''.join(f'\n  {count}x {sql}' for sql, count in recorder.similar().items())
+            self.fail(
+                f'{url_name} ran {recorder.count} queries, over its budget of {budget}.'
+                f'{" Repeated statements:" + similar if similar else ""}\n{recorder.report()}'
+            )
+        return response
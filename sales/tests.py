@@ -1,9 +1,59 @@
 from mixer.backend.django import mixer
-from django.db.models import DateTimeField
-from django.test import TestCase
+from django import forms
+from django.apps import AppConfig
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import engines
+from django.db.models import DateTimeField, ProtectedError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .models import Customer, Order, Payment
+from django.utils import timezone
+from .admin import estimated_count
+from .aging import aging_by_customer, aging_totals, customer_open_orders
+from .archive import archive as archive_sales, restore as restore_archived
+from .benchmarks import run_benchmarks, seed_dataset
+from .cache import FRAGMENT_CACHE
+from .fields import from_cents, to_cents
+from .imports import import_rows, read_rows
+from .jobs import JOB_KINDS, JobKind, JobRun, Worker, claim, enqueue, recover_stale
+from .middleware import ProfilingMiddleware, StaticFilesMiddleware
+from .models import Customer, Order, Payment, Product, DailyPaymentTotals, DailyProductSales, ArchivedOrder, \
+    ArchivedPayment, CarryForward, BalanceSnapshot, Job, day_start
+from .pagination import encode_cursor
+from .payments import post_payment
+from .profiling import Sampler, flamegraph_svg, latest_profiles, save_profile
+from .routers import ReadWriteRouter
+from .startup import ImportTimer, boot, sales_template_names, timing_ready, warm_up
+from .storage import COMPRESSORS
+from .statements import Statement, balance_as_of, month_end, stream_statements, take_snapshots
+from .search import match_expression, search_customers, search_orders, search_products
+from .testing import QueryBudgetMixin
+from . import imports, urls as sales_urls
+from decimal import Decimal
+import csv
 import datetime
+import gzip
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+
+def product(name):
+    return Product.objects.get_or_create(name=name, defaults={'sku': name.upper().replace(' ', '-')})[0]
 
 
 class ViewsResponsivenessTest(TestCase):
@@ -53,7 +103,7 @@ class OrderModelTests(TestCase):
 
     def test_order_amount_owed_equals_product_price(self):
         init_cust = Customer(first_name="test_first", last_name="test_last", email="test@email.com")
-        init_order = Order(customer=init_cust, product="test_product", product_sale_price=2000.00)
+        init_order = Order(customer=init_cust, product=product("test_product"), product_sale_price=2000.00)
         self.assertEqual(init_order.amount_owed, init_order.product_sale_price)
 
     def test_customer_ammount_owed_equals_order_sales_price_from_multiple_orders(self):
@@ -176,3 +226,1556 @@ class OrderModelTests(TestCase):
             return len(payment_list)
         self.assertEqual(count_payments(), 1000)
 
+
+class StoredBalanceTests(TestCase):
+    """
+    These tests check that the stored balance columns follow every kind of write to orders and payments
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer)
+        self.order = mixer.blend(Order, customer=self.customer, product_sale_price=2000.00)
+
+    def test_balances_are_read_without_queries(self):
+        mixer.blend(Payment, order=self.order, customer=self.customer, payment_amount=500.00)
+        customer = Customer.objects.get(pk=self.customer.pk)
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(customer.amount_owed, 1500)
+            self.assertEqual(order.amount_owed, 1500)
+            self.assertEqual(order.payments_total, 500)
+
+    def test_editing_order_price_and_payment_amount_updates_balances(self):
+        payment = mixer.blend(Payment, order=self.order, customer=self.customer, payment_amount=500.00)
+        self.order.product_sale_price = 3000
+        self.order.save()
+        payment.payment_amount = 1000
+        payment.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.balance, 2000)
+        self.assertEqual(self.customer.total_ordered, 3000)
+        self.assertEqual(self.customer.total_paid, 1000)
+        self.assertEqual(self.customer.balance, 2000)
+
+    def test_moving_payment_to_another_customer_moves_the_balance(self):
+        other = mixer.blend(Customer)
+        payment = mixer.blend(Payment, order=self.order, customer=self.customer, payment_amount=500.00)
+        payment.customer = other
+        payment.save()
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, 2000)
+        self.assertEqual(other.balance, -500)
+
+    def test_deleting_payment_and_order_restores_balances(self):
+        payment = mixer.blend(Payment, order=self.order, customer=self.customer, payment_amount=500.00)
+        payment.delete()
+        self.assertEqual(self.order.balance, 2000)
+        self.order.delete()
+        self.assertEqual(self.customer.balance, 0)
+
+    def test_bulk_paths_recompute_balances(self):
+        Order.objects.bulk_create([
+            Order(customer=self.customer, product=product('bulk'), product_sale_price=100) for _ in range(3)
+        ])
+        Payment.objects.bulk_create([
+            Payment(order=self.order, customer=self.customer, payment_type='Cash', payment_amount=250)
+            for _ in range(2)
+        ])
+        self.customer.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(self.customer.balance, 1800)
+        self.assertEqual(self.order.paid_total, 500)
+
+        Payment.objects.filter(order=self.order).update(payment_amount=100)
+        Order.objects.filter(product__name='bulk').delete()
+        self.customer.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(self.customer.balance, 1800)
+        self.assertEqual(self.order.balance, 1800)
+
+    def test_recompute_balances_command_repairs_drift(self):
+        Customer.objects.filter(pk=self.customer.pk).update(balance=0, total_ordered=0)
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('recompute_balances', '--check', stdout=out)
+        call_command('recompute_balances', stdout=out)
+        call_command('recompute_balances', '--check', stdout=out)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, 2000)
+
+
+class ListQueryCountTests(TestCase):
+    """
+    These tests check that the list pages run the same number of queries however many rows they show
+    """
+    def create_ledger(self, count):
+        for i in range(count):
+            customer = mixer.blend(Customer)
+            order = mixer.blend(Order, customer=customer, product_sale_price=100.00)
+            mixer.blend(Payment, order=order, customer=customer, payment_amount=40.00)
+
+    def count_queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse(url_name)).status_code, 200)
+        return len(queries)
+
+    def test_list_pages_do_not_query_per_row(self):
+        self.create_ledger(2)
+        before = {name: self.count_queries(name) for name in ('sales-customer', 'sales-order', 'sales-payment')}
+        self.create_ledger(5)
+        for name, count in before.items():
+            self.assertEqual(self.count_queries(name), count, name)
+
+    def test_live_balances_match_stored_balances(self):
+        self.create_ledger(3)
+        for customer in Customer.objects.with_balances(live=True):
+            self.assertEqual(customer.amount_owed, customer.balance)
+        for order in Order.objects.with_payment_totals(live=True):
+            self.assertEqual(order.payments_total, order.paid_total)
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    These tests walk the keyset paginated list pages forwards and backwards
+    """
+    def setUp(self):
+        customer = mixer.blend(Customer)
+        self.orders = [mixer.blend(Order, customer=customer, product_sale_price=10.00) for _ in range(7)]
+
+    def test_walking_forwards_and_back_visits_every_order_once(self):
+        seen = []
+        response = self.client.get(reverse('sales-order'), {'page_size': 3})
+        pages = [list(response.context['page'])]
+        while response.context['page'].has_next():
+            response = self.client.get(reverse('sales-order'),
+                                       {'page_size': 3, 'cursor': response.context['page'].next_cursor})
+            pages.append(list(response.context['page']))
+        for page in pages:
+            seen.extend(order.pk for order in page)
+        self.assertEqual(seen, [order.pk for order in self.orders])
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+
+        response = self.client.get(reverse('sales-order'),
+                                   {'page_size': 3, 'cursor': response.context['page'].previous_cursor})
+        self.assertEqual(list(response.context['page']), pages[1])
+
+    def test_page_queries_do_not_use_offset_or_count(self):
+        first = self.client.get(reverse('sales-order'), {'page_size': 2})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('sales-order'), {'page_size': 2, 'cursor': first.context['page'].next_cursor})
+        sql = ' '.join(query['sql'] for query in queries).upper()
+        self.assertNotIn('OFFSET', sql)
+        self.assertNotIn('COUNT(', sql)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('sales-payment'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_of_the_wrong_types_is_not_found(self):
+        for values in (['abc', 1], [[1], 1], ['2020-01-01', 'x'], [{'dt': '2020-01-01T00:00:00'}, None]):
+            with self.subTest(values=values):
+                response = self.client.get(reverse('sales-order'), {'cursor': encode_cursor(values, 'next')})
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(SALES_STREAM_CHUNK_ROWS=2)
+class StreamingListTests(TestCase):
+    """
+    These tests check the list pages streamed in full with ?stream=1
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer, first_name='Ann')
+        self.orders = [mixer.blend(Order, customer=self.customer, product_sale_price=10.00) for _ in range(5)]
+        mixer.blend(Payment, order=self.orders[0], customer=self.customer, payment_amount=4.00)
+
+    def test_head_goes_out_before_any_query(self):
+        response = self.client.get(reverse('sales-order'), {'stream': 1})
+        self.assertIsInstance(response, StreamingHttpResponse)
+        content = iter(response.streaming_content)
+        with self.assertNumQueries(0):
+            head = next(content).decode()
+        self.assertIn('<h1>Order List</h1>', head)
+        self.assertNotIn('Order ID', head)
+        chunks = [chunk.decode() for chunk in content]
+        # five rows in chunks of two, then the tail
+        self.assertEqual([chunk.count('Order ID') for chunk in chunks], [2, 2, 1, 0])
+        self.assertIn('</html>', chunks[-1])
+
+    def test_every_row_is_listed_in_order(self):
+        for name, text in [('sales-customer', 'Customer ID'), ('sales-order', 'Order ID'),
+                           ('sales-payment', 'Payment ID')]:
+            with self.subTest(name):
+                page = b''.join(self.client.get(reverse(name), {'stream': 1}).streaming_content).decode()
+                self.assertNotIn('Show all', page)
+                ids = [int(pk) for pk in re.findall(text + r' (\d+)', page)]
+                model = {'sales-customer': Customer, 'sales-order': Order, 'sales-payment': Payment}[name]
+                self.assertEqual(ids, list(model.objects.order_by('pk').values_list('pk', flat=True)))
+
+    def test_streaming_does_not_query_per_row(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                b''.join(self.client.get(reverse('sales-payment'), {'stream': 1}).streaming_content)
+            return len(queries)
+
+        before = count_queries()
+        for order in self.orders[1:]:
+            mixer.blend(Payment, order=order, customer=mixer.blend(Customer), payment_amount=1.00)
+        self.assertEqual(count_queries(), before)
+
+    def test_paginated_pages_link_to_the_full_list(self):
+        response = self.client.get(reverse('sales-order'), {'page_size': 2})
+        self.assertContains(response, 'href="?stream=1"')
+
+
+class ExportTests(TestCase):
+    """
+    These tests check the streamed CSV/JSONL exports and their filters
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer, first_name='Ann')
+        self.order = mixer.blend(Order, customer=self.customer, product_sale_price=100.00)
+        mixer.blend(Payment, order=self.order, customer=self.customer, payment_amount=30.00, payment_type='Cash')
+        other = mixer.blend(Customer)
+        mixer.blend(Order, customer=other, product_sale_price=5.00)
+
+    def test_orders_csv_includes_balances(self):
+        response = self.client.get(reverse('sales-export', args=['orders']), {'customer': self.customer.pk})
+        self.assertIsInstance(response, StreamingHttpResponse)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['customer__first_name'], 'Ann')
+        self.assertEqual(Decimal(rows[0]['balance']), 70)
+
+    def test_payments_jsonl_filters_by_date(self):
+        today = datetime.date.today()
+        response = self.client.get(reverse('sales-export', args=['payments']),
+                                   {'format': 'jsonl', 'start': today, 'end': today})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(Decimal(json.loads(lines[0])['order__balance']), 70)
+        response = self.client.get(reverse('sales-export', args=['payments']),
+                                   {'format': 'jsonl', 'end': today - datetime.timedelta(days=1)})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_export_does_not_query_per_row(self):
+        for _ in range(5):
+            mixer.blend(Order, customer=self.customer, product_sale_price=1.00)
+        with self.assertNumQueries(1):
+            b''.join(self.client.get(reverse('sales-export', args=['orders'])).streaming_content)
+
+    def test_bad_filters_are_rejected(self):
+        response = self.client.get(reverse('sales-export', args=['orders']), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_sales_command(self):
+        out = io.StringIO()
+        call_command('export_sales', 'customers', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+
+
+class ImportTests(TestCase):
+    """
+    These tests check the batched order and payment import
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer)
+        self.pen = product('Pen')
+
+    def test_orders_csv_import_reports_bad_rows(self):
+        data = (
+            'customer,product,product_sale_price\n'
+            f'{self.customer.pk},{self.pen.pk},100.00\n'
+            f'{self.customer.pk},{self.pen.pk},not-a-price\n'
+            f'999999,{self.pen.pk},5.00\n'
+            f'{self.customer.pk},{self.pen.pk},250.50\n'
+        )
+        report = import_rows('orders', read_rows(io.StringIO(data)), batch_size=2)
+        self.assertEqual((report.rows, report.created), (4, 2))
+        self.assertEqual([error['row'] for error in report.errors], [2, 3])
+        self.assertIn('product_sale_price', report.errors[0]['errors'])
+        self.assertIn('customer', report.errors[1]['errors'])
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, Decimal('350.50'))
+
+    def test_products_by_id_sku_or_name(self):
+        desk = Product.objects.create(name='Desk', sku='Pen')
+        data = (
+            'customer,product,product_sale_price\n'
+            f'{self.customer.pk},{self.pen.pk},1.00\n'
+            f'{self.customer.pk},PEN,2.00\n'
+            f'{self.customer.pk},Pen,3.00\n'
+            f'{self.customer.pk},Desk,4.00\n'
+            f'{self.customer.pk},Sofa,5.00\n'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            report = import_rows('orders', read_rows(io.StringIO(data)))
+        # a SKU wins over another product's name
+        self.assertEqual(list(Order.objects.order_by('pk').values_list('product', flat=True)),
+                         [self.pen.pk, self.pen.pk, desk.pk, desk.pk])
+        self.assertEqual([error['row'] for error in report.errors], [5])
+        self.assertEqual(sum('"sales_product"' in query['sql'] for query in queries), 3)
+
+    def test_payments_jsonl_import_uses_set_based_lookups(self):
+        def import_payments(count):
+            orders = [mixer.blend(Order, customer=self.customer, product_sale_price=100.00) for _ in range(count)]
+            data = ''.join(
+                json.dumps({'order': order.pk, 'customer': self.customer.pk, 'payment_type': 'Card',
+                            'payment_amount': '40.00'}) + '\n'
+                for order in orders
+            )
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(import_rows('payments', read_rows(io.StringIO(data), 'jsonl')).created, count)
+            return len(queries)
+
+        self.assertEqual(import_payments(2), import_payments(6))
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, 480)
+
+    def test_upload_endpoint(self):
+        upload = SimpleUploadedFile('orders.csv', f'customer,product,product_sale_price\n{self.customer.pk},{self.pen.pk},2\n'.encode())
+        response = self.client.post(reverse('sales-import'), {'kind': 'orders', 'format': 'csv', 'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['report'].created, 1)
+
+    def test_import_sales_command_dry_run(self):
+        path = os.path.join(tempfile.mkdtemp(), 'orders.csv')
+        with open(path, 'w') as source:
+            source.write(f'customer,product,product_sale_price\n{self.customer.pk},{self.pen.pk},2\n')
+        call_command('import_sales', 'orders', path, '--dry-run', stdout=io.StringIO())
+        self.assertFalse(Order.objects.exists())
+
+
+# Queries each page in sales/urls.py may run with a few rows of every kind in the database, as (args, budget) or
+# (args, budget, options). Args may be a function of the test case, for rows it creates. The options are the
+# request's 'data' and 'method', 'staff' to request it logged in as a staff user, and the 'status' expected
+# instead of 200. Every URL must be listed here, so a new page has to declare its budget
+QUERY_BUDGETS = {
+    'sales-home': (None, 0),
+    'sales-about': (None, 0),
+    'sales-customer': (None, 1),
+    'sales-order': (None, 1),
+    'sales-payment': (None, 1),
+    'customer-registration': (None, 0),
+    'order-placement': (None, 0),
+    'payment-accept': (None, 0),
+    'sales-export': (['payments'], 1),
+    'sales-import': (None, 0),
+    'sales-reports': (None, 4),
+    'sales-aging': (None, 2),
+    'sales-aging-csv': (None, 1),
+    'sales-aging-customer': ([1], 3),
+    'sales-customer-statement': ([1], 10),
+    'sales-cache-stats': (None, 0),
+    'sales-profiles': (None, 2, {'staff': True}),
+    'sales-profile-file': (lambda test: ['sales-order', test.profile, 'svg'], 2, {'staff': True}),
+    'sales-jobs': (None, 1),
+    'sales-job-enqueue': (['export'], 3, {
+        'method': 'post', 'data': {'export-export': 'orders', 'export-format': 'csv'}, 'staff': True, 'status': 302,
+    }),
+    'sales-job': ([1], 1),
+    'sales-job-status': ([1], 1),
+    'sales-job-result': ([1], 3, {'staff': True}),
+    'sales-autocomplete': (['customers'], 1),
+    'sales-api-customers': (None, 1),
+    'sales-search': (None, 3, {'data': {'q': 'Ann'}}),
+    'sales-api-orders': (None, 1),
+    'sales-api-payments': (None, 1),
+}
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    These tests hold every page to its query budget
+    """
+    def setUp(self):
+        files, profiles = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        self.addCleanup(profiles.cleanup)
+        directories = override_settings(SALES_JOB_FILES_DIR=files.name, SALES_PROFILE_DIR=profiles.name)
+        directories.enable()
+        self.addCleanup(directories.disable)
+        for _ in range(5):
+            customer = mixer.blend(Customer, first_name='Ann')
+            order = mixer.blend(Order, customer=customer, product_sale_price=100.00)
+            mixer.blend(Payment, order=order, customer=customer, payment_amount=40.00)
+        job = enqueue('export', {'export': 'orders', 'format': 'csv'})
+        JobRun(job).write_result('orders.csv', ['id\n'])
+        Job.objects.filter(pk=job.pk).update(result_file=f'results/{job.pk}/orders.csv')
+        with Sampler() as sampler:
+            pass
+        self.profile = save_profile(sampler, 'sales-order', RequestFactory().get('/order/'), HttpResponse())
+        self.staff = User.objects.create_user('staff', is_staff=True)
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in sales_urls.urlpatterns}
+        self.assertEqual(names - set(QUERY_BUDGETS), set())
+
+    def test_pages_stay_within_budget(self):
+        for url_name, (args, budget, *options) in QUERY_BUDGETS.items():
+            options = dict(*options)
+            with self.subTest(url_name):
+                if options.pop('staff', False):
+                    self.client.force_login(self.staff)
+                else:
+                    self.client.logout()
+                status = options.pop('status', 200)
+                response = self.assertQueryBudget(budget, url_name, args=args(self) if callable(args) else args,
+                                                  **options)
+                self.assertEqual(response.status_code, status)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('sales-order'))
+        self.assertRegex(response['Server-Timing'], r'^sql;dur=[\d.]+;desc="1 queries"$')
+
+    def test_server_timing_counts_the_middleware_queries(self):
+        User.objects.create_user('admin', password='password', is_staff=True)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('admin:login'), {'username': 'admin', 'password': 'password'})
+        # the session the session middleware saves after the view has run is counted as well
+        self.assertEqual(response['Server-Timing'].split('desc=')[1], f'"{len(queries)} queries"')
+
+
+class BenchmarkTests(TestCase):
+    """
+    These tests check the benchmark dataset generator and harness on a tiny dataset
+    """
+    def test_seed_dataset_is_deterministic_and_balanced(self):
+        seed_dataset(40, seed=3)
+        first = list(Order.objects.order_by('pk').values_list('customer_id', 'product_sale_price', 'balance'))
+        Payment.objects.all().delete()
+        Order.objects.all().delete()
+        Customer.objects.all().delete()
+        seed_dataset(40, seed=3)
+        second = list(Order.objects.order_by('pk').values_list('customer_id', 'product_sale_price', 'balance'))
+        self.assertEqual(len(first), 40)
+        self.assertEqual([row[1:] for row in first], [row[1:] for row in second])
+        call_command('recompute_balances', '--check', stdout=io.StringIO())
+
+    def test_run_benchmarks_reports_every_case(self):
+        seed_dataset(20)
+        results = run_benchmarks(repeat=2)
+        self.assertIn('view:sales-order', results)
+        self.assertIn('property:Order.amount_owed', results)
+        self.assertEqual(set(results['view:sales-order']), {'p50_ms', 'p95_ms', 'queries', 'peak_memory_kb'})
+
+
+class DatabaseLayerTests(TestCase):
+    """
+    These tests check the SQLite connection settings and the read/write routing
+    """
+    databases = {'default', 'read'}
+
+    def pragma(self, alias, name):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        self.assertEqual(self.pragma('default', 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma('default', 'synchronous'), 1)
+        self.assertEqual(self.pragma('read', 'query_only'), 1)
+        self.assertEqual(self.pragma('default', 'query_only'), 0)
+
+    def test_reads_stay_on_default_inside_a_write_transaction(self):
+        self.assertTrue(connections['default'].in_atomic_block)
+        self.assertEqual(ReadWriteRouter().db_for_read(Order), 'default')
+        self.assertEqual(ReadWriteRouter().db_for_write(Order), 'default')
+
+
+class ReadRoutingTests(SimpleTestCase):
+    def test_reads_go_to_the_read_alias_outside_transactions(self):
+        self.assertEqual(ReadWriteRouter().db_for_read(Order), 'read')
+        with self.settings(SALES_READ_DATABASE=None):
+            self.assertEqual(ReadWriteRouter().db_for_read(Order), 'default')
+
+
+class RollupTests(TestCase):
+    """
+    These tests check that the daily rollups follow order and payment writes and feed the reports page
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer)
+        self.today = timezone.localdate()
+
+    def product_sales(self):
+        return {(row.product.name, row.count, row.amount)
+                for row in DailyProductSales.objects.filter(date=self.today).select_related('product')}
+
+    def payment_totals(self):
+        return {(row.payment_type, row.count, row.amount) for row in DailyPaymentTotals.objects.filter(date=self.today)}
+
+    def test_single_writes_move_the_counters(self):
+        order = mixer.blend(Order, customer=self.customer, product=product('Chair'), product_sale_price=100.00)
+        mixer.blend(Order, customer=self.customer, product=product('Chair'), product_sale_price=50.00)
+        payment = mixer.blend(Payment, order=order, customer=self.customer, payment_type='Cash', payment_amount=30.00)
+        self.assertEqual(self.product_sales(), {('Chair', 2, 150)})
+        self.assertEqual(self.payment_totals(), {('Cash', 1, 30)})
+
+        order.product = product('Table')
+        order.save()
+        payment.payment_type = 'Card'
+        payment.save()
+        self.assertEqual(self.product_sales(), {('Chair', 1, 50), ('Table', 1, 100)})
+        self.assertEqual(self.payment_totals(), {('Card', 1, 30)})
+
+        payment.delete()
+        self.assertEqual(self.payment_totals(), set())
+
+    def test_bulk_writes_rebuild_their_days(self):
+        Order.objects.bulk_create([
+            Order(customer=self.customer, product=product('Lamp'), product_sale_price=10) for _ in range(3)
+        ])
+        self.assertEqual(self.product_sales(), {('Lamp', 3, 30)})
+        Order.objects.filter(product__name='Lamp').update(product_sale_price=20)
+        self.assertEqual(self.product_sales(), {('Lamp', 3, 60)})
+        Order.objects.all().delete()
+        self.assertEqual(self.product_sales(), set())
+
+    def test_rebuild_command_restores_rollups(self):
+        mixer.blend(Order, customer=self.customer, product=product('Desk'), product_sale_price=70.00)
+        DailyProductSales.objects.all().delete()
+        call_command('rebuild_rollups', '--start', str(self.today), stdout=io.StringIO())
+        self.assertEqual(self.product_sales(), {('Desk', 1, 70)})
+
+    def test_reports_page_reads_only_rollups(self):
+        order = mixer.blend(Order, customer=self.customer, product=product('Rug'), product_sale_price=80.00)
+        mixer.blend(Payment, order=order, customer=self.customer, payment_type='Card', payment_amount=80.00)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('sales-reports'))
+        self.assertTrue(all('sales_order' not in query['sql'] and 'sales_payment"' not in query['sql']
+                            for query in queries))
+        self.assertEqual(list(response.context['sales_by_product']), [{'product': product('Rug').pk, 'name': 'Rug', 'orders': 1, 'revenue': 80}])
+        self.assertEqual(list(response.context['payments_by_type']),
+                         [{'payment_type': 'Card', 'payments': 1, 'total': 80}])
+
+
+class AgingReportTests(TestCase):
+    """
+    These tests check the accounts-receivable aging buckets, totals, drill-down and CSV export
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer, first_name='Ann', last_name='Lee')
+        other = mixer.blend(Customer)
+        now = timezone.now()
+        for days_ago, price, customer in [(5, 100, self.customer), (45, 200, self.customer),
+                                          (75, 300, self.customer), (200, 400, other), (10, 50, other)]:
+            order = mixer.blend(Order, customer=customer, product_sale_price=price)
+            Order.objects.filter(pk=order.pk).update(date_bought=now - datetime.timedelta(days=days_ago))
+        paid = Order.objects.get(customer=other, product_sale_price=50)
+        mixer.blend(Payment, order=paid, customer=other, payment_amount=50.00)
+
+    def test_buckets_and_totals_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = {row['customer_id']: row for row in aging_by_customer()}
+        row = rows[self.customer.pk]
+        self.assertEqual((row['days_0_30'], row['days_31_60'], row['days_61_90'], row['days_over_90']),
+                         (100, 200, 300, 0))
+        self.assertEqual(row['total'], 600)
+        totals = aging_totals()
+        self.assertEqual((totals['days_over_90'], totals['total']), (400, 1000))
+
+    def test_as_of_date_ages_the_orders(self):
+        rows = {row['customer_id']: row for row in aging_by_customer(timezone.localdate() + datetime.timedelta(days=30))}
+        self.assertEqual(rows[self.customer.pk]['days_over_90'], 300)
+
+    def test_past_dates_use_the_payments_made_by_then(self):
+        now = timezone.now()
+        customer = mixer.blend(Customer)
+        order = mixer.blend(Order, customer=customer, product_sale_price=100.00)
+        Order.objects.filter(pk=order.pk).update(date_bought=now - datetime.timedelta(days=400))
+        payment, _ = post_payment(order.pk, customer.pk, 'Cash', Decimal('100.00'))
+        Payment.objects.filter(pk=payment.pk).update(date_paid=now - datetime.timedelta(days=390))
+        as_of = timezone.localdate() - datetime.timedelta(days=395)
+        for archived in (False, True):
+            with self.subTest(archived=archived):
+                if archived:
+                    self.assertEqual(archive_sales(), (1, 1))
+                row = {row['customer_id']: row for row in aging_by_customer(as_of)}[customer.pk]
+                self.assertEqual((row['days_0_30'], row['total']), (100, balance_as_of(customer.pk, as_of)))
+                self.assertEqual([o.outstanding for o in customer_open_orders(customer, as_of)], [100])
+                self.assertNotIn(customer.pk, {row['customer_id'] for row in aging_by_customer()})
+                self.assertEqual(customer_open_orders(customer), [])
+
+    def test_pages_and_csv(self):
+        response = self.client.get(reverse('sales-aging'))
+        self.assertContains(response, 'Ann Lee')
+        response = self.client.get(reverse('sales-aging-customer', args=[self.customer.pk]))
+        self.assertEqual([order.aging_bucket for order in response.context['orders']],
+                         ['61-90 days', '31-60 days', '0-30 days'])
+        response = self.client.get(reverse('sales-aging-csv'))
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([Decimal(row['total']) for row in rows], [600, 400])
+
+
+class FragmentCacheTests(TestCase):
+    """
+    These tests check that the list pages serve unchanged rows from the fragment cache and re-render only the rows
+    a write touched
+    """
+    def setUp(self):
+        self.cache = caches[FRAGMENT_CACHE]
+        self.cache.clear()
+        self.customer = mixer.blend(Customer, first_name='Ann', last_name='Lee')
+        self.other = mixer.blend(Customer)
+        self.order = mixer.blend(Order, customer=self.customer, product_sale_price=100.00)
+        self.other_order = mixer.blend(Order, customer=self.other, product_sale_price=40.00)
+
+    def render(self, url_name):
+        self.cache.reset_stats()
+        response = self.client.get(reverse(url_name))
+        stats = self.cache.stats()
+        return response, stats['hits'], stats['misses']
+
+    def test_repeat_renders_are_cache_reads(self):
+        for url_name in ('sales-customer', 'sales-order', 'sales-payment'):
+            self.render(url_name)
+        self.assertEqual(self.render('sales-customer')[1:], (2, 0))
+        self.assertEqual(self.render('sales-order')[1:], (2, 0))
+
+    def test_payment_invalidates_only_its_order_and_customer(self):
+        self.render('sales-order')
+        self.render('sales-customer')
+        mixer.blend(Payment, order=self.order, customer=self.customer, payment_amount=30.00)
+        response, hits, misses = self.render('sales-order')
+        self.assertEqual((hits, misses), (1, 1))
+        self.assertContains(response, 'Total Amount Owed: $70.00')
+        response, hits, misses = self.render('sales-customer')
+        self.assertEqual((hits, misses), (1, 1))
+        self.assertContains(response, 'Total Amount Owed: $70.00')
+
+    def test_customer_edit_rerenders_its_rows_and_keeps_balances(self):
+        stale = Customer.objects.get(pk=self.customer.pk)
+        mixer.blend(Order, customer=self.customer, product_sale_price=10.00)
+        self.render('sales-order')
+        stale.first_name = 'Anna'
+        stale.save()
+        self.assertEqual(Customer.objects.get(pk=self.customer.pk).balance, 110)
+        response, hits, misses = self.render('sales-order')
+        self.assertEqual((hits, misses), (1, 2))
+        self.assertContains(response, 'Anna Lee', count=2)
+
+    def test_bulk_updates_move_versions_on(self):
+        before = Order.objects.get(pk=self.order.pk).version
+        Order.objects.filter(pk=self.order.pk).update(product=product('Lamp'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.version, before + 1)
+        self.assertEqual(Order.objects.get(pk=self.other_order.pk).version, self.other_order.version)
+
+    def test_deleted_customer_row_is_dropped(self):
+        customer = mixer.blend(Customer, first_name='Gone')
+        self.render('sales-customer')
+        customer.delete()
+        self.assertEqual(len(self.cache._cache), 2)
+
+    def test_stats_endpoint(self):
+        self.render('sales-customer')
+        self.render('sales-customer')
+        stats = self.client.get(reverse('sales-cache-stats')).json()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (2, 0, 2))
+
+
+class AutocompleteTests(TestCase):
+    """
+    These tests check the customer and order pickers' autocomplete lookups
+    """
+    def setUp(self):
+        self.ann = mixer.blend(Customer, first_name='Ann', last_name='Lee', email='ann@example.com')
+        self.bob = mixer.blend(Customer, first_name='Bob', last_name='Annan', email='bob@example.com')
+        mixer.blend(Customer, first_name='Carl', last_name='Moe', email='carl@example.com')
+
+    def lookup(self, kind, **params):
+        response = self.client.get(reverse('sales-autocomplete', args=[kind]), params)
+        return [result['id'] for result in response.json()['results']]
+
+    def test_customer_prefixes(self):
+        self.assertEqual(self.lookup('customers', q='ann'), [self.bob.pk, self.ann.pk])
+        self.assertEqual(self.lookup('customers', q='Ann Le'), [self.ann.pk])
+        self.assertEqual(self.lookup('customers', q='bob@'), [self.bob.pk])
+        self.assertEqual(self.lookup('customers', q=str(self.ann.pk)), [self.ann.pk])
+        self.assertEqual(self.lookup('customers', q='ann', limit=1), [self.bob.pk])
+        self.assertEqual(self.lookup('customers', q=''), [])
+
+    def test_prefix_search_uses_the_index(self):
+        self.assertIn('sales_customer_last_name_search_idx',
+                      Customer.objects.filter(last_name__istartswith='le').explain())
+        for column in ('name', 'sku'):
+            self.assertIn(f'sales_product_{column}_search_idx',
+                          Product.objects.filter(**{f'{column}__istartswith': 'ch'}).explain())
+
+    def test_orders_are_the_open_orders_of_the_customer(self):
+        open_order = mixer.blend(Order, customer=self.ann, product=product('Chair'), product_sale_price=100.00)
+        paid = mixer.blend(Order, customer=self.ann, product=product('Chair'), product_sale_price=10.00)
+        mixer.blend(Payment, order=paid, customer=self.ann, payment_amount=10.00)
+        mixer.blend(Order, customer=self.bob, product=product('Chair'), product_sale_price=100.00)
+        self.assertEqual(self.lookup('orders', customer=self.ann.pk), [open_order.pk])
+        self.assertEqual(self.lookup('orders', customer=self.ann.pk, q='ch'), [open_order.pk])
+        self.assertEqual(self.lookup('orders', customer=self.ann.pk, q='desk'), [])
+        response = self.client.get(reverse('sales-autocomplete', args=['orders']))
+        self.assertEqual(response.status_code, 400)
+
+    def test_form_pages_do_not_list_the_tables(self):
+        for _ in range(5):
+            mixer.blend(Order, customer=self.ann)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('payment-accept'))
+        self.assertContains(response, 'data-autocomplete-url="/autocomplete/orders/"')
+        self.assertContains(response, 'data-autocomplete-depends-on="customer"')
+        self.assertContains(response, '<datalist id="id_customer_options">')
+
+
+class PaymentPostingTests(TestCase):
+    """
+    These tests check the checks and the idempotency of payments.post_payment and the payment page
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer)
+        self.order = mixer.blend(Order, customer=self.customer, product_sale_price=100.00)
+
+    def test_rejects_wrong_customer_and_overpayment(self):
+        other = mixer.blend(Customer)
+        for customer_id, amount, code in [(other.pk, 10, 'customer_mismatch'), (self.customer.pk, '100.01', 'overpayment'),
+                                          (self.customer.pk, 0, 'invalid_amount')]:
+            with self.assertRaises(ValidationError) as raised:
+                post_payment(self.order.pk, customer_id, 'Cash', amount)
+            self.assertEqual(raised.exception.code, code)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_same_key_records_one_payment(self):
+        first, created = post_payment(self.order.pk, self.customer.pk, 'Card', '60.00', 'key-1')
+        again, created_again = post_payment(self.order.pk, self.customer.pk, 'Card', 60, 'key-1')
+        self.assertEqual((created, created_again, again.pk), (True, False, first.pk))
+        with self.assertRaises(ValidationError):
+            post_payment(self.order.pk, self.customer.pk, 'Card', 20, 'key-1')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.balance, 40)
+
+    def test_double_submitted_form(self):
+        data = {'order': self.order.pk, 'customer': self.customer.pk, 'payment_type': 'Cash',
+                'payment_amount': '30.00', 'idempotency_key': 'form-1'}
+        self.assertEqual(self.client.post(reverse('payment-accept'), data).status_code, 302)
+        self.assertEqual(self.client.post(reverse('payment-accept'), data).status_code, 302)
+        self.assertEqual(Payment.objects.count(), 1)
+        response = self.client.post(reverse('payment-accept'), {**data, 'payment_amount': '80.00', 'idempotency_key': ''})
+        self.assertContains(response, 'left to pay on this order')
+
+    def test_import_rows_cannot_overpay_together(self):
+        data = ''.join(
+            json.dumps({'order': self.order.pk, 'customer': self.customer.pk, 'payment_type': 'Card',
+                        'payment_amount': '40.00'}) + '\n'
+            for _ in range(3)
+        )
+        report = import_rows('payments', read_rows(io.StringIO(data), 'jsonl'))
+        self.assertEqual((report.created, [error['row'] for error in report.errors]), (2, [3]))
+
+
+class PaymentConcurrencyTests(TransactionTestCase):
+    """
+    These tests post payments from several threads at once and check that none is lost, recorded twice or lets an
+    order be overpaid
+    """
+    databases = {'default', 'read'}
+
+    def test_concurrent_posts(self):
+        customer = mixer.blend(Customer)
+        order = mixer.blend(Order, customer=customer, product_sale_price=100.00)
+        # 150 distinct payments of $1 against a $100 order, each posted by two different threads
+        keys = [f'key-{i}' for i in range(150)]
+        outcomes, errors = [], []
+        lock = threading.Lock()
+
+        def terminal(my_keys):
+            try:
+                for key in my_keys:
+                    try:
+                        _, created = post_payment(order.pk, customer.pk, 'Card', 1, key)
+                        result = 'created' if created else 'replayed'
+                    except ValidationError as error:
+                        result = error.code
+                    with lock:
+                        outcomes.append((key, result))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=terminal, args=(keys[i::3] + keys[(i + 1) % 3::3],)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(outcomes), 300)
+        created = [key for key, result in outcomes if result == 'created']
+        self.assertEqual(len(created), 100)
+        self.assertEqual(len(set(created)), 100)
+        self.assertEqual(set(result for _, result in outcomes), {'created', 'replayed', 'overpayment'})
+        self.assertEqual(Payment.objects.count(), 100)
+        self.assertEqual(set(Payment.objects.values_list('idempotency_key', flat=True)), set(created))
+        order = Order.objects.with_computed_balances().get(pk=order.pk)
+        self.assertEqual((order.paid_total, order.computed_paid_total, order.balance), (100, 100, 0))
+        customer = Customer.objects.with_computed_balances().get(pk=customer.pk)
+        self.assertEqual((customer.balance, customer.amount_owed), (0, 0))
+
+    def test_payment_posted_while_an_import_batch_is_checked(self):
+        customer = mixer.blend(Customer)
+        order = mixer.blend(Order, customer=customer, product_sale_price=100.00)
+        outcomes = []
+
+        def post():
+            try:
+                post_payment(order.pk, customer.pk, 'Cash', 50)
+                outcomes.append('created')
+            except ValidationError as error:
+                outcomes.append(error.code)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=post)
+        batch_form_class = imports._batch_form_class
+
+        def checked_while_posting(*args):
+            form_class = batch_form_class(*args)
+            # the payment has to wait for the batch's transaction
+            thread.start()
+            thread.join(0.5)
+            return form_class
+
+        data = json.dumps({'order': order.pk, 'customer': customer.pk, 'payment_type': 'Card',
+                           'payment_amount': '100.00'}) + '\n'
+        with mock.patch.object(imports, '_batch_form_class', checked_while_posting):
+            report = import_rows('payments', read_rows(io.StringIO(data), 'jsonl'))
+        thread.join()
+        self.assertEqual((report.created, outcomes), (1, ['overpayment']))
+        self.assertEqual(Order.objects.get(pk=order.pk).balance, 0)
+
+
+class ApiTests(TestCase):
+    """
+    These tests check the JSON API's batch creation and paginated lists
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer, first_name='Ann', last_name='Lee')
+        self.chair, self.lamp = product('Chair'), product('Lamp')
+
+    def post(self, url_name, items, **params):
+        url = reverse(url_name) + ('?' + '&'.join(f'{k}={v}' for k, v in params.items()) if params else '')
+        return self.client.post(url, json.dumps(items), content_type='application/json')
+
+    def test_batch_of_orders_and_payments(self):
+        response = self.post('sales-api-orders', [
+            {'customer': self.customer.pk, 'product': self.chair.pk, 'product_sale_price': '100.00'},
+            {'customer': 0, 'product': self.chair.pk, 'product_sale_price': '50.00'},
+            {'customer': self.customer.pk, 'product': self.lamp.pk, 'product_sale_price': 25},
+        ])
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body['created'], body['rejected']), (2, 1))
+        self.assertIn('customer', body['results'][1]['errors'])
+        chair, lamp = body['results'][0]['id'], body['results'][2]['id']
+        self.assertEqual(Order.objects.get(pk=lamp).product, self.lamp)
+
+        body = self.post('sales-api-payments', [
+            {'order': chair, 'customer': self.customer.pk, 'payment_type': 'Card', 'payment_amount': '60.00'},
+            {'order': chair, 'customer': self.customer.pk, 'payment_type': 'Card', 'payment_amount': '60.00'},
+        ]).json()
+        self.assertEqual(body['created'], 1)
+        self.assertIn('payment_amount', body['results'][1]['errors'])
+        self.assertEqual(Order.objects.get(pk=chair).balance, 40)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, 65)
+
+    def test_dry_run_and_bad_bodies(self):
+        body = self.post('sales-api-orders', [{'customer': self.customer.pk, 'product': self.lamp.pk,
+                                               'product_sale_price': 5}], dry_run=1).json()
+        self.assertEqual((body['created'], body['results']), (0, [{'id': None}]))
+        self.assertFalse(Order.objects.exists())
+        body = self.post('sales-api-orders', [{'customer': self.customer.pk, 'product': 'Rug',
+                                               'product_sale_price': 5}]).json()
+        self.assertIn('product', body['results'][0]['errors'])
+        body = self.post('sales-api-orders', [{'customer': self.customer.pk, 'product': 'LAMP',
+                                               'product_sale_price': 5}]).json()
+        self.assertEqual(Order.objects.get(pk=body['results'][0]['id']).product, self.lamp)
+        self.assertEqual(self.post('sales-api-orders', {'customer': 1}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('sales-api-customers')).status_code, 405)
+
+    def test_batch_costs_the_same_queries_whatever_its_size(self):
+        def create(count):
+            with CaptureQueriesContext(connection) as queries:
+                self.post('sales-api-orders', [
+                    {'customer': self.customer.pk, 'product': self.chair.pk, 'product_sale_price': 10}
+                ] * count)
+            return len(queries)
+        self.assertEqual(create(2), create(20))
+
+    def test_paginated_lists(self):
+        for price in (10, 20, 30):
+            mixer.blend(Order, customer=self.customer, product_sale_price=price)
+        first = self.client.get(reverse('sales-api-orders'), {'page_size': 2}).json()
+        self.assertEqual([order['product_sale_price'] for order in first['results']], ['10.00', '20.00'])
+        second = self.client.get(reverse('sales-api-orders'), {'page_size': 2, 'cursor': first['next']}).json()
+        self.assertEqual([order['balance'] for order in second['results']], ['30.00'])
+        self.assertIsNone(second['next'])
+        customers = self.client.get(reverse('sales-api-customers'), {'live': 1}).json()['results']
+        self.assertEqual(customers, [{'id': self.customer.pk, 'first_name': 'Ann', 'last_name': 'Lee',
+                                      'email': self.customer.email, 'balance': '60.00'}])
+
+
+class ProductCatalogTests(TestCase):
+    """
+    These tests check that orders and their rollups follow the product catalog
+    """
+    def setUp(self):
+        caches[FRAGMENT_CACHE].clear()
+        self.customer = mixer.blend(Customer, first_name='Ann', last_name='Lee')
+        self.chair = Product.objects.create(name='Oak Chair', sku='OC-1', list_price=120)
+        self.order = mixer.blend(Order, customer=self.customer, product=self.chair, product_sale_price=100.00)
+
+    def test_rename_shows_on_every_order_row(self):
+        self.client.get(reverse('sales-order'))
+        self.chair.name = 'Elm Chair'
+        self.chair.save()
+        self.assertContains(self.client.get(reverse('sales-order')), 'Elm Chair')
+
+    def test_rollups_are_keyed_by_product(self):
+        renamed = Product.objects.create(name='Oak chair ', sku='OC-2', list_price=80)
+        mixer.blend(Order, customer=self.customer, product=renamed, product_sale_price=50.00)
+        rows = DailyProductSales.objects.order_by('product_id').values_list('product_id', 'count', 'amount')
+        self.assertEqual(list(rows), [(self.chair.pk, 1, 100), (renamed.pk, 1, 50)])
+        with self.assertRaises(ProtectedError):
+            self.chair.delete()
+
+    def test_autocomplete_matches_names_and_skus(self):
+        def lookup(term):
+            response = self.client.get(reverse('sales-autocomplete', args=['products']), {'q': term})
+            return [result['text'] for result in response.json()['results']]
+        self.assertEqual(lookup('oak'), ['Oak Chair (OC-1)'])
+        self.assertEqual(lookup('oc-'), ['Oak Chair (OC-1)'])
+        self.assertEqual(lookup('pine'), [])
+
+    def test_order_placement_takes_a_product_id(self):
+        self.client.post(reverse('order-placement'), {
+            'customer': self.customer.pk, 'product': self.chair.pk, 'product_sale_price': '120.00',
+        })
+        self.assertEqual(Order.objects.filter(product=self.chair).count(), 2)
+
+
+class SearchTests(TestCase):
+    """
+    These tests check that the full-text indexes follow every kind of write and rank their matches
+    """
+    def setUp(self):
+        self.ann = mixer.blend(Customer, first_name='Ann', last_name='Lee', email='ann@example.com')
+        self.bob = mixer.blend(Customer, first_name='Bob', last_name='Stone', email='annals@example.com')
+
+    def test_match_expression(self):
+        self.assertEqual(match_expression('Ann  "Lee" OR*'), '"Ann"* "Lee"* "OR"*')
+        self.assertEqual(match_expression('"*'), '')
+
+    def test_customers_ranked_by_name_before_email(self):
+        self.assertEqual(search_customers('ann'), [self.ann, self.bob])
+        self.assertEqual(search_customers('ann lee'), [self.ann])
+        self.assertEqual(search_customers('example.com'), [self.ann, self.bob])
+
+    def test_index_follows_writes(self):
+        self.ann.last_name = 'Moore'
+        self.ann.save()
+        self.assertEqual(search_customers('lee'), [])
+        self.assertEqual(search_customers('moore'), [self.ann])
+
+        table, chair = product('Oak Table'), product('Oak Chair')
+        order = mixer.blend(Order, customer=self.ann, product=table)
+        Order.objects.bulk_create([Order(customer=self.bob, product=chair, product_sale_price=5)])
+        self.assertEqual({o.product.name for o in search_orders('oak')}, {'Oak Table', 'Oak Chair'})
+        Order.objects.filter(pk=order.pk).update(product=product('Pine Table'))
+        self.assertEqual([o.product.name for o in search_orders('oak')], ['Oak Chair'])
+        Product.objects.filter(pk=chair.pk).update(name='Elm Chair', sku='ELM-CHAIR')
+        self.assertEqual(search_orders('oak'), [])
+        self.assertEqual(search_products('elm'), [chair])
+
+    def test_orders_are_the_latest_of_the_best_products(self):
+        oak, oak_chair = product('Oak'), product('Oak Chair')
+        orders = [mixer.blend(Order, customer=self.ann, product=oak) for _ in range(3)]
+        chair_order = mixer.blend(Order, customer=self.ann, product=oak_chair)
+        self.assertEqual(search_orders('oak', limit=2), orders[:0:-1])
+        self.assertEqual(search_orders('oak chair', limit=2), [chair_order])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO sales_customer_fts(sales_customer_fts) VALUES ('delete-all')")
+        self.assertEqual(search_customers('ann'), [])
+        call_command('rebuild_search_index', '--optimize', stdout=io.StringIO())
+        self.assertEqual(search_customers('ann'), [self.ann, self.bob])
+
+    def test_search_page(self):
+        mixer.blend(Order, customer=self.ann, product=product('Lamp'))
+        mixer.blend(Order, customer=self.bob, product=product('Lamp shade'))
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('sales-search'), {'q': 'lamp'})
+        self.assertEqual([o.product.name for o in response.context['orders']], ['Lamp', 'Lamp shade'])
+        self.assertEqual([p.name for p in response.context['products']], ['Lamp', 'Lamp shade'])
+        self.assertContains(response, 'Bob Stone')
+
+
+class MoneyTests(TestCase):
+    """
+    These tests check that amounts are stored and summed as whole cents and read back as two-place decimals
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer)
+        self.order = mixer.blend(Order, customer=self.customer, product=product('Pen'), product_sale_price='1.00')
+
+    def test_conversions(self):
+        self.assertEqual(to_cents(Decimal('10.29')), 1029)
+        self.assertEqual(to_cents('0.005'), 1)
+        self.assertEqual(to_cents(-2), -200)
+        self.assertEqual(str(from_cents(1029)), '10.29')
+
+    def test_columns_hold_integers(self):
+        for _ in range(3):
+            mixer.blend(Payment, order=self.order, customer=self.customer, payment_amount='0.10')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT balance, typeof(balance) FROM sales_customer WHERE id = %s', [self.customer.pk])
+            self.assertEqual(cursor.fetchone(), (70, 'integer'))
+            cursor.execute('SELECT SUM(payment_amount), typeof(SUM(payment_amount)) FROM sales_payment')
+            self.assertEqual(cursor.fetchone(), (30, 'integer'))
+
+    def test_sums_are_exact_decimals(self):
+        Payment.objects.bulk_create([
+            Payment(order=self.order, customer=self.customer, payment_type='Cash', payment_amount=Decimal('0.10'))
+            for _ in range(10)
+        ])
+        self.order.refresh_from_db()
+        self.assertEqual(str(self.order.balance), '0.00')
+        customer = Customer.objects.with_balances(live=True).get(pk=self.customer.pk)
+        self.assertEqual((str(customer.computed_total_paid), str(customer.amount_owed)), ('1.00', '0.00'))
+        self.assertEqual(str(DailyPaymentTotals.objects.get().amount), '1.00')
+        self.assertEqual(Order.objects.filter(balance__lt=Decimal('0.01')).count(), 1)
+
+
+class AdminTests(TestCase):
+    """
+    These tests check that the admin changelists cost the same queries whatever the table size and that the bulk
+    action settles orders set-based
+    """
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.customer = mixer.blend(Customer)
+
+    def changelist_queries(self, model, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:sales_{model}_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries]
+
+    def test_changelists_run_a_fixed_number_of_queries(self):
+        def add_orders(count):
+            for _ in range(count):
+                order = mixer.blend(Order, customer=mixer.blend(Customer), product_sale_price=10.00)
+                mixer.blend(Payment, order=order, customer=order.customer, payment_amount=5.00)
+
+        def queries():
+            return [len(self.changelist_queries(model)) for model in ('customer', 'order', 'payment')]
+        add_orders(1)
+        few = queries()
+        add_orders(10)
+        self.assertEqual(queries(), few)
+
+    def test_dates_are_filtered_by_indexed_ranges(self):
+        order = mixer.blend(Order, customer=self.customer)
+        mixer.blend(Payment, order=order, customer=self.customer)
+        today = timezone.localdate()
+        for model, field in [('order', 'date_bought'), ('payment', 'date_paid'), ('archivedorder', 'date_bought'),
+                             ('archivedpayment', 'date_paid')]:
+            with self.subTest(model):
+                sql = ' '.join(self.changelist_queries(model)).upper()
+                self.assertNotIn('DISTINCT', sql)
+                self.changelist_queries(model, **{f'{field}__gte': str(today),
+                                                  f'{field}__lt': str(today + datetime.timedelta(days=1))})
+
+    def test_large_tables_are_counted_by_estimate(self):
+        mixer.cycle(3).blend(Order, customer=self.customer)
+        with self.settings(SALES_ADMIN_EXACT_COUNT_LIMIT=2):
+            self.assertFalse(any('COUNT(' in sql for sql in self.changelist_queries('order')))
+            self.assertTrue(any('COUNT(' in sql for sql in self.changelist_queries('order', settled='no')))
+        self.assertTrue(any('COUNT(' in sql for sql in self.changelist_queries('order')))
+
+    def test_estimate_uses_the_analyzed_row_count(self):
+        orders = mixer.cycle(5).blend(Order, customer=self.customer)
+        Order.objects.filter(pk__in=[order.pk for order in orders[1:4]]).delete()
+        # before ANALYZE the span of the ids, gaps included
+        self.assertEqual(estimated_count(Order.objects.all()), 5)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE sales_order')
+        self.assertEqual(estimated_count(Order.objects.all()), 2)
+
+    def test_payments_are_read_only(self):
+        order = mixer.blend(Order, customer=self.customer, product_sale_price=10.00)
+        payment = mixer.blend(Payment, order=order, customer=self.customer, payment_amount=5.00)
+        self.assertEqual(self.client.get(reverse('admin:sales_payment_add')).status_code, 403)
+        # an overpayment the admin form would have saved without the payment checks
+        response = self.client.post(reverse('admin:sales_payment_change', args=[payment.pk]), {
+            'order': order.pk, 'customer': self.customer.pk, 'payment_type': 'Cash', 'payment_amount': '500.00',
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:sales_payment_change', args=[payment.pk])).status_code, 200)
+        self.client.post(reverse('admin:sales_payment_changelist'), {
+            'action': 'delete_selected', '_selected_action': [payment.pk], 'post': 'yes',
+        })
+        self.assertEqual(Payment.objects.get().payment_amount, 5)
+
+    def test_mark_settled(self):
+        open_order = mixer.blend(Order, customer=self.customer, product_sale_price=100.00)
+        mixer.blend(Payment, order=open_order, customer=self.customer, payment_amount=30.00)
+        paid = mixer.blend(Order, customer=self.customer, product_sale_price=10.00)
+        mixer.blend(Payment, order=paid, customer=self.customer, payment_amount=10.00)
+        self.client.post(reverse('admin:sales_order_changelist'), {
+            'action': 'mark_settled', '_selected_action': [open_order.pk, paid.pk],
+        })
+        self.assertEqual(list(Order.objects.values_list('balance', flat=True)), [0, 0])
+        self.assertEqual(Payment.objects.filter(order=open_order, payment_type='Cash').last().payment_amount, 70)
+        self.assertEqual(Payment.objects.filter(order=paid).count(), 1)
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.total_paid, self.customer.balance), (110, 0))
+
+
+class ArchiveTests(TestCase):
+    """
+    These tests check that archiving moves settled history out of the hot tables without changing any balance or
+    rollup, and that it can be restored
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer)
+        self.long_ago = timezone.now() - datetime.timedelta(days=800)
+        self.settled = self.order(100, paid=100, when=self.long_ago)
+        self.outstanding = self.order(50, paid=20, when=self.long_ago)
+        self.recent = self.order(10, paid=10, when=timezone.now())
+
+    def order(self, price, paid, when):
+        order = mixer.blend(Order, customer=self.customer, product=product('Desk'), product_sale_price=price)
+        payment = mixer.blend(Payment, order=order, customer=self.customer, payment_amount=paid)
+        Order.objects.filter(pk=order.pk).update(date_bought=when)
+        Payment.objects.filter(pk=payment.pk).update(date_paid=when)
+        return order
+
+    def snapshot(self):
+        self.customer.refresh_from_db()
+        live = Customer.objects.with_balances(live=True).get(pk=self.customer.pk)
+        return (
+            (self.customer.total_ordered, self.customer.total_paid, self.customer.balance),
+            (live.computed_total_ordered, live.computed_total_paid),
+            sorted(DailyProductSales.objects.values_list('date', 'count', 'amount')),
+            sorted(DailyPaymentTotals.objects.values_list('date', 'count', 'amount')),
+        )
+
+    def test_archive_and_restore(self):
+        before = self.snapshot()
+        self.assertEqual(archive_sales(), (1, 1))
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {self.outstanding.pk, self.recent.pk})
+        self.assertEqual(ArchivedPayment.objects.get().order_id, self.settled.pk)
+        self.assertEqual(CarryForward.objects.get(customer=self.customer).total_ordered, 100)
+        # the tables are analyzed, so the admin estimates their rows from sqlite_stat1
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 'sales_order'")
+            self.assertTrue(cursor.fetchone()[0])
+        self.assertEqual(estimated_count(Order.objects.all()), 2)
+        for rollup in (DailyProductSales, DailyPaymentTotals):
+            rollup.rebuild()
+        call_command('recompute_balances', '--check', stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(archive_sales(), (0, 0))
+
+        self.assertEqual(restore_archived(ArchivedOrder.objects.all()), (1, 1))
+        self.assertEqual(Order.objects.get(pk=self.settled.pk).version, self.settled.version + 2)
+        self.assertFalse(ArchivedOrder.objects.exists() or CarryForward.objects.exists())
+        call_command('recompute_balances', '--check', stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), before)
+
+    def test_batches_and_command(self):
+        others = [self.order(5, paid=5, when=self.long_ago) for _ in range(4)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(archive_sales(batch_size=2), (5, 5))
+        # per batch a savepoint, the lookup, five statements and the release, then the empty lookup's savepoint,
+        # then the analysis limit and ANALYZE of the four tables
+        self.assertEqual(len(queries), 3 * 8 + 3 + 5)
+        out = io.StringIO()
+        call_command('archive_sales', '--restore', f'--customer={self.customer.pk}', stdout=out)
+        self.assertIn('Restored 5 order(s) and 5 payment(s)', out.getvalue())
+        self.assertEqual(Order.objects.filter(pk__in=[order.pk for order in others]).count(), 4)
+        call_command('archive_sales', stdout=io.StringIO())
+        self.assertEqual(ArchivedOrder.objects.count(), 5)
+        tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+        call_command('archive_sales', '--before', str(tomorrow), stdout=io.StringIO())
+        self.assertEqual(list(Order.objects.values_list('pk', flat=True)), [self.outstanding.pk])
+
+    def test_archived_history_export(self):
+        archive_sales()
+        response = self.client.get(reverse('sales-export', args=['archived-orders']))
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.settled.pk)])
+
+
+class StatementTests(TestCase):
+    """
+    These tests check that statements computed from the month-end snapshots match the full ledger
+    """
+    def setUp(self):
+        self.customer = mixer.blend(Customer, first_name='Ann', last_name='Lee')
+        self.other = mixer.blend(Customer)
+        # the 10th of each of the last three months
+        month = timezone.localdate().replace(day=1)
+        self.months = []
+        for _ in range(3):
+            month = (month - datetime.timedelta(days=1)).replace(day=1)
+            self.months.insert(0, month.replace(day=10))
+        self.orders = [self.order(self.customer, 100, 40, month) for month in self.months]
+        self.order(self.other, 70, 70, self.months[1])
+
+    def order(self, customer, price, paid, day):
+        moment = day_start(day) + datetime.timedelta(hours=12)
+        order = mixer.blend(Order, customer=customer, product=product('Desk'), product_sale_price=price)
+        payment = mixer.blend(Payment, order=order, customer=customer, payment_amount=paid)
+        Order.objects.filter(pk=order.pk).update(date_bought=moment)
+        Payment.objects.filter(pk=payment.pk).update(date_paid=moment + datetime.timedelta(days=1))
+        return order
+
+    def test_snapshots_match_the_ledger(self):
+        self.assertEqual(take_snapshots(), 3)
+        self.assertEqual(take_snapshots(), 0)
+        snapshot = BalanceSnapshot.objects.get(customer=self.customer, date=month_end(self.months[1]))
+        self.assertEqual((snapshot.total_ordered, snapshot.total_paid), (200, 80))
+        days = [self.months[0] - datetime.timedelta(days=1), self.months[1], month_end(self.months[1]),
+                self.months[2] + datetime.timedelta(days=1), timezone.localdate()]
+        with_snapshots = [balance_as_of(self.customer.pk, day) for day in days]
+        BalanceSnapshot.objects.all().delete()
+        self.assertEqual(with_snapshots, [balance_as_of(self.customer.pk, day) for day in days])
+        self.assertEqual(with_snapshots, [0, 160, 120, 180, 180])
+
+    def test_backdated_writes_discard_later_snapshots(self):
+        take_snapshots()
+        order = self.orders[1]
+        order.product_sale_price = 150
+        order.save()
+        self.assertEqual(list(BalanceSnapshot.objects.values_list('date', flat=True).distinct()),
+                         [month_end(self.months[0])])
+        take_snapshots()
+        self.assertEqual(balance_as_of(self.customer.pk, timezone.localdate()), 230)
+
+    def test_statement_and_batch_run(self):
+        take_snapshots()
+        start, end = self.months[1].replace(day=1), month_end(self.months[1])
+        statement = Statement(self.customer, start, end)
+        self.assertEqual((statement.opening_balance, statement.closing_balance), (60, 120))
+        self.assertEqual([(line['kind'], line['balance']) for line in statement.lines],
+                         [('Order', 160), ('Payment', 120)])
+
+        archive_sales(before=timezone.localdate())
+        lines = list(csv.reader(io.StringIO(''.join(stream_statements(start, end)))))
+        self.assertEqual(lines[1:], [
+            [str(self.customer.pk), 'Ann', 'Lee', '60.00', '100.00', '40.00', '120.00'],
+            [str(self.other.pk), self.other.first_name, self.other.last_name, '0.00', '70.00', '70.00', '0.00'],
+        ])
+
+    def test_statement_page(self):
+        response = self.client.get(reverse('sales-customer-statement', args=[self.customer.pk]),
+                                   {'start': self.months[0], 'end': timezone.localdate()})
+        self.assertContains(response, 'Opening balance')
+        self.assertContains(response, '$180.00')
+
+
+def crash_on_first_attempt(run):
+    if run.job.attempts == 1:
+        os._exit(1)
+    return 'done'
+
+
+def always_fails(run):
+    raise RuntimeError('broken')
+
+
+@override_settings(SALES_JOB_RETRY_DELAY=0)
+class JobTests(TestCase):
+    """
+    These tests queue jobs through the views and run them with the worker, in this process
+    """
+    def setUp(self):
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        settings = override_settings(SALES_JOB_FILES_DIR=files.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.customer = mixer.blend(Customer, first_name='Ann')
+        mixer.blend(Order, customer=self.customer, product_sale_price=25.00)
+
+    def work(self):
+        out = io.StringIO()
+        call_command('run_sales_worker', '--concurrency', '0', '--once', stdout=out)
+        return out.getvalue()
+
+    def test_export_job_from_queue_to_download(self):
+        self.assertContains(self.client.get(reverse('sales-jobs')), 'Customer statements')
+        response = self.client.post(reverse('sales-job-enqueue', args=['export']),
+                                    {'export-export': 'orders', 'export-format': 'csv'})
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('sales-job', args=[job.pk]))
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('1 job(s) succeeded', self.work())
+        status = self.client.get(reverse('sales-job-status', args=[job.pk])).json()
+        self.assertEqual((status['status'], status['progress'], status['finished']), ('succeeded', 100, True))
+        response = self.client.get(status['result_url'])
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['customer__first_name'] for row in rows], ['Ann'])
+        self.assertContains(self.client.get(reverse('sales-job', args=[job.pk])), 'Download the result')
+
+    def test_import_job_is_not_retried(self):
+        upload = SimpleUploadedFile('orders.csv', (
+            f'customer,product,product_sale_price\n{self.customer.pk},{product("Desk").pk},10.00\n999,1,5\n'
+        ).encode())
+        self.client.post(reverse('sales-job-enqueue', args=['import']),
+                         {'import-kind': 'orders', 'import-format': 'csv', 'import-file': upload})
+        job = Job.objects.get()
+        self.assertEqual(job.max_attempts, 1)
+        self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.message), (Job.SUCCEEDED, '2 row(s) read, 1 created, 1 rejected'))
+        self.assertEqual(self.customer.order_set.count(), 2)
+        self.assertTrue(job.result_file.endswith('errors.jsonl'))
+
+    def test_invalid_form_is_shown_again(self):
+        response = self.client.post(reverse('sales-job-enqueue', args=['statements']), {'statements-start': 'x'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(self.client.get(reverse('sales-job-enqueue', args=['nope'])).status_code, 404)
+
+    def test_queueing_and_downloading_need_staff(self):
+        job = enqueue('export', {'export': 'orders', 'format': 'csv'})
+        self.work()
+        self.client.logout()
+        for response in (self.client.post(reverse('sales-job-enqueue', args=['recompute-balances'])),
+                         self.client.get(reverse('sales-job-result', args=[job.pk]))):
+            self.assertRedirects(response, f"{reverse('admin:login')}?next={response.wsgi_request.path}")
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_claims_are_exclusive_and_wait_for_run_after(self):
+        first = enqueue('recompute-balances')
+        Job.objects.filter(pk=enqueue('archive').pk).update(
+            run_after=timezone.now() + datetime.timedelta(minutes=5)
+        )
+        self.assertEqual(claim('a').pk, first.pk)
+        self.assertIsNone(claim('b'))
+        self.assertEqual(Job.objects.get(pk=first.pk).attempts, 1)
+
+    def test_failing_job_is_retried_then_failed(self):
+        with mock.patch.dict(JOB_KINDS, {'fails': JobKind('Fails', always_fails, forms.Form, True)}):
+            job = enqueue('fails')
+            self.assertIn('0 job(s) succeeded, 2 queued for a retry, 1 failed', self.work())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertIn('RuntimeError: broken', job.error)
+
+    def test_job_of_an_unknown_kind_fails_at_once(self):
+        with mock.patch.dict(JOB_KINDS, {'retired': JobKind('Retired', always_fails, forms.Form, True)}):
+            job = enqueue('retired')
+        self.assertEqual(job.max_attempts, 3)
+        self.assertContains(self.client.get(reverse('sales-job', args=[job.pk])), 'retired')
+        self.assertIn('0 job(s) succeeded, 0 queued for a retry, 1 failed', self.work())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), (Job.FAILED, 1, "Unknown job kind 'retired'"))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_abandoned_job_is_recovered(self):
+        job = enqueue('recompute-balances')
+        claim('dead-worker')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(recover_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('dead-worker stopped sending heartbeats', job.error)
+        self.assertIn('1 job(s) succeeded', self.work())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), (Job.SUCCEEDED, 2, ''))
+
+
+@override_settings(SALES_JOB_RETRY_DELAY=0)
+class JobPoolTests(TransactionTestCase):
+    """
+    These tests run jobs on the worker's process pool, where a job can take its process down with it
+    """
+    databases = {'default', 'read'}
+
+    def test_jobs_survive_a_crashed_process(self):
+        with tempfile.TemporaryDirectory() as files, override_settings(SALES_JOB_FILES_DIR=files), \
+                mock.patch.dict(JOB_KINDS, {'crash': JobKind('Crash', crash_on_first_attempt, forms.Form, True)}):
+            crash = enqueue('crash')
+            export = enqueue('export', {'export': 'customers', 'format': 'jsonl'})
+            counts = Worker(concurrency=2, poll_interval=0.05).run(once=True)
+        self.assertEqual(Job.objects.get(pk=crash.pk).status, Job.SUCCEEDED)
+        self.assertEqual(Job.objects.get(pk=export.pk).status, Job.SUCCEEDED)
+        self.assertEqual(counts[Job.SUCCEEDED], 2)
+        self.assertGreaterEqual(counts[Job.QUEUED], 1)
+
+
+class StartupTests(TestCase):
+    """
+    These tests check the boot time instrumentation and the warm-up stages of the WSGI workers
+    """
+    databases = {'default', 'read'}
+
+    def test_import_timer_leaves_out_nested_imports(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'startup_outer.py'), 'w') as module:
+                module.write('import startup_inner\n')
+            with open(os.path.join(directory, 'startup_inner.py'), 'w') as module:
+                module.write('import time\ntime.sleep(0.05)\n')
+            sys.path.insert(0, directory)
+            self.addCleanup(sys.path.remove, directory)
+            self.addCleanup(sys.modules.pop, 'startup_inner', None)
+            self.addCleanup(sys.modules.pop, 'startup_outer', None)
+            with ImportTimer().installed() as timer:
+                __import__('startup_outer')
+        self.assertGreaterEqual(timer.times['startup_inner'], 0.05)
+        self.assertLess(timer.times['startup_outer'], 0.05)
+
+    def test_ready_is_timed_per_app(self):
+        with timing_ready({}) as times:
+            AppConfig.create('sales.apps.SalesConfig').ready()
+        self.assertIn('sales', times)
+
+    def test_warm_up_stages(self):
+        self.assertIn('sales/rows/order.html', sales_template_names())
+        self.assertEqual(set(warm_up(['templates', 'urls', 'database'])), {'templates', 'urls', 'database'})
+        loader = engines['django'].engine.template_loaders[0]
+        if hasattr(loader, 'get_template_cache'):
+            self.assertIn('sales/base.html', loader.get_template_cache)
+        self.assertIsNotNone(connections['default'].connection)
+
+    @override_settings(SALES_WARMUP=['urls'])
+    def test_boot_reports_where_the_time_went(self):
+        with self.assertLogs('sales.startup', 'INFO') as logs:
+            self.assertEqual(boot(lambda: 'application'), 'application')
+        self.assertRegex(logs.output[0], r'booted in [\d.]+ ms')
+        self.assertIn('warm-up urls', logs.output[-1])
+
+
+class StaticPipelineTests(TestCase):
+    """
+    These tests collect the static files into a temporary STATIC_ROOT and serve them through the middleware
+    """
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        static = override_settings(STATIC_ROOT=root.name)
+        static.enable()
+        self.addCleanup(static.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(root.name, 'staticfiles.json')) as manifest:
+            self.hashed = json.load(manifest)['paths']['sales/main.css']
+        self.root = root.name
+
+    def get(self, path, **headers):
+        middleware = StaticFilesMiddleware(lambda request: HttpResponse('not static'))
+        return middleware(RequestFactory().get(settings.STATIC_URL + path, **headers))
+
+    def test_collect_writes_hashed_and_compressed_files(self):
+        self.assertRegex(self.hashed, r'^sales/main\.[0-9a-f]{12}\.css$')
+        for name in ('sales/main.css', self.hashed):
+            self.assertTrue(os.path.exists(os.path.join(self.root, name + '.gz')))
+            self.assertEqual(os.path.exists(os.path.join(self.root, name + '.br')), 'br' in COMPRESSORS)
+        with open(os.path.join(self.root, self.hashed), 'rb') as original, \
+                gzip.open(os.path.join(self.root, self.hashed + '.gz')) as compressed:
+            self.assertEqual(compressed.read(), original.read())
+
+    def test_pages_link_the_hashed_names(self):
+        self.assertContains(self.client.get(reverse('sales-home')), settings.STATIC_URL + self.hashed)
+
+    def test_hashed_files_are_immutable_and_precompressed(self):
+        response = self.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn(b'.site-header', gzip.decompress(body))
+        self.assertNotIn('Content-Encoding', self.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip;q=0'))
+
+    def test_plain_names_revalidate(self):
+        response = self.get('sales/main.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertNotIn('Content-Encoding', response)
+        response = self.get('sales/main.css', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_other_paths_go_through(self):
+        self.assertEqual(self.get('sales/missing.css').content, b'not static')
+        self.assertEqual(self.get('staticfiles.json').content, b'not static')
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfilingTests(TestCase):
+    """
+    These tests profile requests into a temporary SALES_PROFILE_DIR and list the profiles on the staff page
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiling = override_settings(SALES_PROFILE_DIR=directory.name, SALES_PROFILE_TOKEN='secret',
+                                      SALES_PROFILE_SAMPLE_RATE=0.0, SALES_PROFILE_INTERVAL=0.001)
+        profiling.enable()
+        self.addCleanup(profiling.disable)
+        self.directory = directory.name
+
+    def test_sampler_collapses_the_stacks_of_its_thread(self):
+        with Sampler(interval=0.001) as sampler:
+            _busy(0.05)
+        self.assertGreater(sampler.samples, 0)
+        stack, _ = sampler.stacks.most_common(1)[0]
+        self.assertTrue(stack.endswith('sales.tests:test_sampler_collapses_the_stacks_of_its_thread;'
+                                       'sales.tests:_busy'), stack)
+
+    def test_flamegraph_has_a_box_per_function(self):
+        svg = flamegraph_svg({'a:main;b:work': 3, 'a:main;c:<listcomp>': 1}, 'GET /')
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('<title>a:main (4 samples, 100.0%)</title>', svg)
+        self.assertIn('<title>b:work (3 samples, 75.0%)</title>', svg)
+        self.assertIn('c:&lt;listcomp&gt;', svg)
+
+    def test_only_authorized_requests_are_profiled(self):
+        self.assertNotIn('X-Sales-Profile', self.client.get(reverse('sales-order')))
+        self.assertNotIn('X-Sales-Profile', self.client.get(reverse('sales-order'), HTTP_X_SALES_PROFILE='wrong'))
+        self.assertEqual(latest_profiles(), {})
+        response = self.client.get(reverse('sales-order'), HTTP_X_SALES_PROFILE='secret')
+        stamp = response['X-Sales-Profile']
+        [profile] = latest_profiles()['sales-order']
+        self.assertEqual((profile['stamp'], profile['path'], profile['status']), (stamp, '/order/', 200))
+        for extension in ('collapsed', 'svg'):
+            self.assertTrue(os.path.exists(os.path.join(self.directory, 'sales-order', f'{stamp}.{extension}')))
+
+    @override_settings(SALES_PROFILE_TOKEN='', SALES_PROFILE_SAMPLE_RATE=1.0, SALES_PROFILE_KEEP=2)
+    def test_sampled_requests_keep_the_latest_profiles(self):
+        stamps = [self.client.get(reverse('sales-home'))['X-Sales-Profile'] for _ in range(3)]
+        self.assertEqual([profile['stamp'] for profile in latest_profiles()['sales-home']], stamps[:0:-1])
+
+    @override_settings(SALES_PROFILE_TOKEN='', SALES_PROFILE_SAMPLE_RATE=0.0)
+    def test_disabled_without_rate_or_token(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: HttpResponse())
+
+    def test_profiles_page_is_for_staff(self):
+        stamp = self.client.get(reverse('sales-order'), HTTP_X_SALES_PROFILE='secret')['X-Sales-Profile']
+        svg_url = reverse('sales-profile-file', args=['sales-order', stamp, 'svg'])
+        self.assertEqual(self.client.get(reverse('sales-profiles')).status_code, 302)
+        self.assertEqual(self.client.get(svg_url).status_code, 302)
+        User.objects.create_user('staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        self.assertContains(self.client.get(reverse('sales-profiles')), svg_url)
+        response = self.client.get(svg_url)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'<svg'))
+        self.assertEqual(self.client.get(reverse('sales-profile-file', args=['sales-order', stamp, 'json'])).status_code,
+                         404)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.home, name='sales-home'),
@@ -9,5 +9,25 @@ urlpatterns = [
     path('payment/', views.payment, name='sales-payment'),
     path('customer-registration/', views.customer_registration, name='customer-registration'),
     path('order-placement/', views.order_placement, name='order-placement'),
-    path('payment-accept/', views.payment_accept, name='payment-accept')
+    path('payment-accept/', views.payment_accept, name='payment-accept'),
+    path('search/', views.search, name='sales-search'),
+    path('autocomplete/<str:kind>/', views.autocomplete, name='sales-autocomplete'),
+    path('export/<str:kind>/', views.export, name='sales-export'),
+    path('import/', views.sales_import, name='sales-import'),
+    path('reports/', views.reports, name='sales-reports'),
+    path('reports/aging/', views.aging, name='sales-aging'),
+    path('reports/aging.csv', views.aging_csv, name='sales-aging-csv'),
+    path('reports/aging/<int:customer_id>/', views.aging_customer, name='sales-aging-customer'),
+    path('customer/<int:customer_id>/statement/', views.customer_statement, name='sales-customer-statement'),
+    path('api/customers/', api.customers, name='sales-api-customers'),
+    path('api/orders/', api.orders, name='sales-api-orders'),
+    path('api/payments/', api.payments, name='sales-api-payments'),
+    path('jobs/', views.jobs, name='sales-jobs'),
+    path('jobs/<str:kind>/enqueue/', views.job_enqueue, name='sales-job-enqueue'),
+    path('jobs/<int:job_id>/', views.job, name='sales-job'),
+    path('jobs/<int:job_id>/status/', views.job_status, name='sales-job-status'),
+    path('jobs/<int:job_id>/result/', views.job_result, name='sales-job-result'),
+    path('cache/stats/', views.cache_stats, name='sales-cache-stats'),
+    path('profiles/', views.profiles, name='sales-profiles'),
+    path('profiles/<str:url_name>/<str:stamp>.<str:extension>', views.profile_file, name='sales-profile-file'),
 ]
\ No newline at end of file
@@ -1,7 +1,31 @@
-from django.shortcuts import render, redirect
-from .models import Customer, Order, Payment
+import datetime
+import os
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import ValidationError
+from django.db.models import F, Sum
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
+from django.utils import timezone
+from .models import Customer, Order, Payment, DailyPaymentTotals, DailyProductSales, Job
 from django.contrib import messages
-from .forms import CustomerRegistrationForm, OrderPlacementForm, PaymentAcceptForm
+from .aging import AGING_BUCKETS, aging_by_customer, aging_totals, customer_open_orders, stream_aging_csv
+from .autocomplete import get_limit, search_customers, search_orders, search_products
+from .cache import fragment_cache_stats
+from .exports import EXPORTS, stream_export
+from .forms import CustomerRegistrationForm, OrderPlacementForm, PaymentAcceptForm, ExportFilterForm, ImportUploadForm, \
+    DateRangeForm, AsOfForm
+from .imports import import_rows, read_rows, text_stream
+from .jobs import JOB_KINDS, enqueue, job_path
+from .pagination import paginate
+from .profiling import latest_profiles, profile_directory
+from .payments import post_payment
+from .statements import Statement
+from .streaming import stream_list
+from .search import search_customers as search_customers_fts, search_orders as search_orders_fts, \
+    search_products as search_products_fts
 
 
 def home(request):
@@ -12,28 +36,33 @@ def about(request):
     return render(request, 'sales/about.html', {'title': 'About Our Sales'})
 
 
-def customer(request):
+def _list_page(request, name, queryset, keys, title):
+    """
+    The keyset paginated list page of `name`s, or all of them streamed in one response with ?stream=1
+    """
+    template_name = f'sales/{name}.html'
+    if request.GET.get('stream'):
+        rows = stream_list(request, template_name, f'sales/rows/{name}.html', name, queryset, keys, {'title': title})
+        return StreamingHttpResponse(rows, content_type='text/html; charset=utf-8')
+    page = paginate(request, queryset, keys)
     context = {
-        'customers': Customer.objects.all(),
-        'title': 'Customers'
+        f'{name}s': page,
+        'page': page,
+        'title': title
     }
-    return render(request, 'sales/customer.html', context)
+    return render(request, template_name, context)
+
+
+def customer(request):
+    return _list_page(request, 'customer', Customer.objects.with_balances(), ['id'], 'Customers')
 
 
 def order(request):
-    context = {
-        'orders': Order.objects.all(),
-        'title': 'Orders'
-    }
-    return render(request, 'sales/order.html', context)
+    return _list_page(request, 'order', Order.objects.with_payment_totals(), ['date_bought', 'id'], 'Orders')
 
 
 def payment(request):
-    context = {
-        'payments': Payment.objects.all(),
-        'title': 'Payments'
-    }
-    return render(request, 'sales/payment.html', context)
+    return _list_page(request, 'payment', Payment.objects.with_related(), ['date_paid', 'id'], 'Payments')
 
 
 def customer_registration(request):
@@ -65,9 +94,271 @@ def payment_accept(request):
     if request.method == 'POST':
         form = PaymentAcceptForm(request.POST)
         if form.is_valid():
-            form.save()
-            messages.success(request, f'Successfully accepted payment!')
-            return redirect('sales-payment')
+            data = form.cleaned_data
+            try:
+                _, created = post_payment(
+                    data['order'].pk, data['customer'].pk, data['payment_type'], data['payment_amount'],
+                    data['idempotency_key'],
+                )
+            except ValidationError as error:
+                form.add_error(None, error)
+            else:
+                if created:
+                    messages.success(request, f'Successfully accepted payment!')
+                else:
+                    messages.info(request, f'This payment had already been accepted.')
+                return redirect('sales-payment')
     else:
         form = PaymentAcceptForm()
     return render(request, 'sales/payment_accept.html', {'form': form, 'title': 'New Payment'})
+
+
+def search(request):
+    term = request.GET.get('q', '').strip()
+    limit = settings.SALES_SEARCH_RESULTS
+    context = {
+        'q': term,
+        'customers': search_customers_fts(term, limit) if term else [],
+        'products': search_products_fts(term, limit) if term else [],
+        'orders': search_orders_fts(term, limit) if term else [],
+        'title': f'Search: {term}' if term else 'Search',
+    }
+    return render(request, 'sales/search.html', context)
+
+
+def autocomplete(request, kind):
+    """
+    The top matches of ?q= as JSON, for the customer and order pickers. Orders are the open orders of ?customer=
+    """
+    term, limit = request.GET.get('q', ''), get_limit(request)
+    if kind == 'customers':
+        results = search_customers(term, limit)
+    elif kind == 'products':
+        results = search_products(term, limit)
+    elif kind == 'orders':
+        try:
+            customer_id = int(request.GET['customer'])
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest('?customer= must be a customer id')
+        results = search_orders(term, customer_id, limit)
+    else:
+        raise Http404('Unknown lookup')
+    return JsonResponse({'results': results})
+
+
+def export(request, kind):
+    """
+    Streams customers, orders or payments as CSV or JSONL, optionally filtered with ?start=&end= (dates, inclusive)
+    and ?customer=<id>
+    """
+    if kind not in EXPORTS:
+        raise Http404('Unknown export')
+    form = ExportFilterForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_json(), content_type='application/json')
+    filters = dict(form.cleaned_data)
+    export_format = filters.pop('format')
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(stream_export(kind, export_format, **filters), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{export_format}"'
+    return response
+
+
+def sales_import(request):
+    report = None
+    if request.method == 'POST':
+        form = ImportUploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            rows = read_rows(text_stream(form.cleaned_data['file']), form.cleaned_data['format'])
+            report = import_rows(form.cleaned_data['kind'], rows)
+            if report.created:
+                messages.success(request, f'Successfully imported {report.created} {form.cleaned_data["kind"]}!')
+    else:
+        form = ImportUploadForm()
+    context = {'form': form, 'report': report, 'title': 'Import Orders and Payments'}
+    return render(request, 'sales/import.html', context)
+
+
+def reports(request):
+    """
+    Revenue per day and product and payments per day and type, read only from the daily rollup tables, so the cost
+    depends on the number of days in the range rather than the number of orders. Defaults to the last 30 days
+    """
+    form = DateRangeForm(request.GET)
+    today = timezone.localdate()
+    start, end = today - datetime.timedelta(days=29), today
+    if form.is_valid():
+        start = form.cleaned_data['start'] or start
+        end = form.cleaned_data['end'] or end
+    sales = DailyProductSales.objects.filter(date__range=(start, end))
+    payments = DailyPaymentTotals.objects.filter(date__range=(start, end))
+    context = {
+        'form': form,
+        'start': start,
+        'end': end,
+        'sales_by_day': sales.values('date').annotate(orders=Sum('count'), revenue=Sum('amount')).order_by('date'),
+        'sales_by_product': sales.values('product', name=F('product__name')).annotate(
+            orders=Sum('count'), revenue=Sum('amount')).order_by('-revenue'),
+        'payments_by_day': payments.values('date', 'payment_type').annotate(
+            payments=Sum('count'), total=Sum('amount')).order_by('date', 'payment_type'),
+        'payments_by_type': payments.values('payment_type').annotate(
+            payments=Sum('count'), total=Sum('amount')).order_by('payment_type'),
+        'title': 'Sales Reports',
+    }
+    return render(request, 'sales/reports.html', context)
+
+
+def _as_of(request):
+    form = AsOfForm(request.GET)
+    return (form.is_valid() and form.cleaned_data['as_of']) or timezone.localdate()
+
+
+def aging(request):
+    """
+    Outstanding balances per customer bucketed by the age of the unpaid orders, largest first. The page shows the
+    first SALES_AGING_ROWS customers, the CSV export has all of them
+    """
+    as_of = _as_of(request)
+    limit = settings.SALES_AGING_ROWS
+    context = {
+        'as_of': as_of,
+        'buckets': AGING_BUCKETS,
+        'rows': list(aging_by_customer(as_of, limit)),
+        'totals': aging_totals(as_of),
+        'limit': limit,
+        'title': 'Accounts Receivable Aging',
+    }
+    return render(request, 'sales/aging.html', context)
+
+
+def aging_csv(request):
+    as_of = _as_of(request)
+    response = StreamingHttpResponse(stream_aging_csv(as_of), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="aging-{as_of}.csv"'
+    return response
+
+
+def aging_customer(request, customer_id):
+    as_of = _as_of(request)
+    customer = get_object_or_404(Customer, pk=customer_id)
+    context = {
+        'as_of': as_of,
+        'customer': customer,
+        'orders': customer_open_orders(customer, as_of),
+        'title': f'Aging for {customer.full_name}',
+    }
+    return render(request, 'sales/aging_customer.html', context)
+
+
+def customer_statement(request, customer_id):
+    """
+    A customer's statement for ?start=&end= (dates, inclusive), by default the current month up to today
+    """
+    customer = get_object_or_404(Customer, pk=customer_id)
+    form = DateRangeForm(request.GET)
+    end = timezone.localdate()
+    start = end.replace(day=1)
+    if form.is_valid():
+        start = form.cleaned_data['start'] or start
+        end = form.cleaned_data['end'] or end
+    if start > end:
+        return HttpResponseBadRequest('The start date must not be after the end date.')
+    context = {
+        'form': form,
+        'statement': Statement(customer, start, end),
+        'title': f'Statement for {customer.full_name}',
+    }
+    return render(request, 'sales/statement.html', context)
+
+
+def _jobs_page(request, forms):
+    context = {
+        'kinds': [(kind, JOB_KINDS[kind].label, form) for kind, form in forms.items()],
+        'jobs': Job.objects.order_by('-pk')[:20],
+        'title': 'Background Jobs',
+    }
+    return render(request, 'sales/jobs.html', context)
+
+
+def jobs(request):
+    """
+    The latest jobs, and a form to queue a job of each kind
+    """
+    return _jobs_page(request, {kind: job_kind.form(prefix=kind) for kind, job_kind in JOB_KINDS.items()})
+
+
+@staff_member_required
+def job_enqueue(request, kind):
+    if kind not in JOB_KINDS:
+        raise Http404('Unknown job')
+    if request.method != 'POST':
+        return redirect('sales-jobs')
+    form = JOB_KINDS[kind].form(request.POST, request.FILES, prefix=kind)
+    if not form.is_valid():
+        forms = {other: job_kind.form(prefix=other) for other, job_kind in JOB_KINDS.items()}
+        return _jobs_page(request, dict(forms, **{kind: form}))
+    params = dict(form.cleaned_data)
+    job = enqueue(kind, params, upload=params.pop('file', None))
+    messages.success(request, f'Queued {JOB_KINDS[kind].label.lower()} as job {job.pk}.')
+    return redirect('sales-job', job.pk)
+
+
+def _job_status(job):
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'attempts': job.attempts,
+        'finished': job.finished,
+        'result_url': reverse('sales-job-result', args=[job.pk]) if job.result_file else None,
+    }
+
+
+def job(request, job_id):
+    job = get_object_or_404(Job, pk=job_id)
+    # a job of a kind the code no longer has is shown under its kind
+    job_kind = JOB_KINDS.get(job.kind)
+    context = {'job': job, 'label': job_kind.label if job_kind else job.kind, 'title': f'Job {job.pk}'}
+    return render(request, 'sales/job.html', context)
+
+
+def job_status(request, job_id):
+    """
+    The job's status and progress as JSON, polled by the job page while the job runs
+    """
+    return JsonResponse(_job_status(get_object_or_404(Job, pk=job_id)))
+
+
+@staff_member_required
+def job_result(request, job_id):
+    job = get_object_or_404(Job, pk=job_id)
+    if not job.result_file:
+        raise Http404('The job has no result file')
+    return FileResponse(open(job_path(job.result_file), 'rb'), as_attachment=True)
+
+
+def cache_stats(request):
+    return JsonResponse(fragment_cache_stats())
+
+
+@staff_member_required
+def profiles(request):
+    """
+    The kept profiles of each URL name, newest first
+    """
+    return render(request, 'sales/profiles.html', {'title': 'Profiles', 'profiles': sorted(latest_profiles().items())})
+
+
+PROFILE_FILE_TYPES = {'svg': 'image/svg+xml', 'collapsed': 'text/plain; charset=utf-8'}
+
+
+@staff_member_required
+def profile_file(request, url_name, stamp, extension):
+    if extension not in PROFILE_FILE_TYPES:
+        raise Http404('Unknown profile file type')
+    path = os.path.join(profile_directory(url_name), f'{os.path.basename(stamp)}.{extension}')
+    if not os.path.exists(path):
+        raise Http404('No such profile')
+    return FileResponse(open(path, 'rb'), content_type=PROFILE_FILE_TYPES[extension])
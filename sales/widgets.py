@@ -0,0 +1,27 @@
+from django import forms
+from django.urls import reverse
+
+
+class AutocompleteInput(forms.TextInput):
+    """
+    A text input for a model id that suggests matches from the sales-autocomplete endpoint as the user types
+    (sales/static/sales/autocomplete.js), instead of rendering every row of the table as a <select> option.
+    `depends_on` names another field of the form whose value is sent along as a filter
+    """
+    template_name = 'sales/widgets/autocomplete.html'
+
+    def __init__(self, kind, depends_on=None, attrs=None):
+        attrs = {'autocomplete': 'off', 'inputmode': 'search', **(attrs or {})}
+        super().__init__(attrs)
+        self.kind = kind
+        self.depends_on = depends_on
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        widget_attrs = context['widget']['attrs']
+        widget_attrs['data-autocomplete-url'] = reverse('sales-autocomplete', args=[self.kind])
+        if self.depends_on:
+            widget_attrs['data-autocomplete-depends-on'] = self.depends_on
+        if widget_attrs.get('id'):
+            widget_attrs['list'] = f"{widget_attrs['id']}_options"
+        return context